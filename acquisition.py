@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+from __future__ import print_function
+
+import contextlib
+import functools
+import threading
+from time import perf_counter
+import traceback
+try:
+    from concurrent.futures import Future
+    from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+except:
+    pass
+
+import minimalmodbus
+
+import commandqueue
+import discovery
+import flasher
+import metrics
+import modbusrtu
+from rd60xx import RD6006
+from samplestore import SampleStore
+from utils import UnlockerCtx, emitter
+
+
+def parse_port_spec(spec):
+    # type: (str) -> Tuple[str, int]
+    """Split "port@address" into its parts; the address defaults to 1."""
+    port, sep, address = spec.rpartition("@")
+    if not sep or not address.isdigit():
+        return spec, 1
+    return port, int(address)
+
+def format_port_spec(port, address):
+    # type: (str, int) -> str
+    if address == 1:
+        return port
+    return "{}@{}".format(port, address)
+
+
+class AdaptivePolling(object):
+    """Poll fast while the output is moving and back off when it settles.
+
+    A change in V or A beyond threshold between successive samples drops the
+    interval straight to min_interval; every steady sample after that
+    stretches it by backoff, up to the device's normal polling interval.
+    """
+
+    def __init__(self, min_interval, threshold, backoff=1.5):
+        # type: (float, float, float) -> None
+        super(AdaptivePolling, self).__init__()
+        self.min_interval = min_interval
+        self.threshold = threshold
+        self.backoff = backoff
+
+    def next_interval(self, interval, idle_interval, dv, da):
+        # type: (float, float, float, float) -> float
+        if abs(dv) > self.threshold or abs(da) > self.threshold:
+            return self.min_interval
+        return min(max(interval, self.min_interval) * self.backoff, idle_interval)
+
+
+class Device(object):
+    """One power supply: its connection, sample buffers and poll schedule."""
+
+    # seconds to wait before polling a device again after an error,
+    # doubling with each further failure up to MAX_RETRY_INTERVAL
+    RETRY_INTERVAL = 0.25
+    MAX_RETRY_INTERVAL = 10.0
+    # consecutive Modbus failures after which the port is reopened
+    MAX_FAILURES = 3
+    # weight of the newest interval in the achieved sample rate average
+    RATE_SMOOTHING = 0.1
+    # polled by another process; see sharedacquisition.RemoteDevice
+    remote = False
+
+    def __init__(self, port, polling_interval, graph_seconds, mock=False, address=1):
+        # type: (str, float, float, bool, int) -> None
+        super(Device, self).__init__()
+        self.port = port
+        self.address = address
+        self.mock = mock
+        self.stats = metrics.LinkStats(metrics.registry, str(self))
+        self.poll_jitter = metrics.registry.histogram(str(self) + "/poll_jitter")
+        self.lock_wait = metrics.registry.histogram(str(self) + "/lock_wait")
+        self.rd = None # type: RD6006
+        # how to find the device again if its adapter is re-enumerated
+        self.hwid = None # type: str
+        self.serial_number = None # type: int
+        # link speed last found, tried first when reconnecting
+        self.baudrate = None # type: int
+        # switch the link to the fastest rate that works when connecting
+        self.upgrade_baudrate = False
+        self.manager = None # type: DeviceManager
+        # consecutive failed polls
+        self.failures = 0
+        self._connected = False
+        # called on the I/O thread when polling succeeds again after a failure
+        self.on_reconnect = None # type: Callable[[Device], None]
+        # called on the I/O thread with (device, t, V, A) for every sample
+        # stored, NaN for gaps; replaced as a whole, never mutated
+        self.listeners = () # type: Tuple[Callable[[Device, float, float, float], None], ...]
+        # held around any serial I/O with this device
+        self.lock = threading.Lock()
+        self.worker = None # type: PortWorker
+        self.polling_interval = polling_interval
+        self.graph_seconds = graph_seconds
+        self.adaptive = None # type: AdaptivePolling
+        # interval actually used for the next poll
+        self.interval = polling_interval
+        self.next_poll = perf_counter()
+        self.error = None # type: BaseException
+        self._last_sample = None # type: float
+        self._last_va = None # type: Tuple[float, float]
+        self._mean_interval = None # type: float
+        # written only by the I/O thread, read lock-free by the plot
+        self.samples = SampleStore(self.graph_seconds)
+        if mock:
+            self._vgen = emitter()
+            self._agen = emitter()
+
+    def __str__(self):
+        return format_port_spec(self.port, self.address)
+
+    @property
+    def achieved_rate(self):
+        # type: () -> float
+        """Smoothed samples per second actually taken from this device."""
+        mean = self._mean_interval
+        if not mean:
+            return 0.
+        return 1. / mean
+
+    def configure(self, polling_interval=None, graph_seconds=None, adaptive=False, upgrade_baudrate=None):
+        # type: (float, float, AdaptivePolling, bool) -> None
+        """Change settings; adaptive=None turns adaptive polling off."""
+        if upgrade_baudrate is not None:
+            self.upgrade_baudrate = upgrade_baudrate
+        if polling_interval is not None:
+            self.polling_interval = polling_interval
+        if graph_seconds is not None:
+            self.graph_seconds = graph_seconds
+        if adaptive is not False:
+            self.adaptive = adaptive
+        if self.adaptive is None:
+            self.interval = self.polling_interval
+        else:
+            self.interval = min(self.interval, self.polling_interval)
+        self.samples.set_retention(self.graph_seconds)
+        if self.worker is not None:
+            self.worker.wake()
+
+    def connect(self):
+        """(Re)open the connection.  Call with lock held."""
+        self._close()
+        if self._connected:
+            # a USB reset can bring the adapter back under another name
+            port = discovery.locate(self.port, self.hwid, self.serial_number, self.address, self._ports_in_use())
+            if port is None:
+                raise IOError("{} not found".format(self))
+            self.port = port
+        # minimalmodbus shares one serial.Serial between instruments on the
+        # same port, so every address on a bus talks through one connection,
+        # and at one speed
+        bus = self._open_bus()
+        if bus is not None:
+            baudrate = bus.baudrate
+        else:
+            baudrate = discovery.detect_baudrate(self.port, self.address, self.baudrate)
+            if baudrate is None:
+                raise IOError("No RD60xx answering on {}".format(self))
+        self.rd = RD6006(self.port, self.address, baudrate=baudrate, bus_timing=self.worker.bus_timing, stats=self.stats)
+        if not self.rd.in_bootloader:
+            if self.upgrade_baudrate and bus is None and len(self.worker.devices) == 1:
+                # changing speed on a shared bus would strand the other slaves
+                baudrate = self.rd.upgrade_baudrate()
+            self.rd.tune_timeout()
+        self.baudrate = baudrate
+        self._connected = True
+        self.serial_number = self.rd.sn
+        if self.hwid is None:
+            self.hwid = discovery.hwid_of(self.port)
+
+    def _open_bus(self):
+        """The serial port another device on this port already has open, if any."""
+        for d in self.worker.devices:
+            if d is not self and d.rd is not None and d.rd.instrument.serial.is_open:
+                return d.rd.instrument.serial
+        return None
+
+    def _ports_in_use(self):
+        # type: () -> List[str]
+        """Ports other workers are talking to, which must not be probed."""
+        if self.manager is None:
+            return []
+        return [d.port for d in list(self.manager.devices) if d.worker is not self.worker]
+
+    def disconnect(self):
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if self.rd is None:
+            return
+        serial = self.rd.instrument.serial
+        self.rd = None
+        # leave the port open for other slaves on the bus
+        if not any(d.rd is not None and d.rd.instrument.serial is serial for d in self.worker.devices):
+            try:
+                serial.close()
+            except (IOError, OSError):
+                # the adapter is already gone
+                pass
+
+    def submit(self, fn, key=None, delay=0.):
+        # type: (Callable[[RD6006], Any], Hashable, float) -> Future
+        """Queue fn(rd) to run on the I/O thread ahead of the next poll."""
+        if key is not None:
+            key = (self, key)
+        return self.worker.commands.submit(functools.partial(self._execute, fn),
+                                           commandqueue.PRIORITY_USER, key, delay)
+
+    def flash_firmware(self, size, chunks, progress=None):
+        # type: (int, Iterable[bytes], Callable[[flasher.Progress], None]) -> Future
+        """Queue a firmware update of the device; see flasher.flash."""
+        def flash(rd):
+            # type: (RD6006) -> None
+            try:
+                flasher.flash(rd, size, chunks, progress)
+            finally:
+                # identify the new firmware afresh on the next poll
+                self._close()
+        return self.submit(flash)
+
+    def _execute(self, fn):
+        # type: (Callable[[RD6006], Any]) -> Any
+        with self._locked():
+            if self.rd is None and not self.mock:
+                self.connect()
+            return fn(self.rd)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Acquire lock, recording how long that took."""
+        t = perf_counter()
+        with self.lock:
+            self.lock_wait.record(perf_counter() - t)
+            yield
+
+    def poll(self):
+        """Take one sample.  Called on the I/O thread."""
+        start = t = perf_counter()
+        # how late this poll is relative to its schedule
+        self.poll_jitter.record(max(start - self.next_poll, 0.))
+        try:
+            if self.mock:
+                v = next(self._vgen)
+                a = next(self._agen)
+            else:
+                with self._locked():
+                    if self.rd is None:
+                        self.connect()
+                    # one transaction per cycle; reads of other status
+                    # registers are served from this image
+                    self.rd.snapshot(self.interval)
+                    v, a = self.rd.measvoltagecurrent
+                # the readings were taken somewhere during the round trip
+                t = (start + perf_counter()) / 2
+        except Exception as e:
+            self._failed(start, e)
+            return
+        self.error = None
+        if self.failures:
+            self.failures = 0
+            if self.on_reconnect is not None:
+                self.on_reconnect(self)
+        if self.adaptive is not None and self._last_va is not None:
+            self.interval = self.adaptive.next_interval(
+                self.interval, self.polling_interval, v - self._last_va[0], a - self._last_va[1])
+        self._last_va = (v, a)
+        if self._last_sample is not None:
+            interval = t - self._last_sample
+            if self._mean_interval is None:
+                self._mean_interval = interval
+            else:
+                self._mean_interval += self.RATE_SMOOTHING * (interval - self._mean_interval)
+        self._last_sample = t
+        self.samples.append(t, v, a)
+        self._publish(t, v, a)
+        self.next_poll = start + self.interval
+
+    def _publish(self, t, v, a):
+        # type: (float, float, float) -> None
+        for listener in self.listeners:
+            try:
+                listener(self, t, v, a)
+            except Exception:
+                # a broken consumer mustn't stop acquisition
+                traceback.print_exc()
+
+    def _failed(self, t, e):
+        # type: (float, Exception) -> None
+        """Back off after a failed poll, reopening the port if the link looks lost."""
+        if not self.failures:
+            traceback.print_exc()
+            # break the plotted line instead of joining across the outage
+            self.samples.append_gap(t)
+            self._publish(t, float('nan'), float('nan'))
+        self.failures += 1
+        self.error = e
+        # anything but a Modbus-level error means the port itself failed
+        modbus_error = isinstance(e, (modbusrtu.ModbusError, minimalmodbus.ModbusException))
+        if not modbus_error or self.failures >= self.MAX_FAILURES:
+            with self.lock:
+                self._close()
+        self.next_poll = t + min(self.RETRY_INTERVAL * 2 ** min(self.failures - 1, 16), self.MAX_RETRY_INTERVAL)
+
+
+class PortWorker(threading.Thread):
+    """I/O thread for one serial port, which may be a multi-drop bus.
+
+    Polls its devices on their own schedules, always serving the most
+    overdue one next so slaves with the same rate take turns, and runs
+    queued commands ahead of any poll that is due.
+    """
+
+    def __init__(self, port, after=None):
+        # type: (str, Optional[PortWorker]) -> None
+        super(PortWorker, self).__init__(name="PortWorker({})".format(port))
+        self.daemon = True
+        self.port = port
+        # a retiring worker for the same port, to let go of it first
+        self.after = after
+        self.devices = [] # type: List[Device]
+        self.cond = threading.Condition(threading.Lock())
+        self.commands = commandqueue.CommandQueue(self.cond)
+        self.bus_timing = modbusrtu.BusTiming()
+        self._shutdown = False
+
+    def add(self, device):
+        # type: (Device) -> None
+        with self.cond:
+            self.devices.append(device)
+            device.worker = self
+            self.cond.notify()
+
+    def remove(self, device):
+        # type: (Device) -> None
+        with self.cond:
+            self.devices.remove(device)
+
+    def achieved_rates(self):
+        # type: () -> Dict[int, float]
+        """Samples per second achieved for each slave address on the bus."""
+        with self.cond:
+            return dict((d.address, d.achieved_rate) for d in self.devices)
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify()
+
+    def shutdown(self):
+        with self.cond:
+            self._shutdown = True
+            self.cond.notify()
+        self.join()
+
+    def retire(self, device, stop=False):
+        # type: (Device, bool) -> None
+        """Disconnect a removed device on the I/O thread once the commands
+        queued before have run, then exit the thread if stop.  Doesn't wait
+        for any of it."""
+        def retire():
+            device.disconnect()
+            if stop:
+                with self.cond:
+                    self._shutdown = True
+        self.commands.submit(retire, commandqueue.PRIORITY_BACKGROUND)
+
+    def run(self):
+        if self.after is not None:
+            self.after.join()
+            self.after = None
+        with self.cond:
+            while not self._shutdown:
+                cmd = self.commands.pop()
+                if cmd is not None:
+                    with UnlockerCtx(self.cond):
+                        cmd.run(lambda fn: fn())
+                    continue
+                now = perf_counter()
+                device = min(self.devices, key=lambda d: d.next_poll) if self.devices else None
+                due = min(device.next_poll if device else float('inf'), self.commands.next_due())
+                if now < due:
+                    self.cond.wait(due - now if due != float('inf') else None)
+                    continue
+                if device is None or device.next_poll > now:
+                    # a delayed command came due; pop it first
+                    continue
+                with UnlockerCtx(self.cond):
+                    device.poll()
+        self.commands.cancel_all()
+
+
+class DeviceManager(object):
+    """Opens power supplies and runs one PortWorker per serial port, so a
+    slow or missing device only holds up its own port."""
+
+    def __init__(self, polling_interval, graph_seconds):
+        # type: (float, float) -> None
+        super(DeviceManager, self).__init__()
+        self.polling_interval = polling_interval
+        self.graph_seconds = graph_seconds
+        self.adaptive = None # type: AdaptivePolling
+        self.upgrade_baudrate = False
+        self.devices = [] # type: List[Device]
+        # given to every device as its listeners; see subscribe()
+        self.listeners = () # type: Tuple[Callable[[Device, float, float, float], None], ...]
+        self._workers = {} # type: Dict[str, PortWorker]
+        # workers whose last device was closed, until their threads exit
+        self._retiring = {} # type: Dict[str, PortWorker]
+        self._lock = threading.Lock()
+
+    def open(self, port, address=1, mock=False):
+        # type: (str, int, bool) -> Device
+        """Start polling the device at address on port.
+
+        Devices on the same port share its serial connection and worker.
+        Connects on the I/O thread.
+        """
+        with self._lock:
+            for device in self.devices:
+                if device.port == port and device.address == address:
+                    return device
+            device = Device(port, self.polling_interval, self.graph_seconds, mock, address)
+            device.manager = self
+            device.listeners = self.listeners
+            device.configure(adaptive=self.adaptive, upgrade_baudrate=self.upgrade_baudrate)
+            worker = self._workers.get(port)
+            if worker is None:
+                retiring = self._retiring.pop(port, None)
+                if retiring is not None and not retiring.is_alive():
+                    retiring = None
+                worker = self._workers[port] = PortWorker(port, after=retiring)
+                worker.start()
+            worker.add(device)
+            self.devices.append(device)
+            return device
+
+    def close(self, device):
+        # type: (Device) -> None
+        """Stop polling device.  It is disconnected, and its worker stopped
+        if it was the last on the port, on the I/O thread, so this returns
+        straight away even if the port is busy."""
+        with self._lock:
+            self.devices.remove(device)
+            worker = device.worker
+            worker.remove(device)
+            stop = not worker.devices
+            if stop:
+                del self._workers[worker.port]
+                self._retiring[worker.port] = worker
+        worker.retire(device, stop)
+
+    def configure(self, polling_interval=None, graph_seconds=None, adaptive=False, upgrade_baudrate=None):
+        # type: (float, float, AdaptivePolling, bool) -> None
+        """upgrade_baudrate takes effect the next time a device connects."""
+        with self._lock:
+            if polling_interval is not None:
+                self.polling_interval = polling_interval
+            if graph_seconds is not None:
+                self.graph_seconds = graph_seconds
+            if adaptive is not False:
+                self.adaptive = adaptive
+            if upgrade_baudrate is not None:
+                self.upgrade_baudrate = upgrade_baudrate
+            devices = list(self.devices)
+        for device in devices:
+            device.configure(polling_interval, graph_seconds, adaptive, upgrade_baudrate)
+
+    def subscribe(self, listener):
+        # type: (Callable[[Device, float, float, float], None]) -> None
+        """Call listener(device, t, V, A) on the I/O threads for every sample
+        from every device, present and future.  It must not block."""
+        with self._lock:
+            self.listeners += (listener,)
+            for device in self.devices:
+                device.listeners = self.listeners
+
+    def unsubscribe(self, listener):
+        # type: (Callable[[Device, float, float, float], None]) -> None
+        with self._lock:
+            self.listeners = tuple(l for l in self.listeners if l != listener)
+            for device in self.devices:
+                device.listeners = self.listeners
+
+    def shutdown(self):
+        """Close every device and wait for the I/O threads to exit."""
+        for device in list(self.devices):
+            self.close(device)
+        with self._lock:
+            workers = list(self._retiring.values())
+            self._retiring = {}
+        for worker in workers:
+            worker.join()
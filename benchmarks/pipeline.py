@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Microbenchmarks of the sample pipeline and the plot update path.
+
+Sweeps plot spans and poll intervals, so sample buffers from hundreds to
+hundreds of thousands of points, and for each measures the cost of storing
+a sample, of polling (mock device), of one StripChart frame (fetch plot
+data, set line data, blit over the cached background) drawn headlessly by
+its StripFigure on an Agg canvas, and of mapping a cursor position.  Also reports allocations
+per frame, the memory held by the sample store, peak memory, and the loop
+rate of a PortWorker polling a mock device flat out.
+
+Results can be saved as a baseline and later runs compared against it:
+
+    $ python benchmarks/pipeline.py --save baseline.json
+    $ python benchmarks/pipeline.py --compare baseline.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from time import perf_counter
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    from typing import Any, Dict, List
+except:
+    pass
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+
+import acquisition
+from samplestore import SampleStore
+from stripfigure import StripFigure
+
+
+GRAPH_SECONDS = (60, 600)
+POLL_INTERVALS = (0.1, 0.01, 0.001)
+FRAMES = 200
+# metrics where a larger number is worse, compared against a baseline
+COMPARED = ("append_us", "poll_us", "frame_ms", "frame_alloc_kb", "cursor_us", "store_mb")
+
+
+def _median(samples):
+    # type: (List[float]) -> float
+    return float(np.median(samples))
+
+
+def _fill(store, samples, interval):
+    # type: (SampleStore, int, float) -> float
+    """Append samples of a noisy waveform ending now; return seconds per append."""
+    t0 = perf_counter() - samples * interval
+    v = 12 + np.sin(np.arange(samples) / 50.) + np.random.normal(0, 0.01, samples)
+    a = v / 10
+    append = store.append
+    start = perf_counter()
+    for i in range(samples):
+        append(t0 + i * interval, v[i], a[i])
+    return (perf_counter() - start) / samples
+
+
+def _store_bytes(store):
+    # type: (SampleStore) -> int
+    """Bytes held by store's arrays, its min/max pyramid included."""
+    stores = [store] + (store.pyramid.levels if store.pyramid is not None else [])
+    return sum(s._published[0].nbytes for s in stores)
+
+
+def bench_case(graph_seconds, interval, frames):
+    # type: (float, float, int) -> Dict[str, Any]
+    samples = int(graph_seconds / interval)
+    result = {"graph_seconds": graph_seconds, "polling_interval": interval, "samples": samples}
+
+    charted = acquisition.Device("mock", interval, graph_seconds, mock=True)
+    store = charted.samples
+    result["append_us"] = _fill(store, samples, interval) * 1e6
+    result["store_mb"] = _store_bytes(store) / 1e6
+
+    device = acquisition.Device("mock", interval, graph_seconds, mock=True)
+    polls = min(samples, 20000)
+    start = perf_counter()
+    for _ in range(polls):
+        device.poll()
+    result["poll_us"] = (perf_counter() - start) / polls * 1e6
+
+    chart = StripFigure(FigureCanvasAgg, graph_seconds, 60, 6)
+    chart.add_trace(charted)
+    chart.figure.tight_layout()
+    chart.canvas.draw()
+    now = perf_counter()
+    times = []
+    for i in range(frames):
+        # a new sample every frame, as when polling faster than drawing
+        now += interval
+        store.append(now, 12., 1.2)
+        start = perf_counter()
+        chart.render(now)
+        times.append(perf_counter() - start)
+    result["frame_ms"] = _median(times) * 1e3
+
+    # traced separately, as tracing slows everything down
+    tracemalloc.start()
+    allocated = []
+    for i in range(min(frames, 50)):
+        now += interval
+        store.append(now, 12., 1.2)
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        chart.render(now)
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    result["frame_alloc_kb"] = _median(allocated) / 1e3
+
+    values_at = chart.values_at
+    start = perf_counter()
+    for i in range(1000):
+        values_at(100 + i % 400, 200, chart.vaxis, 0.)
+    result["cursor_us"] = (perf_counter() - start) * 1e3
+    return result
+
+
+def bench_worker(seconds=1.0):
+    # type: (float) -> Dict[str, Any]
+    """Samples per second of a PortWorker polling a mock device with no delay."""
+    device = acquisition.Device("mock", 0., 60, mock=True)
+    worker = acquisition.PortWorker("mock")
+    worker.add(device)
+    worker.start()
+    time.sleep(seconds)
+    worker.shutdown()
+    rate = device.samples.seq / seconds
+    return {"polls_per_s": rate, "loop_us": 1e6 / rate if rate else None}
+
+
+def compare(results, baseline, tolerance):
+    # type: (Dict[str, Any], Dict[str, Any], float) -> List[str]
+    """Lines describing each metric that got worse than baseline by more than tolerance."""
+    regressions = []
+    old_cases = dict(((c["graph_seconds"], c["polling_interval"]), c) for c in baseline.get("cases", ()))
+    for case in results["cases"]:
+        old = old_cases.get((case["graph_seconds"], case["polling_interval"]))
+        if old is None:
+            continue
+        for key in COMPARED:
+            if old.get(key) and case[key] > old[key] * (1 + tolerance):
+                regressions.append("{}s @ {}s: {} {:.3f} -> {:.3f} (+{:.0f}%)".format(
+                    case["graph_seconds"], case["polling_interval"], key,
+                    old[key], case[key], (case[key] / old[key] - 1) * 100))
+    old_loop = baseline.get("worker", {}).get("loop_us")
+    new_loop = results["worker"]["loop_us"]
+    if old_loop and new_loop and new_loop > old_loop * (1 + tolerance):
+        regressions.append("worker: loop_us {:.3f} -> {:.3f} (+{:.0f}%)".format(
+            old_loop, new_loop, (new_loop / old_loop - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--graph-seconds", type=float, nargs="+", default=GRAPH_SECONDS)
+    parser.add_argument("--polling-interval", type=float, nargs="+", default=POLL_INTERVALS)
+    parser.add_argument("--frames", type=int, default=FRAMES)
+    parser.add_argument("--save", metavar="PATH", help="write results to PATH as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against the baseline at PATH")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown tolerated before --compare fails")
+    args = parser.parse_args()
+
+    results = {"cases": [], "python": sys.version.split()[0],
+               "numpy": np.__version__, "matplotlib": matplotlib.__version__}
+    print("{:>8} {:>8} {:>9} {:>9} {:>8} {:>9} {:>10} {:>9} {:>8}".format(
+        "span s", "poll s", "samples", "append", "poll", "frame", "frame alloc", "cursor", "store"))
+    for graph_seconds in args.graph_seconds:
+        for interval in args.polling_interval:
+            case = bench_case(graph_seconds, interval, args.frames)
+            results["cases"].append(case)
+            print("{graph_seconds:>8g} {polling_interval:>8g} {samples:>9d} {append_us:>7.2f}µs "
+                  "{poll_us:>6.2f}µs {frame_ms:>7.3f}ms {frame_alloc_kb:>8.1f}kB "
+                  "{cursor_us:>7.2f}µs {store_mb:>6.1f}MB".format(**case))
+            sys.stdout.flush()
+    results["worker"] = bench_worker()
+    print("worker: {polls_per_s:.0f} polls/s, {loop_us:.2f}µs per loop".format(**results["worker"]))
+    if resource is not None:
+        # kilobytes on Linux, bytes on macOS
+        scale = 1e6 if sys.platform == "darwin" else 1e3
+        results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+        print("peak RSS: {:.1f}MB".format(results["peak_rss_mb"]))
+
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as fh:
+            regressions = compare(results, json.load(fh), args.tolerance)
+        for line in regressions:
+            print("regression: " + line, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Measure rdgui startup: time to import, to show the window, to draw the
+first plot frame and to take the first sample.
+
+Runs against the mock device unless --port is given, with settings kept in
+a throwaway config file so the user's configuration is left alone.  Prints
+one JSON object of seconds since the script started, along with which of
+the lazily imported modules were loaded before the window appeared, and
+exits non-zero if the window took longer than --budget to appear.
+
+    $ python benchmarks/startup.py [--backend wx] [--port /dev/ttyUSB0]
+"""
+
+from __future__ import print_function
+
+from time import perf_counter
+STARTED = perf_counter()
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# modules rdgui only imports when the feature needing them is used
+DEFERRED = ("matplotlib", "sharedacquisition", "streamserver", "recording", "fwcache", "urllib.request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("matplotlib", "wx"), default="matplotlib")
+    parser.add_argument("--port", help="port spec (port[@address]) of a real device")
+    parser.add_argument("--budget", type=float, default=1.0,
+                        help="seconds allowed until the window is shown")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    import wx
+    import rdgui
+    imported = perf_counter()
+    timings = {"import": imported - STARTED}
+    config_path = os.path.join(tempfile.mkdtemp(), "rdgui-startup.ini")
+
+    class BenchmarkApp(rdgui.App):
+        def OnInit(self):
+            cfg = wx.FileConfig(localFilename=config_path, style=wx.CONFIG_USE_LOCAL_FILE)
+            cfg.WriteBool("mock_data", not args.port)
+            cfg.Write("port", args.port or "")
+            cfg.Write("plot_backend", args.backend)
+            wx.Config.Set(cfg)
+            return super(BenchmarkApp, self).OnInit()
+
+    app = BenchmarkApp(False)
+    timings["shown"] = perf_counter() - STARTED
+    timings["loaded_before_shown"] = [name for name in DEFERRED if name in sys.modules]
+    frame = app.GetTopWindow() # type: rdgui.CanvasFrame
+
+    def watch_samples():
+        # sample stores are lock-free, so just spin on their seq
+        deadline = perf_counter() + args.timeout
+        while perf_counter() < deadline:
+            if any(device.samples.seq for device in list(frame.manager.devices)):
+                timings["first_sample"] = perf_counter() - STARTED
+                return
+            time.sleep(0.001)
+    watcher = threading.Thread(target=watch_samples)
+    watcher.daemon = True
+    watcher.start()
+
+    def check():
+        if frame.first_frame_at is not None and not watcher.is_alive():
+            timings["first_frame"] = frame.first_frame_at - STARTED
+            frame.Close()
+        elif perf_counter() - STARTED > args.timeout:
+            frame.Close()
+        else:
+            wx.CallLater(10, check)
+    wx.CallLater(10, check)
+    app.MainLoop()
+
+    json.dump(timings, sys.stdout, indent=2, sort_keys=True)
+    print()
+    if "first_frame" not in timings or "first_sample" not in timings:
+        print("timed out", file=sys.stderr)
+        return 2
+    if timings["shown"] > args.budget:
+        print("window took {:.3f}s to show, budget {:.3f}s".format(timings["shown"], args.budget), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
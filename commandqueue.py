@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+from __future__ import print_function
+
+from concurrent.futures import Future
+import heapq
+import itertools
+import threading
+from time import perf_counter
+try:
+    from typing import Any, Callable, Dict, Hashable, List, Optional
+except:
+    pass
+
+
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 10
+
+
+class Command(object):
+    def __init__(self, fn, priority, due, key):
+        # type: (Callable[..., Any], int, float, Hashable) -> None
+        super(Command, self).__init__()
+        self.fn = fn
+        self.priority = priority
+        self.due = due
+        self.key = key
+        self.future = Future()
+
+    def run(self, executor):
+        # type: (Callable[[Callable[..., Any]], Any]) -> None
+        """Run fn via executor, completing the future with its outcome."""
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = executor(self.fn)
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+
+class CommandQueue(object):
+    """Prioritized queue of work for the serial I/O thread.
+
+    Commands with a lower priority number run first, FIFO within a
+    priority.  A command submitted with a key replaces the work of a
+    still-pending command with the same key, so a burst of writes to one
+    setting collapses into a single transaction with the latest value; all
+    submitters share the resulting future.
+    """
+
+    def __init__(self, cond=None):
+        # type: (threading.Condition) -> None
+        super(CommandQueue, self).__init__()
+        self.cond = cond if cond is not None else threading.Condition()
+        self._seq = itertools.count()
+        self._ready = [] # type: List[tuple]
+        self._delayed = [] # type: List[tuple]
+        self._pending = {} # type: Dict[Hashable, Command]
+
+    def submit(self, fn, priority=PRIORITY_USER, key=None, delay=0.):
+        # type: (Callable[..., Any], int, Hashable, float) -> Future
+        with self.cond:
+            if key is not None:
+                cmd = self._pending.get(key)
+                if cmd is not None:
+                    cmd.fn = fn
+                    return cmd.future
+            cmd = Command(fn, priority, perf_counter() + delay, key)
+            if key is not None:
+                self._pending[key] = cmd
+            if delay > 0:
+                heapq.heappush(self._delayed, (cmd.due, next(self._seq), cmd))
+            else:
+                heapq.heappush(self._ready, (priority, next(self._seq), cmd))
+            self.cond.notify()
+            return cmd.future
+
+    def pop(self):
+        # type: () -> Optional[Command]
+        """Return the next runnable command, or None.  Call with cond held."""
+        now = perf_counter()
+        while self._delayed and self._delayed[0][0] <= now:
+            cmd = heapq.heappop(self._delayed)[2]
+            heapq.heappush(self._ready, (cmd.priority, next(self._seq), cmd))
+        if not self._ready:
+            return None
+        cmd = heapq.heappop(self._ready)[2]
+        if cmd.key is not None:
+            del self._pending[cmd.key]
+        return cmd
+
+    def next_due(self):
+        # type: () -> float
+        """perf_counter() time of the earliest delayed command, or inf."""
+        if self._ready:
+            return perf_counter()
+        if self._delayed:
+            return self._delayed[0][0]
+        return float('inf')
+
+    def cancel_all(self):
+        with self.cond:
+            for entry in itertools.chain(self._ready, self._delayed):
+                entry[2].future.cancel()
+            self._ready = []
+            self._delayed = []
+            self._pending = {}
@@ -4,6 +4,7 @@
 from __future__ import print_function
 
 import collections
+import traceback
 try:
     from typing import Dict, Any
 except:
@@ -16,15 +17,9 @@ class ConfigChangeHandler(object):
     def __init__(self):
         super(ConfigChangeHandler, self).__init__()
 
-    def OnConfigChangeBegin(self):
-        pass
-
-    def OnConfigChanged(self, name, oldvalue, newvalue):
-        # type: (str, Any, Any) -> None
-        pass
-
     def OnConfigChangeEnd(self, updates):
         # type: (Dict[str, Any]) -> None
+        """Called once per Save with the new value of each changed setting."""
         pass
 
 
@@ -44,23 +39,53 @@ class Config(object):
         'polling_interval': _TypeDefault(float, 0.25),
         'graph_seconds': _TypeDefault(float, 60.0),
         'voltage_range': _TypeDefault(float, 5.0),
-        'amperage_range': _TypeDefault(float, 1.0)
+        'amperage_range': _TypeDefault(float, 1.0),
+        'adaptive_polling': _TypeDefault(bool, False),
+        'adaptive_min_interval': _TypeDefault(float, 0.02),
+        'adaptive_threshold': _TypeDefault(float, 0.01),
+        # "matplotlib", or "wx" for the lightweight native plot
+        'plot_backend': _TypeDefault(str, "matplotlib"),
+        # JSON of the devices found behind each serial adapter, by hwid
+        'port_cache': _TypeDefault(str, "{}"),
+        # switch single-device ports to the fastest baud rate that works,
+        # from the next time each device connects
+        'upgrade_baudrate': _TypeDefault(bool, False),
+        # record every sample to disk, under record_directory if set
+        'record': _TypeDefault(bool, False),
+        'record_directory': _TypeDefault(str, ""),
+        # poll devices from separate processes through shared memory; the
+        # GUI then only monitors them.  Takes effect on restart
+        'acquisition_process': _TypeDefault(bool, False),
+        # serve live samples to other programs on this socket address, see
+        # streamserver.py; empty for off
+        'stream_address': _TypeDefault(str, "")
     }
 
+    # immutable view of every setting, safe to hand to other threads
+    Settings = collections.namedtuple('Settings', sorted(_props))
+
     def __init__(self):
         super(Config, self).__init__()
         self._config = wx.Config.Get() # type: wx.ConfigBase
         self._handlers = WeakSet() # type: WeakSet[ConfigChangeHandler]
         self._dirtyprops = {} # type: Dict[str, Any]
+        # the backend is only read here and Save replaces the snapshot as a
+        # whole, so it is safe to read from any thread
+        self.snapshot = self._Load() # type: Config.Settings
+
+    def _Load(self):
+        # type: () -> Config.Settings
+        values = {}
+        for name, p in self._props.items():
+            values[name] = p.typ(getattr(self._config, self._types[p.typ].readmethod)(name, p.default))
+        return self.Settings(**values)
 
     def __getattr__(self, name):
-        if name in self._dirtyprops:
-            return self._dirtyprops[name]
-        elif name in self._props:
-            p = self._props[name]
-            return getattr(self._config, self._types[p.typ].readmethod)(name, p.default)
-        else:
-            return super(Config, self).__getattr__(name)
+        # the last saved value: edits stay private to the GUI thread until
+        # Save commits them
+        if name in self._props:
+            return getattr(self.snapshot, name)
+        raise AttributeError(name)
 
     def __setattr__(self, name, value):
         if name in self._props:
@@ -77,29 +102,23 @@ class Config(object):
         self._handlers.remove(handler)
 
     def Save(self):
-        for handler in self._handlers:
-            try:
-                handler.OnConfigChangeBegin()
-            except:
-                pass
-
-        updates = self._dirtyprops
+        """Write the changed settings in one batch and notify handlers once."""
+        old = self.snapshot
+        updates = dict((name, value) for name, value in self._dirtyprops.items() if value != getattr(old, name))
         self._dirtyprops = {}
+        if not updates:
+            return
 
         for name, newvalue in sorted(updates.items()):
-            oldvalue = getattr(self, name)
             getattr(self._config, self._types[self._props[name].typ].writemethod)(name, newvalue)
-            for handler in self._handlers:
-                try:
-                    handler.OnConfigChanged(name, oldvalue, newvalue)
-                except:
-                    pass
+        self._config.Flush()
+        self.snapshot = old._replace(**updates)
 
-        for handler in self._handlers:
+        for handler in list(self._handlers):
             try:
                 handler.OnConfigChangeEnd(updates)
-            except:
-                pass
+            except Exception:
+                traceback.print_exc()
 
     def Revert(self):
         self._dirtyprops = {}
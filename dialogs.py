@@ -10,14 +10,17 @@ import wx.lib.dialogs
 import wx.xrc as xrc
 
 try:
-    from typing import Tuple
+    from concurrent.futures import Future
+    from typing import Any, Callable, Tuple
 except:
         pass
 
 import config
-from rd60xx import rdwrap
+import discovery
+import metrics
+from rd60xx import RD6006
 import rdgui_xrc
-from utils import appendlistitem
+from utils import appendlistitem, wx_future_callback
 
 # assume main module added our XmlResourceHandler
 
@@ -46,16 +49,77 @@ class WrappedMultiMessageDialog(wx.lib.dialogs.MultiMessageDialog):
 
 
 class DlgPortSelector(rdgui_xrc.xrcdlgPortSelector):
+    # list columns
+    COL_PORT = 0
+    COL_DEVICE = 1
+
     def __init__(self, parent):
         super(DlgPortSelector, self).__init__(parent)
         self.ctlComportList = self.ctlComportList # type: wx.ListCtrl
+        self.ctlAddress = self.ctlAddress # type: wx.SpinCtrl
         self.wxID_OK = self.wxID_OK # type: wx.Button
-        if wx.GetApp().config.mock_data:
-            appendlistitem(self.ctlComportList, "port", "desc", "hwid")
-        import serial.tools.list_ports
-        for port, desc, hwid in serial.tools.list_ports.comports():
-            appendlistitem(self.ctlComportList, port, desc, hwid)
+        self.config = wx.GetApp().config # type: config.Config
+        self.discovery = None # type: discovery.Discovery
         self.wxID_OK.Enable(False)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.OnDestroy)
+        if self.config.mock_data:
+            appendlistitem(self.ctlComportList, "port", "", "desc", "hwid")
+            return
+        self.discovery = discovery.Discovery(discovery.Discovery.loads(self.config.port_cache))
+        self._Scan(False)
+
+    def _Scan(self, rescan):
+        # type: (bool) -> None
+        """List the ports, probing those not identified by a previous run."""
+        self.ctlComportList.DeleteAllItems()
+        # don't disturb ports we are already talking to
+        manager = getattr(self.Parent, 'manager', None)
+        in_use = set(d.port for d in manager.devices) if manager is not None else set()
+        address = self.ctlAddress.GetValue()
+        for port, desc, hwid in self.discovery.ports():
+            identity = None if rescan else self.discovery.cached(hwid)
+            if port in in_use:
+                status = _("in use")
+            elif identity is not None:
+                status = discovery.describe(identity)
+            else:
+                status = _("probing...")
+            item = appendlistitem(self.ctlComportList, port, status, desc, hwid)
+            if port not in in_use and identity is None:
+                wx_future_callback(self.discovery.submit(port, hwid, address),
+                                   lambda f, port=port: self._OnProbed(port, f))
+            elif identity is not None and self.ctlComportList.GetFirstSelected() == -1:
+                self.ctlComportList.Select(item)
+
+    def _OnProbed(self, port, future):
+        # type: (str, Future) -> None
+        if not self or future.cancelled():
+            return
+        item = self.ctlComportList.FindItem(-1, port)
+        if item == -1:
+            return
+        try:
+            identity = future.result()
+        except Exception as e:
+            self.ctlComportList.SetItem(item, self.COL_DEVICE, str(e))
+            return
+        self.ctlComportList.SetItem(item, self.COL_DEVICE, discovery.describe(identity))
+        if identity is not None and self.ctlComportList.GetFirstSelected() == -1:
+            self.ctlComportList.Select(item)
+        self.config.port_cache = self.discovery.dumps()
+        self.config.Save()
+
+    def OnDestroy(self, evt):
+        # type: (wx.WindowDestroyEvent) -> None
+        if evt.GetEventObject() is self and self.discovery is not None:
+            self.discovery.shutdown()
+        evt.Skip()
+
+    def OnButton_wxID_REFRESH(self, evt):
+        # type: (wx.CommandEvent) -> None
+        if self.discovery is not None:
+            self.wxID_OK.Enable(False)
+            self._Scan(True)
 
     def OnButton_wxID_CANCEL(self, evt):
         # type: (wx.CommandEvent) -> None
@@ -66,6 +130,7 @@ class DlgPortSelector(rdgui_xrc.xrcdlgPortSelector):
         sel = self.ctlComportList.GetFirstSelected()
         if (sel != -1):
             self.port = self.ctlComportList.GetItemText(sel) # type: str
+            self.address = self.ctlAddress.GetValue() # type: int
             self.EndModal(evt.Id)
 
     def OnList_item_deselected_ctlComportList(self, evt):
@@ -79,6 +144,7 @@ class DlgPortSelector(rdgui_xrc.xrcdlgPortSelector):
     def OnList_item_activated_ctlComportList(self, evt):
         # type: (wx.ListEvent) -> None
         self.port = evt.Text # type: str
+        self.address = self.ctlAddress.GetValue() # type: int
         self.EndModal(wx.ID_OK)
 
 
@@ -92,6 +158,9 @@ class DlgSettings(rdgui_xrc.xrcdlgSettings, config.ConfigChangeHandler):
         self.ctlPollingInterval = self.ctlPollingInterval # type: wx.lib.agw.floatspin.FloatSpin
         self.ctlVoltageRange = self.ctlVoltageRange       # type: wx.lib.agw.floatspin.FloatSpin
         self.ctlAmperageRange = self.ctlAmperageRange     # type: wx.lib.agw.floatspin.FloatSpin
+        self.ctlAdaptivePolling = self.ctlAdaptivePolling # type: wx.CheckBox
+        self.ctlAdaptiveThreshold = self.ctlAdaptiveThreshold     # type: wx.lib.agw.floatspin.FloatSpin
+        self.ctlAdaptiveMinInterval = self.ctlAdaptiveMinInterval # type: wx.lib.agw.floatspin.FloatSpin
         self.wxID_APPLY = self.wxID_APPLY                 # type: wx.Button
 
         self.ctlGraphSeconds.SetDefaultValue(self.config.graph_seconds)
@@ -106,6 +175,14 @@ class DlgSettings(rdgui_xrc.xrcdlgSettings, config.ConfigChangeHandler):
         self.ctlAmperageRange.SetDefaultValue(self.config.amperage_range)
         self.ctlAmperageRange.SetToDefaultValue()
 
+        self.ctlAdaptivePolling.SetValue(self.config.adaptive_polling)
+
+        self.ctlAdaptiveThreshold.SetDefaultValue(self.config.adaptive_threshold)
+        self.ctlAdaptiveThreshold.SetToDefaultValue()
+
+        self.ctlAdaptiveMinInterval.SetDefaultValue(self.config.adaptive_min_interval)
+        self.ctlAdaptiveMinInterval.SetToDefaultValue()
+
     def OnClose(self, evt):
         # type: (wx.CloseEvent) -> None
         self.config.Unsubscribe(self)
@@ -119,6 +196,9 @@ class DlgSettings(rdgui_xrc.xrcdlgSettings, config.ConfigChangeHandler):
     OnSpinctrl_ctlPollingInterval = OnSpinctrl
     OnSpinctrl_ctlVoltageRange = OnSpinctrl
     OnSpinctrl_ctlAmperageRange = OnSpinctrl
+    OnSpinctrl_ctlAdaptiveThreshold = OnSpinctrl
+    OnSpinctrl_ctlAdaptiveMinInterval = OnSpinctrl
+    OnCheckbox_ctlAdaptivePolling = OnSpinctrl
 
     def OnButton_wxID_OK(self, evt):
         # type: (wx.CommandEvent) -> None
@@ -147,6 +227,15 @@ class DlgSettings(rdgui_xrc.xrcdlgSettings, config.ConfigChangeHandler):
         if not self.ctlAmperageRange.IsDefaultValue():
             self.config.amperage_range = self.ctlAmperageRange.GetValue()
             dirty = True
+        if self.ctlAdaptivePolling.GetValue() != self.config.adaptive_polling:
+            self.config.adaptive_polling = self.ctlAdaptivePolling.GetValue()
+            dirty = True
+        if not self.ctlAdaptiveThreshold.IsDefaultValue():
+            self.config.adaptive_threshold = self.ctlAdaptiveThreshold.GetValue()
+            dirty = True
+        if not self.ctlAdaptiveMinInterval.IsDefaultValue():
+            self.config.adaptive_min_interval = self.ctlAdaptiveMinInterval.GetValue()
+            dirty = True
         if dirty:
             self.config.Save()
         self.wxID_APPLY.Enable(False)
@@ -160,6 +249,10 @@ class DlgSettings(rdgui_xrc.xrcdlgSettings, config.ConfigChangeHandler):
             self.ctlVoltageRange.SetDefaultValue(updates['voltage_range'])
         if 'amperage_range' in updates:
             self.ctlAmperageRange.SetDefaultValue(updates['amperage_range'])
+        if 'adaptive_threshold' in updates:
+            self.ctlAdaptiveThreshold.SetDefaultValue(updates['adaptive_threshold'])
+        if 'adaptive_min_interval' in updates:
+            self.ctlAdaptiveMinInterval.SetDefaultValue(updates['adaptive_min_interval'])
 
 
 class DlgCalibration(rdgui_xrc.xrcdlgCalibration):
@@ -177,17 +270,44 @@ class DlgCalibration(rdgui_xrc.xrcdlgCalibration):
             xrc.XRCCTRL(self, "ctlAReadbackScale"),
         ) # type: Tuple[wx.SpinCtrl, ...]
 
+        self.device = parent.device
+        # a commit or restore on its way to the device
+        self._pending = None # type: Future
         if wx.GetApp().config.mock_data:
             self.initial_regs = [18, 22802, 22, 17585, 276, 21458, 77, 17418]
+            self._SetRegs(self.initial_regs)
         else:
-            with rdwrap.lock:
-                self.initial_regs = rdwrap.rd._read_registers(0x37, 8) # type: list[int]
-
-        for ctrl, reg in zip(self.spinctrls, self.initial_regs):
+            self.initial_regs = None # type: list[int]
+            for ctrl in self.spinctrls:
+                ctrl.Enable(False)
+            wx_future_callback(self.device.submit(lambda rd: rd._read_registers(0x37, 8)), self._OnInitialRegs)
+
+    def _OnInitialRegs(self, future):
+        # type: (Future) -> None
+        if not self or future.cancelled():
+            return
+        try:
+            self.initial_regs = future.result()
+        except:
+            wx.lib.dialogs.MultiMessageBox(
+                _("An error occurred while attempting to read calibration data"),
+                _("Error reading calibration data"),
+                traceback.format_exc(), wx.OK|wx.ICON_ERROR, self)
+            self.EndModal(wx.ID_CANCEL)
+            return
+        self._SetRegs(self.initial_regs)
+        for ctrl in self.spinctrls:
+            ctrl.Enable(True)
+
+    def _SetRegs(self, regs):
+        # type: (list[int]) -> None
+        for ctrl, reg in zip(self.spinctrls, regs):
             ctrl.SetValue(reg)
 
     def OnButton_wxID_OK(self, evt):
         # type: (wx.CommandEvent) -> None
+        if self._pending is not None:
+            return
         ans = wx.MessageBox(
             "{}\n\n{}".format(
                 _("Are you sure you want to commit calibration data?"),
@@ -198,29 +318,64 @@ class DlgCalibration(rdgui_xrc.xrcdlgCalibration):
             self)
         if ans == wx.YES:
             regs = [ctrl.GetValue() for ctrl in self.spinctrls]
-            with rdwrap.lock:
+            def commit(rd):
+                # type: (RD6006) -> None
                 # TODO: should we do this or rely on the SpinEvents?
-                rdwrap.rd._write_registers(0x37, regs)
-                rdwrap.rd._write_register(0x36, 0x1501)
-            self.EndModal(evt.Id)
+                rd._write_registers(0x37, regs)
+                rd._write_register(0x36, 0x1501)
+            self._Submit(commit, evt.Id, _("An error occurred while attempting to commit calibration data"),
+                         _("Error committing calibration data"), True)
 
     def OnButton_wxID_CANCEL(self, evt):
         # type: (wx.CommandEvent) -> None
+        if self._pending is not None:
+            return
+        if self.initial_regs is None:
+            self.EndModal(evt.Id)
+            return
+        initial_regs = self.initial_regs
+        self._Submit(lambda rd: rd._write_registers(0x37, initial_regs), evt.Id,
+                     _("An error occurred while attempting to restore calibration data"),
+                     _("Error restoring calibration data"), False)
+
+    def _Submit(self, fn, code, message, caption, stay_on_error):
+        # type: (Callable[[RD6006], None], int, str, str, bool) -> None
+        """Run fn on the device's I/O thread with the dialog disabled, then
+        end the dialog with code.  On error show message, and end the dialog
+        anyway unless stay_on_error."""
+        self._EnableControls(False)
+        self._pending = self.device.submit(fn)
+        wx_future_callback(self._pending, lambda future: self._OnSubmitted(future, code, message, caption, stay_on_error))
+
+    def _OnSubmitted(self, future, code, message, caption, stay_on_error):
+        # type: (Future, int, str, str, bool) -> None
+        if not self:
+            return
+        self._pending = None
         try:
-            with rdwrap.lock:
-                rdwrap.rd._write_registers(0x37, self.initial_regs)
+            future.result()
         except:
-            wx.lib.dialogs.MultiMessageBox(
-                _("An error occurred while attempting to restore calibration data"),
-                _("Error restoring calibration data"),
-                traceback.format_exc(), wx.OK|wx.ICON_ERROR, self)
-        self.EndModal(evt.Id)
+            wx.lib.dialogs.MultiMessageBox(message, caption, traceback.format_exc(), wx.OK|wx.ICON_ERROR, self)
+            if stay_on_error:
+                self._EnableControls(True)
+                return
+        self.EndModal(code)
+
+    def _EnableControls(self, enable):
+        # type: (bool) -> None
+        for ctrl in self.spinctrls:
+            ctrl.Enable(enable)
+        for button_id in (wx.ID_OK, wx.ID_CANCEL):
+            button = self.FindWindow(button_id)
+            if button is not None:
+                button.Enable(enable)
 
     def OnSpinctrl(self, evt):
         # type: (wx.SpinEvent) -> None
         i = self.spinctrls.index(evt.EventObject)
-        with rdwrap.lock:
-            rdwrap.rd._write_register(0x37 + i, evt.GetInt())
+        value = evt.GetInt()
+        # coalesced, so only the latest value of a fast spin gets written
+        self.device.submit(lambda rd: rd._write_register(0x37 + i, value), ('calibration', i))
 
     OnSpinctrl_ctlVOutputZero = OnSpinctrl
     OnSpinctrl_ctlVOutputScale = OnSpinctrl
@@ -230,3 +385,64 @@ class DlgCalibration(rdgui_xrc.xrcdlgCalibration):
     OnSpinctrl_ctlAOutputScale = OnSpinctrl
     OnSpinctrl_ctlAReadbackZero = OnSpinctrl
     OnSpinctrl_ctlAReadbackScale = OnSpinctrl
+
+
+class DlgStats(rdgui_xrc.xrcdlgStats):
+    """Modeless view of metrics.registry, refreshed while open."""
+
+    REFRESH_MS = 1000
+
+    def __init__(self, parent):
+        super(DlgStats, self).__init__(parent)
+        self.ctlStats = self.ctlStats # type: wx.ListCtrl
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnTimer, self.timer)
+        self._Populate()
+        self.timer.Start(self.REFRESH_MS)
+
+    @staticmethod
+    def _Columns(metric):
+        # type: (Any) -> list[str]
+        if isinstance(metric, metrics.Histogram):
+            values = [metric.mean] + metric.percentiles((50, 99, 99.9)) + [metric.max]
+            return [str(metric.count)] + ["{:.3f}".format(value * 1000) for value in values]
+        return [str(metric.value)] + [""] * 5
+
+    def _Populate(self):
+        items = metrics.registry.items()
+        names = [self.ctlStats.GetItemText(i) for i in range(self.ctlStats.GetItemCount())]
+        if names != [name for name, _ in items]:
+            self.ctlStats.DeleteAllItems()
+            for name, metric in items:
+                appendlistitem(self.ctlStats, name, *self._Columns(metric))
+        else:
+            for row, (name, metric) in enumerate(items):
+                for col, text in enumerate(self._Columns(metric), 1):
+                    self.ctlStats.SetItem(row, col, text)
+
+    def OnTimer(self, evt):
+        # type: (wx.TimerEvent) -> None
+        self._Populate()
+
+    def OnButton_wxID_CLEAR(self, evt):
+        # type: (wx.CommandEvent) -> None
+        metrics.registry.reset()
+        self._Populate()
+
+    def OnButton_wxID_SAVE(self, evt):
+        # type: (wx.CommandEvent) -> None
+        filename = wx.FileSelector(_("Save Statistics"), default_filename="rdgui-stats.json",
+                                   wildcard=_("JSON File (*.json)|*.json"),
+                                   flags=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT, parent=self) # type: str
+        if filename.strip():
+            with open(filename, "w") as fp:
+                metrics.registry.dump(fp)
+
+    def OnButton_wxID_CLOSE(self, evt):
+        # type: (wx.CommandEvent) -> None
+        self.Close()
+
+    def OnClose(self, evt):
+        # type: (wx.CloseEvent) -> None
+        self.timer.Stop()
+        self.Destroy()
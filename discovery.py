@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Find RD60xx power supplies among the serial ports.
+
+Every candidate port is probed at once on a thread pool, with a short
+timeout, first as a Modbus slave and then for the bootloader.  Results are
+kept by hardware ID, so a port whose adapter has been seen before can be
+identified without opening it.
+"""
+
+from __future__ import print_function
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import json
+import struct
+try:
+    from concurrent.futures import Future
+    from typing import Dict, List, Optional
+except:
+    pass
+
+import serial
+import serial.tools.list_ports
+
+import modbusrtu
+
+
+# seconds to wait for a reply while probing; a present device answers well
+# within this at any supported baud rate
+PROBE_TIMEOUT = 0.1
+PROBE_ATTEMPTS = 2
+# link speeds an RD60xx can be set to, fastest first
+BAUD_RATES = (115200, 57600, 38400, 19200, 9600)
+
+Identity = collections.namedtuple('Identity', ('model', 'serial', 'fw', 'bootloader'))
+
+
+def describe(identity):
+    # type: (Optional[Identity]) -> str
+    if identity is None:
+        return ""
+    if identity.bootloader:
+        return "RD{} bootloader SN {:08d}".format(identity.model // 10, identity.serial)
+    return "RD{} SN {:08d} FW {:.2f}".format(identity.model // 10, identity.serial, identity.fw)
+
+
+def probe(port, address=1, baudrate=115200, timeout=PROBE_TIMEOUT):
+    # type: (str, int, int, float) -> Optional[Identity]
+    """Identify the RD60xx on port, or return None if none answers."""
+    ser = serial.Serial(port, baudrate, timeout=timeout)
+    try:
+        rtu = modbusrtu.RTUTransport(ser, address)
+        for _ in range(PROBE_ATTEMPTS):
+            try:
+                regs = rtu.read_holding_registers(0, 4)
+            except modbusrtu.ModbusError:
+                continue
+            return Identity(regs[0], regs[1] << 16 | regs[2], regs[3] / 100., False)
+        # the bootloader doesn't speak Modbus; see RD6006.is_bootloader
+        ser.reset_input_buffer()
+        ser.write(b"queryd\r\n")
+        if ser.read(4) != b'boot':
+            return None
+        ser.write(b"getinf\r\n")
+        res = ser.read(13)
+        if len(res) != 13 or res[:3] != b'inf':
+            return Identity(0, 0, 0., True)
+        _, serialno, model, _, fwver = struct.unpack("<3sIHHH", res)
+        return Identity(model, serialno, fwver / 100., True)
+    finally:
+        ser.close()
+
+
+def detect_baudrate(port, address=1, first=None):
+    # type: (str, int, int) -> Optional[int]
+    """Find the rate the device on port talks at, trying first first."""
+    rates = ((first,) if first else ()) + tuple(r for r in BAUD_RATES if r != first)
+    for rate in rates:
+        if probe(port, address, rate) is not None:
+            return rate
+    return None
+
+
+def hwid_of(port):
+    # type: (str) -> Optional[str]
+    for name, _, hwid in Discovery.ports():
+        if name == port:
+            return hwid
+    return None
+
+
+def locate(port, hwid=None, serial_number=None, address=1, exclude=()):
+    # type: (str, str, int, int, tuple) -> Optional[str]
+    """Find where a device last seen on port is now, after a USB reset.
+
+    The adapter's hardware ID is tried first, then the port name if it
+    still exists, then any other port not in exclude whose supply reports
+    serial_number.  Returns None if the device is nowhere to be found.
+    """
+    ports = Discovery.ports()
+    if Discovery.cacheable(hwid):
+        for name, _, h in ports:
+            if h == hwid:
+                return name
+    names = [name for name, _, _ in ports]
+    if port in names and not Discovery.cacheable(hwid):
+        return port
+    if serial_number is not None:
+        for name in names:
+            if name in exclude:
+                continue
+            try:
+                identity = probe(name, address)
+            except (serial.SerialException, OSError):
+                continue
+            if identity is not None and identity.serial == serial_number:
+                return name
+    return port if port in names else None
+
+
+class Discovery(object):
+    """Probes serial ports in parallel and remembers what it found."""
+
+    def __init__(self, cache=None, max_workers=8):
+        # type: (Dict[str, Identity], int) -> None
+        super(Discovery, self).__init__()
+        # hwid -> Identity of the device last found behind that adapter
+        self.cache = cache if cache is not None else {} # type: Dict[str, Identity]
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @staticmethod
+    def ports():
+        """(port, description, hwid) of every serial port on the system."""
+        return [tuple(p) for p in serial.tools.list_ports.comports()]
+
+    @staticmethod
+    def cacheable(hwid):
+        # type: (str) -> bool
+        # ports without a hardware ID can't be told apart across launches
+        return bool(hwid) and hwid != "n/a"
+
+    def cached(self, hwid):
+        # type: (str) -> Optional[Identity]
+        return self.cache.get(hwid) if self.cacheable(hwid) else None
+
+    def submit(self, port, hwid, address=1):
+        # type: (str, str, int) -> Future
+        """Probe port in the background; the future's result is an Identity or None."""
+        future = self._executor.submit(probe, port, address)
+        def remember(f):
+            # type: (Future) -> None
+            if not f.cancelled() and f.exception() is None and self.cacheable(hwid):
+                if f.result() is None:
+                    self.cache.pop(hwid, None)
+                else:
+                    self.cache[hwid] = f.result()
+        future.add_done_callback(remember)
+        return future
+
+    def discover(self, address=1, exclude=()):
+        # type: (int, tuple) -> List[tuple]
+        """Probe every port not in exclude concurrently and wait for them all.
+
+        Returns (port, description, hwid, Identity or None) for each.
+        """
+        ports = [p for p in self.ports() if p[0] not in exclude]
+        futures = [self.submit(port, hwid, address) for port, _, hwid in ports]
+        results = []
+        for (port, desc, hwid), future in zip(ports, futures):
+            try:
+                identity = future.result()
+            except (serial.SerialException, OSError):
+                identity = None
+            results.append((port, desc, hwid, identity))
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def dumps(self):
+        # type: () -> str
+        return json.dumps(dict((hwid, identity._asdict()) for hwid, identity in list(self.cache.items())), sort_keys=True)
+
+    @staticmethod
+    def loads(s):
+        # type: (str) -> Dict[str, Identity]
+        try:
+            return dict((hwid, Identity(**fields)) for hwid, fields in json.loads(s).items())
+        except (ValueError, TypeError, AttributeError):
+            return {}
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Firmware updates for RD60xx supplies, run on a device's I/O thread.
+
+The image is streamed from any iterable of byte chunks, such as a file
+from fwcache, straight into the bootloader, and progress is reported
+at most every PROGRESS_INTERVAL seconds however fast blocks are acked.
+"""
+
+from __future__ import print_function
+
+import collections
+from time import perf_counter
+try:
+    from typing import Callable, Iterable, Iterator, Optional
+except:
+    pass
+
+from rd60xx import RD6006
+
+
+# seconds between progress reports while flashing
+PROGRESS_INTERVAL = 0.2
+CHUNK_SIZE = 4096
+
+STAGE_REBOOT = "reboot"
+STAGE_FLASH = "flash"
+STAGE_RESTART = "restart"
+STAGE_DONE = "done"
+
+Progress = collections.namedtuple('Progress', ('stage', 'done', 'total', 'rate', 'eta'))
+Progress.__doc__ = """Flash progress: bytes done of total, bytes/s and seconds left (None if unknown)."""
+
+
+def file_chunks(filename, chunk_size=CHUNK_SIZE):
+    # type: (str, int) -> Iterator[bytes]
+    with open(filename, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            yield chunk
+
+
+class _Throttle(object):
+    """Turns per-block positions into Progress reports, rate limited."""
+
+    def __init__(self, total, callback):
+        # type: (int, Callable[[Progress], None]) -> None
+        super(_Throttle, self).__init__()
+        self.total = total
+        self.callback = callback
+        self.started = None # type: float
+        self._next = 0.
+
+    def stage(self, stage, done=0):
+        # type: (str, int) -> None
+        self._next = 0.
+        self.callback(Progress(stage, done, self.total, 0., None))
+
+    def __call__(self, pos):
+        # type: (int) -> None
+        now = perf_counter()
+        if self.started is None:
+            self.started = now
+        if now < self._next and pos < self.total:
+            return
+        self._next = now + PROGRESS_INTERVAL
+        elapsed = now - self.started
+        rate = pos / elapsed if elapsed > 0 else 0.
+        eta = (self.total - pos) / rate if rate > 0 else None
+        self.callback(Progress(STAGE_FLASH, pos, self.total, rate, eta))
+
+
+def flash(rd, size, chunks, progress=None):
+    # type: (RD6006, int, Iterable[bytes], Optional[Callable[[Progress], None]]) -> None
+    """Put rd into its bootloader, flash chunks and wait for the new firmware.
+
+    Call on the device's I/O thread; progress is called from there too.
+    """
+    throttle = _Throttle(size, progress or (lambda p: None))
+    throttle.stage(STAGE_REBOOT)
+    if not rd.is_bootloader:
+        rd.reboot_into_bootloader()
+        rd.wait_for_bootloader()
+    rd.bootloader_update_firmware(chunks, throttle)
+    throttle.stage(STAGE_RESTART, size)
+    rd.wait_for_firmware()
+    throttle.stage(STAGE_DONE, size)
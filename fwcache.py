@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""On-disk cache of the vendor's firmware metadata and images.
+
+Metadata is revalidated with conditional requests (ETag/Last-Modified), and
+used from disk when the server can't be reached.  Images are kept per
+model and version once their size matches the metadata, with a SHA-256
+recorded so a corrupted copy is noticed and fetched again.
+"""
+
+from __future__ import print_function
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import tempfile
+import threading
+try:
+    from typing import Any, Dict, Iterable, List, Optional, Tuple
+except:
+    pass
+
+
+METADATA_URL = "http://www.ruidengkeji.com/rdupdate/firmware/RD{0}/RD{0}.json"
+TIMEOUT = 10.0
+CHUNK_SIZE = 65536
+
+# atomic where available (Python 3), so readers never see a partial file
+_replace = getattr(os, "replace", os.rename)
+
+
+def _urllib():
+    # type: () -> Tuple[Any, Any, Any, Any]
+    """(HTTPError, URLError, Request, urlopen), imported on first use to keep
+    the network stack off rdgui's startup path."""
+    try:
+        from urllib.error import HTTPError, URLError
+        from urllib.request import Request, urlopen
+    except ImportError:
+        from urllib2 import HTTPError, Request, URLError, urlopen
+    return HTTPError, URLError, Request, urlopen
+
+
+class FirmwareCache(object):
+    def __init__(self, directory, metadata_url=METADATA_URL):
+        # type: (str, str) -> None
+        super(FirmwareCache, self).__init__()
+        self.directory = directory
+        self.metadata_url = metadata_url
+        self._lock = threading.Lock()
+        # one lock per cached file, so concurrent requests fetch it once
+        self._locks = {} # type: Dict[str, threading.Lock]
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, name):
+        # type: (str) -> str
+        return os.path.join(self.directory, name)
+
+    def _file_lock(self, name):
+        # type: (str) -> threading.Lock
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def _read_json(self, name):
+        # type: (str) -> Optional[Dict[str, Any]]
+        try:
+            with open(self._path(name)) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_atomic(self, name, chunks):
+        # type: (str, Iterable[bytes]) -> str
+        """Write chunks to name via a temporary file; return its SHA-256."""
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=name + ".")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    fh.write(chunk)
+            _replace(tmp, self._path(name))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return digest.hexdigest()
+
+    def metadata(self, model):
+        # type: (int) -> Dict[str, Any]
+        """The vendor's update metadata for model, revalidated if cached.
+
+        Falls back to the cached copy if the server can't be reached.
+        """
+        HTTPError, URLError, Request, urlopen = _urllib()
+        name = "RD{}.json".format(model)
+        with self._file_lock(name):
+            cached = self._read_json(name)
+            request = Request(self.metadata_url.format(model))
+            if cached is not None:
+                if cached.get("etag"):
+                    request.add_header("If-None-Match", cached["etag"])
+                if cached.get("last_modified"):
+                    request.add_header("If-Modified-Since", cached["last_modified"])
+            try:
+                fp = urlopen(request, timeout=TIMEOUT)
+            except (HTTPError, URLError, IOError, OSError):
+                # 304 Not Modified lands here too
+                if cached is None:
+                    raise
+                return cached["metadata"]
+            try:
+                body = fp.read()
+                headers = fp.info()
+            finally:
+                fp.close()
+            metadata = json.loads(body.decode("utf-8-sig"), strict=False)
+            entry = {
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "metadata": metadata,
+            }
+            self._write_atomic(name, (json.dumps(entry, indent=2, sort_keys=True).encode("utf-8"),))
+            return metadata
+
+    def check_all(self, models, max_workers=4):
+        # type: (Iterable[int], int) -> Dict[int, Any]
+        """Fetch metadata for several models at once.
+
+        Returns model -> metadata, or the exception raised for that model.
+        """
+        models = sorted(set(models))
+        results = {} # type: Dict[int, Any]
+        if not models:
+            return results
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(models))) as executor:
+            futures = dict((model, executor.submit(self.metadata, model)) for model in models)
+        for model, future in futures.items():
+            exc = future.exception()
+            results[model] = exc if exc is not None else future.result()
+        return results
+
+    def firmware(self, model, metadata):
+        # type: (int, Dict[str, Any]) -> str
+        """Path to the verified image metadata describes, downloading it
+        unless a good copy is cached."""
+        name = "RD{}-{}.bin".format(model, metadata["Version"])
+        size = int(metadata["Size"])
+        with self._file_lock(name):
+            path = self._path(name)
+            record = self._read_json(name + ".sha256.json")
+            if record is not None and record.get("size") == size and os.path.isfile(path) \
+                    and os.path.getsize(path) == size and self._sha256(path) == record.get("sha256"):
+                return path
+            urlopen = _urllib()[3]
+            fp = urlopen(metadata["DownloadUri"], timeout=TIMEOUT)
+            try:
+                sha256 = self._write_atomic(name, iter(lambda: fp.read(CHUNK_SIZE), b""))
+            finally:
+                fp.close()
+            actual = os.path.getsize(path)
+            if actual != size:
+                os.remove(path)
+                raise IOError("Downloaded {} is {} bytes, expected {}".format(name, actual, size))
+            self._write_atomic(name + ".sha256.json",
+                               (json.dumps({"size": size, "sha256": sha256}).encode("utf-8"),))
+            return path
+
+    def _sha256(self, path):
+        # type: (str) -> str
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
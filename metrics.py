@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Lightweight latency histograms and counters.
+
+Recording is cheap enough for the polling hot path: a histogram is a fixed
+list of log-linear buckets (in the style of HdrHistogram), so a record is a
+frexp and an increment, and readers never have to take a lock.
+"""
+
+from __future__ import print_function
+
+import json
+import math
+import threading
+try:
+    from typing import Any, Dict, IO, List
+except:
+    pass
+
+
+class Histogram(object):
+    """Histogram of durations in seconds, about 3% relative precision."""
+
+    # durations are bucketed in units of 1µs, up to about 2^31µs (35 minutes)
+    UNIT = 1e-6
+    SUB_BUCKETS = 32
+    MAX_EXPONENT = 32
+
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self):
+        super(Histogram, self).__init__()
+        self.reset()
+
+    def reset(self):
+        self._counts = [0] * (self.SUB_BUCKETS * (self.MAX_EXPONENT + 1))
+        self.count = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+
+    def record(self, value):
+        # type: (float) -> None
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self._counts[self._index(value)] += 1
+
+    def _index(self, value):
+        # type: (float) -> int
+        mantissa, exponent = math.frexp(value / self.UNIT)
+        if exponent <= 0:
+            return 0
+        if exponent > self.MAX_EXPONENT:
+            return len(self._counts) - 1
+        return exponent * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+
+    def _value(self, index):
+        # type: (int) -> float
+        """Midpoint of the bucket at index."""
+        exponent, sub = divmod(index, self.SUB_BUCKETS)
+        mantissa = 0.5 + (sub + 0.5) / (2. * self.SUB_BUCKETS)
+        return math.ldexp(mantissa, exponent) * self.UNIT
+
+    @property
+    def mean(self):
+        # type: () -> float
+        return self.total / self.count if self.count else 0.
+
+    def percentiles(self, percentiles=PERCENTILES):
+        # type: (tuple) -> List[float]
+        counts = list(self._counts)
+        total = sum(counts)
+        result = []
+        index = 0
+        seen = counts[0]
+        for p in percentiles:
+            target = total * p / 100.
+            while seen < target and index < len(counts) - 1:
+                index += 1
+                seen += counts[index]
+            result.append(min(self._value(index), self.max) if total else 0.)
+        return result
+
+    def as_dict(self):
+        # type: () -> Dict[str, Any]
+        d = {
+            "count": self.count,
+            "min": self.min if self.count else 0.,
+            "max": self.max,
+            "mean": self.mean,
+        }
+        for p, value in zip(self.PERCENTILES, self.percentiles()):
+            d["p{:g}".format(p)] = value
+        return d
+
+
+class Counter(object):
+    def __init__(self):
+        super(Counter, self).__init__()
+        self.value = 0
+
+    def increment(self, n=1):
+        # type: (int) -> None
+        self.value += n
+
+    def reset(self):
+        self.value = 0
+
+    def as_dict(self):
+        # type: () -> Dict[str, Any]
+        return {"count": self.value}
+
+
+class Registry(object):
+    """Named histograms and counters, created on first use."""
+
+    def __init__(self):
+        super(Registry, self).__init__()
+        self._lock = threading.Lock()
+        self._metrics = {} # type: Dict[str, Any]
+
+    def _get(self, name, cls):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(name, cls())
+        return metric
+
+    def histogram(self, name):
+        # type: (str) -> Histogram
+        return self._get(name, Histogram)
+
+    def counter(self, name):
+        # type: (str) -> Counter
+        return self._get(name, Counter)
+
+    def items(self):
+        with self._lock:
+            return sorted(self._metrics.items())
+
+    def reset(self):
+        for _, metric in self.items():
+            metric.reset()
+
+    def as_dict(self):
+        # type: () -> Dict[str, Dict[str, Any]]
+        return dict((name, metric.as_dict()) for name, metric in self.items())
+
+    def dump(self, fp):
+        # type: (IO[str]) -> None
+        json.dump(self.as_dict(), fp, indent=2, sort_keys=True)
+
+
+class LinkStats(object):
+    """Metrics for one Modbus slave, named "<name>/<metric>"."""
+
+    def __init__(self, registry, name):
+        # type: (Registry, str) -> None
+        super(LinkStats, self).__init__()
+        self.rtt = registry.histogram(name + "/rtt")
+        self.timeouts = registry.counter(name + "/timeouts")
+        self.errors = registry.counter(name + "/errors")
+        self.retries = registry.counter(name + "/retries")
+
+
+registry = Registry()
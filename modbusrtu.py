@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Lean Modbus RTU client covering the function codes RD60xx needs.
+
+Unlike minimalmodbus, frames are built in preallocated bytearrays, the CRC
+comes from a precomputed table, and responses are read with a single
+serial.read sized from the function code.
+"""
+
+from __future__ import print_function
+
+import struct
+from time import perf_counter, sleep
+try:
+    from typing import Dict, List, Sequence
+except:
+    pass
+
+
+READ_HOLDING_REGISTERS = 3
+WRITE_MULTIPLE_REGISTERS = 16
+
+# Modbus limits per frame
+MAX_READ_REGISTERS = 125
+MAX_WRITE_REGISTERS = 123
+
+
+def _make_crc_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+_CRC_TABLE = _make_crc_table()
+
+
+def crc16(data, end=None):
+    # type: (bytes, int) -> int
+    """Return the Modbus CRC16 of data[:end]."""
+    crc = 0xFFFF
+    table = _CRC_TABLE
+    for b in memoryview(data)[:end]:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+
+class ModbusError(IOError):
+    pass
+
+
+class NoResponseError(ModbusError):
+    pass
+
+
+class InvalidResponseError(ModbusError):
+    pass
+
+
+class SlaveReportedException(ModbusError):
+    def __init__(self, code):
+        # type: (int) -> None
+        super(SlaveReportedException, self).__init__("Slave reported exception code {}".format(code))
+        self.code = code
+
+
+class BusTiming(object):
+    """Frame timing shared by every transport on one serial line."""
+
+    def __init__(self):
+        super(BusTiming, self).__init__()
+        self.last_frame = 0.
+        # slave address -> serial timeout tuned for it; the line's timeout
+        # is the largest, so no slave's replies are cut short
+        self.timeouts = {} # type: Dict[int, float]
+
+
+class RTUTransport(object):
+    _header = struct.Struct(">BBHH")
+    _crc = struct.Struct("<H")
+
+    def __init__(self, serial, address, timing=None):
+        # type: (serial.Serial, int, BusTiming) -> None
+        super(RTUTransport, self).__init__()
+        self.serial = serial
+        self.address = address
+        # pass the same BusTiming to transports for other slaves on this
+        # line so the inter-frame gap is kept between their frames too
+        self.timing = timing if timing is not None else BusTiming()
+        self.clear_buffers_before_each_transaction = True
+        # largest frames: write request / read response
+        self._request = bytearray(9 + 2 * MAX_WRITE_REGISTERS)
+        self._response = memoryview(bytearray(5 + 2 * MAX_READ_REGISTERS))
+        self._registers = {} # type: Dict[int, struct.Struct]
+
+    @property
+    def frame_gap(self):
+        # type: () -> float
+        """Silent interval required between frames (3.5 character times)."""
+        baudrate = self.serial.baudrate
+        if baudrate > 19200:
+            return 0.00175
+        return 3.5 * 11. / baudrate
+
+    def _regstruct(self, count):
+        # type: (int) -> struct.Struct
+        s = self._registers.get(count)
+        if s is None:
+            s = self._registers[count] = struct.Struct(">{}H".format(count))
+        return s
+
+    def _transact(self, reqlen, resplen):
+        # type: (int, int) -> memoryview
+        """Send _request[:reqlen] and return the validated response."""
+        req = self._request
+        crc = crc16(req, reqlen)
+        self._crc.pack_into(req, reqlen, crc)
+        reqlen += 2
+
+        ser = self.serial
+        wait = self.timing.last_frame + self.frame_gap - perf_counter()
+        if wait > 0:
+            sleep(wait)
+        if self.clear_buffers_before_each_transaction:
+            ser.reset_input_buffer()
+            ser.reset_output_buffer()
+        ser.write(memoryview(req)[:reqlen])
+        data = ser.read(resplen)
+        self.timing.last_frame = perf_counter()
+
+        n = len(data)
+        if n == 0:
+            raise NoResponseError("No response from slave {}".format(self.address))
+        resp = self._response
+        resp[:n] = data
+        if n >= 5 and resp[1] == (req[1] | 0x80) and crc16(resp, 3) == self._crc.unpack_from(resp, 3)[0]:
+            raise SlaveReportedException(resp[2])
+        if n != resplen:
+            raise InvalidResponseError("Expected {} bytes, got {}: {!r}".format(resplen, n, bytes(data)))
+        if crc16(resp, n - 2) != self._crc.unpack_from(resp, n - 2)[0]:
+            raise InvalidResponseError("CRC mismatch: {!r}".format(bytes(data)))
+        if resp[0] != req[0] or resp[1] != req[1]:
+            raise InvalidResponseError("Unexpected response header: {!r}".format(bytes(data)))
+        return resp[:n]
+
+    def read_holding_registers(self, start, count):
+        # type: (int, int) -> List[int]
+        if not 0 < count <= MAX_READ_REGISTERS:
+            raise ValueError("Invalid register count {}".format(count))
+        self._header.pack_into(self._request, 0, self.address, READ_HOLDING_REGISTERS, start, count)
+        resp = self._transact(6, 5 + 2 * count)
+        if resp[2] != 2 * count:
+            raise InvalidResponseError("Bad byte count {} for {} registers".format(resp[2], count))
+        return list(self._regstruct(count).unpack_from(resp, 3))
+
+    def write_multiple_registers(self, start, values):
+        # type: (int, Sequence[int]) -> None
+        count = len(values)
+        if not 0 < count <= MAX_WRITE_REGISTERS:
+            raise ValueError("Invalid register count {}".format(count))
+        req = self._request
+        self._header.pack_into(req, 0, self.address, WRITE_MULTIPLE_REGISTERS, start, count)
+        req[6] = 2 * count
+        self._regstruct(count).pack_into(req, 7, *values)
+        resp = self._transact(7 + 2 * count, 8)
+        if self._header.unpack_from(resp, 0)[2:] != (start, count):
+            raise InvalidResponseError("Write echo mismatch: {!r}".format(bytes(resp)))
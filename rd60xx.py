@@ -3,17 +3,19 @@
 
 from __future__ import print_function
 
+from array import array
 import struct
-import sys
-import threading
+from time import perf_counter
 try:
-    from typing import Callable
+    from typing import Callable, Iterable, Iterator, Union
 except:
     pass
 from weakref import WeakSet
 
 import minimalmodbus
 
+import metrics
+import modbusrtu
 from utils import AttributeSetterCtx
 
 import submodpaths
@@ -22,25 +24,205 @@ import rd6006
 
 
 class RD6006(rd6006.RD6006):
+    # Registers covered by snapshot(): internal temperature (4) through
+    # output enable (18).  This includes setpoints, measured output, input
+    # voltage, protection and CV/CC status.
+    SNAPSHOT_START = 4
+    SNAPSHOT_LENGTH = 15
+    # attempts at a transaction before a timeout or garbled reply is raised
+    MAX_ATTEMPTS = 3
+    # link speed setting, as an index into BAUD_RATES
+    BAUD_REGISTER = 25
+    BAUD_RATES = (9600, 19200, 38400, 57600, 115200)
+    DEFAULT_TIMEOUT = 0.5
+    # bounds on, and headroom over the slowest measured round trip for,
+    # the timeout set by tune_timeout()
+    MIN_TIMEOUT = 0.05
+    TIMEOUT_FACTOR = 4
+
     def __init__(self, *args, **kwargs):
+        use_rtu = kwargs.pop('use_rtu', True) # type: bool
+        bus_timing = kwargs.pop('bus_timing', None) or modbusrtu.BusTiming() # type: modbusrtu.BusTiming
+        self.bus_timing = bus_timing
+        self.stats = kwargs.pop('stats', None) # type: metrics.LinkStats
         self._constructing = True
+        self._image = array('H', [0] * self.SNAPSHOT_LENGTH)
+        self._image_expires = 0.
+        self.rtu = None # type: modbusrtu.RTUTransport
+        # found in the bootloader rather than the firmware when opened
+        self.in_bootloader = False
+        # minimalmodbus shares one serial.Serial per port between slaves;
+        # if it's already open, leave the timeout tuned for them alone
+        port = args[0] if args else kwargs.get('port')
+        shared = getattr(minimalmodbus, '_serialports', {}).get(port)
+        shared = shared is not None and shared.is_open
         super(RD6006, self).__init__(*args, **kwargs)
         self._constructing = False
-        # It looks like rd6006 tried to change minimalmodbus timeout to 0.5s,
-        # but at least the version I have is still using 0.05s.  Change it
-        self.instrument.serial.timeout = 0.5
+        if not shared:
+            # a fresh connection: forget timeouts tuned on the last one.  It
+            # looks like rd6006 tried to change minimalmodbus timeout to 0.5s,
+            # but at least the version I have is still using 0.05s.  Change it
+            bus_timing.timeouts.clear()
+            self.instrument.serial.timeout = self.DEFAULT_TIMEOUT
+        # Use our own codec for register traffic, leaving minimalmodbus to
+        # open the port and as a fallback
+        if use_rtu:
+            self.rtu = modbusrtu.RTUTransport(self.instrument.serial, self.instrument.address, bus_timing)
+            self.rtu.clear_buffers_before_each_transaction = self.instrument.clear_buffers_before_each_transaction
+
+    def snapshot(self, max_age):
+        # type: (float) -> None
+        """Read the snapshot register block in one transaction.
+
+        Until max_age seconds have passed, reads of registers inside the
+        block are served from the cached image instead of the device.
+        """
+        t = perf_counter()
+        self._image_expires = 0.
+        self._image[:] = array('H', self._read_registers(self.SNAPSHOT_START, self.SNAPSHOT_LENGTH))
+        self._image_expires = t + max_age
+
+    def invalidate_snapshot(self):
+        self._image_expires = 0.
+
+    def _image_range(self, start, length):
+        # type: (int, int) -> slice
+        """Return the image slice for the registers, or None if not cached."""
+        offset = start - self.SNAPSHOT_START
+        if offset < 0 or offset + length > self.SNAPSHOT_LENGTH:
+            return None
+        if perf_counter() >= self._image_expires:
+            return None
+        return slice(offset, offset + length)
+
+    def _read_register(self, register):
+        r = self._image_range(register, 1)
+        if r is not None:
+            return self._image[r.start]
+        if self.rtu is not None:
+            return self._read_registers(register, 1)[0]
+        return self._retry(self.instrument.read_register, register)
 
     def _read_registers(self, start, length):
+        r = self._image_range(start, length)
+        if r is not None:
+            return self._image[r].tolist()
         if self._constructing and start == 0 and length == 4 and self.is_bootloader:
+            self.in_bootloader = True
             info = self.bootloader_info
             return (info["model"], (info["serial"] >> 16) & 0xFFFF, info["serial"] & 0xFFFF, int(info["fwver"]*100))
-        return super(RD6006, self)._read_registers(start, length)
+        if self.rtu is not None:
+            return self._retry(self.rtu.read_holding_registers, start, length)
+        return self._retry(self.instrument.read_registers, start, length)
+
+    def _write_register(self, register, value):
+        if self.rtu is not None:
+            return self._write_registers(register, [value])
+        ret = self._retry(self.instrument.write_register, register, value)
+        self._invalidate_image(register, 1)
+        return ret
 
     def _write_registers(self, register, values):
+        if self.rtu is not None:
+            ret = self._retry(self.rtu.write_multiple_registers, register, values)
+        else:
+            ret = self._retry(self.instrument.write_registers, register, values)
+        self._invalidate_image(register, len(values))
+        return ret
+
+    def measure_rtt(self, count=10):
+        # type: (int) -> float
+        """Read the snapshot block count times; return the slowest round trip.
+
+        Raises if any read fails, so this doubles as a link check.
+        """
+        worst = 0.
+        for _ in range(count):
+            self.invalidate_snapshot()
+            t = perf_counter()
+            self._timed(self.rtu.read_holding_registers if self.rtu is not None else self.instrument.read_registers,
+                        self.SNAPSHOT_START, self.SNAPSHOT_LENGTH)
+            worst = max(worst, perf_counter() - t)
+        return worst
+
+    def tune_timeout(self, count=10):
+        # type: (int) -> float
+        """Size the serial timeout from measured round trips instead of a
+        constant, so a lost reply is noticed quickly."""
+        timeout = min(max(self.TIMEOUT_FACTOR * self.measure_rtt(count), self.MIN_TIMEOUT), self.DEFAULT_TIMEOUT)
+        timeouts = self.bus_timing.timeouts
+        timeouts[self.instrument.address] = timeout
+        self.instrument.serial.timeout = max(timeouts.values())
+        return timeout
+
+    def upgrade_baudrate(self, baudrate=BAUD_RATES[-1], burst=20):
+        # type: (int, int) -> int
+        """Switch device and port to baudrate if a burst of reads passes.
+
+        Falls back to the current rate otherwise, restoring the device
+        setting.  Returns the rate in use afterwards.
+        """
+        ser = self.instrument.serial
+        old = ser.baudrate
+        if baudrate == old:
+            return old
+        errors = (minimalmodbus.ModbusException, modbusrtu.ModbusError)
+        try:
+            self._write_registers(self.BAUD_REGISTER, [self.BAUD_RATES.index(baudrate)])
+        except errors:
+            # the device may switch before it replies
+            pass
+        for rate in (baudrate, old):
+            ser.baudrate = rate
+            try:
+                self.measure_rtt(burst)
+            except errors:
+                continue
+            if rate == old:
+                self._write_registers(self.BAUD_REGISTER, [self.BAUD_RATES.index(old)])
+            return rate
+        raise modbusrtu.NoResponseError("No response at {} or {} baud".format(baudrate, old))
+
+    def _retry(self, fn, *args):
+        """Call fn(*args) via _timed, up to MAX_ATTEMPTS times.
+
+        Replaces rd6006's unbounded recursion, so a dead link surfaces as
+        an exception for the connection supervisor instead of a hang.
+        """
+        for attempt in range(self.MAX_ATTEMPTS):
+            try:
+                return self._timed(fn, *args)
+            except (minimalmodbus.NoResponseError, minimalmodbus.InvalidResponseError,
+                    modbusrtu.NoResponseError, modbusrtu.InvalidResponseError):
+                if attempt == self.MAX_ATTEMPTS - 1:
+                    raise
+                if self.stats is not None:
+                    self.stats.retries.increment()
+
+    def _timed(self, fn, *args):
+        """Call fn(*args), recording its round trip or failure in stats."""
+        stats = self.stats
+        if stats is None:
+            return fn(*args)
+        t = perf_counter()
         try:
-            return self.instrument.write_registers(register, values)
-        except minimalmodbus.NoResponseError:
-            return self._write_registers(register, values)
+            ret = fn(*args)
+        except (minimalmodbus.NoResponseError, modbusrtu.NoResponseError):
+            stats.timeouts.increment()
+            raise
+        except (minimalmodbus.ModbusException, modbusrtu.ModbusError):
+            stats.errors.increment()
+            raise
+        stats.rtt.record(perf_counter() - t)
+        return ret
+
+    def _invalidate_image(self, register, count):
+        # type: (int, int) -> None
+        """Drop the cached image if it covers any written register.  The
+        device may not have taken the value (out of range, locked, ...),
+        so reads after a write must come from the device."""
+        if register < self.SNAPSHOT_START + self.SNAPSHOT_LENGTH and register + count > self.SNAPSHOT_START:
+            self._image_expires = 0.
 
     @property
     def model(self):
@@ -61,14 +243,8 @@ class RD6006(rd6006.RD6006):
         self._write_registers(8, [int(value[0] * self.voltres), int(value[1] * self.ampres)])
 
     def reboot_into_bootloader(self):
-        py3 = sys.version_info[0] > 2
         f = struct.pack(">BBHH", self.instrument.address, 6, 0x100, 0x1601)
-        # stupid minimalmodbus
-        if py3:
-            f = str(f, encoding='latin1')
-        f += minimalmodbus._calculate_crc_string(f)
-        if py3:
-            f = bytes(f, encoding='latin1')
+        f += struct.pack("<H", modbusrtu.crc16(f))
         if self.instrument.clear_buffers_before_each_transaction:
             self.instrument.serial.reset_input_buffer()
             self.instrument.serial.reset_output_buffer()
@@ -101,8 +277,34 @@ class RD6006(rd6006.RD6006):
             raise RuntimeError("Bad getinf response from bootloader: {!r}".format(res))
         return {"serial": serial, "model": model, "bootver": bootver/100., "fwver": fwver/100.}
 
+    def wait_for_bootloader(self, timeout=10.0, interval=0.1):
+        # type: (float, float) -> None
+        """Poll until the bootloader answers, after reboot_into_bootloader."""
+        deadline = perf_counter() + timeout
+        with AttributeSetterCtx(self.instrument.serial, 'timeout', interval):
+            while perf_counter() < deadline:
+                if self.is_bootloader:
+                    return
+        raise RuntimeError("Bootloader did not start within {}s".format(timeout))
+
+    def wait_for_firmware(self, timeout=15.0):
+        # type: (float) -> None
+        """Poll until the firmware answers Modbus again, after flashing."""
+        deadline = perf_counter() + timeout
+        while perf_counter() < deadline:
+            try:
+                self.measure_rtt(1)
+                return
+            except (minimalmodbus.ModbusException, modbusrtu.ModbusError):
+                pass
+        raise RuntimeError("Firmware did not start within {}s".format(timeout))
+
     def bootloader_update_firmware(self, firmware, progress_callback = lambda pos: None):
-        # type: (bytes, Callable[[int], None]) -> None
+        # type: (Union[bytes, Iterable[bytes]], Callable[[int], None]) -> None
+        """Flash firmware, given as bytes or as an iterable of chunks of any
+        size, which is consumed as it is sent."""
+        if isinstance(firmware, bytes):
+            firmware = (firmware,)
         if self.instrument.clear_buffers_before_each_transaction:
             self.instrument.serial.reset_input_buffer()
             self.instrument.serial.reset_output_buffer()
@@ -111,24 +313,25 @@ class RD6006(rd6006.RD6006):
             res = self.instrument.serial.read(6)
             if res != b'upredy':
                 raise RuntimeError("Unable to enter update firmware mode: {!r}".format(res))
-            for pos, block in ((pos, firmware[pos:pos+64]) for pos in range(0, len(firmware), 64)):
+            pos = 0
+            for block in _blocks(firmware, 64):
                 progress_callback(pos)
                 self.instrument.serial.write(block)
                 res = self.instrument.serial.read(2)
                 if res != b'OK':
                     raise RuntimeError("Flash failed: {!r}".format(res))
+                pos += len(block)
+            progress_callback(pos)
 
 
-class RDWrapper(object):
-    def __init__(self):
-        super(RDWrapper, self).__init__()
-        self.rd = None # type: RD6006
-        self.lock = threading.Lock()
-
-    def open(self, port):
-        with self.lock:
-            if self.rd is not None:
-                self.rd.instrument.serial.close()
-            self.rd = RD6006(port)
-
-rdwrap = RDWrapper()
+def _blocks(chunks, size):
+    # type: (Iterable[bytes], int) -> Iterator[bytes]
+    """Regroup chunks into blocks of size bytes; the last may be short."""
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= size:
+            yield bytes(buf[:size])
+            del buf[:size]
+    if buf:
+        yield bytes(buf)
@@ -3,37 +3,26 @@
 
 from __future__ import print_function
 
-import contextlib
-import json
 import math
 import os
-import threading
 from time import localtime, time, perf_counter
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 try:
-    from typing import Callable
+    from concurrent.futures import Future
+    from typing import Any, Iterable, Optional, Tuple
 except:
     pass
-try:
-    from urllib.request import urlopen
-except ImportError:
-    from urllib import urlopen
-
-from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
-from matplotlib.figure import Figure
-from matplotlib.lines import Line2D
-from matplotlib.ticker import AutoMinorLocator
-import matplotlib.animation as animation
-import numpy as np
-from numpy_ringbuffer import RingBuffer
 import wx
 import wx.lib.agw.floatspin
 
+import acquisition
 import config
 import dialogs
-from rd60xx import rdwrap
+import flasher
+from rd60xx import RD6006
 import rdgui_xrc
-from utils import UnlockerCtx, ringbuffer_resize, emitter
+from utils import wx_future_callback
 import xh_floatspin
 
 rdgui_xrc.get_resources().AddHandler(xh_floatspin.FloatSpinCtrlXmlHandler())
@@ -41,79 +30,6 @@ rdgui_xrc.get_resources().AddHandler(xh_floatspin.FloatSpinCtrlXmlHandler())
 _ = wx.GetTranslation
 
 
-class ReaderThread(threading.Thread, config.ConfigChangeHandler):
-    class _Command(object):
-        NONE = 0
-        SHUTDOWN = 1
-        CONFIGUPDATE = 2
-
-    def __init__(self):
-        super(ReaderThread, self).__init__()
-        self.daemon = True
-        self.config = wx.GetApp().config # type: config.Config
-        self.config.Subscribe(self)
-        self.polling_interval = self.config.polling_interval # type: float
-        self.mock = self.config.mock_data # type: bool
-        self.graph_seconds = self.config.graph_seconds # type: float
-        self.command = self._Command.NONE
-        self.datalock = threading.Lock()
-        self.commandcond = threading.Condition(self.datalock)
-        self.t = RingBuffer(int(self.graph_seconds/self.polling_interval), float)
-        self.v = RingBuffer(int(self.graph_seconds/self.polling_interval), float)
-        self.a = RingBuffer(int(self.graph_seconds/self.polling_interval), float)
-
-    def shutdown(self):
-        with self.datalock:
-            self.command = self._Command.SHUTDOWN
-            self.commandcond.notify()
-        self.join()
-        self.config.Unsubscribe(self)
-
-    def run(self):
-        if self.mock:
-            vgen = emitter()
-            agen = emitter()
-        with self.datalock:
-            while self.command != self._Command.SHUTDOWN:
-                if self.command == self._Command.CONFIGUPDATE:
-                    pass
-                self.command = self._Command.NONE
-                with UnlockerCtx(self.datalock):
-                    t = perf_counter()
-                    if self.mock:
-                        v = next(vgen)
-                        a = next(agen)
-                    else:
-                        with rdwrap.lock:
-                            v, a = rdwrap.rd.measvoltagecurrent
-                    print (perf_counter() - t, v, a)
-                self.t.append(t)
-                self.v.append(v)
-                self.a.append(a)
-                if self.command == self._Command.NONE:
-                    self.commandcond.wait(max((t + self.polling_interval) - perf_counter(), 0))
-
-    def OnConfigChangeEnd(self, updates):
-        dirty = False
-        for name in ('polling_interval', 'graph_seconds'):
-            if name in updates:
-                dirty = True
-                break
-        if dirty:
-            with self.datalock:
-                if 'polling_interval' in updates:
-                    self.polling_interval = updates['polling_interval']
-                if 'graph_seconds' in updates:
-                    self.graph_seconds = updates['graph_seconds']
-
-                self.t = ringbuffer_resize(self.t, int(self.graph_seconds/self.polling_interval))
-                self.v = ringbuffer_resize(self.v, int(self.graph_seconds/self.polling_interval))
-                self.a = ringbuffer_resize(self.a, int(self.graph_seconds/self.polling_interval))
-
-                self.command = self._Command.CONFIGUPDATE
-                self.commandcond.notify()
-
-
 class CanvasFrame(rdgui_xrc.xrcCanvasFrame, config.ConfigChangeHandler):
     def __init__(self, parent=None):
         super(CanvasFrame, self).__init__(parent)
@@ -123,160 +39,403 @@ class CanvasFrame(rdgui_xrc.xrcCanvasFrame, config.ConfigChangeHandler):
         self.ctlAmperage = self.ctlAmperage # type: wx.lib.agw.floatspin.FloatSpin
         self.btnEnable = self.btnEnable     # type: wx.ToggleButton
 
+        self.ctlDevice = self.ctlDevice     # type: wx.Choice
+
         self.config = wx.GetApp().config # type: config.Config
-        port = self.config.port # type: str
-        if port == "":
+        ports = self._ConfiguredPorts()
+        if not ports and not self.config.mock_data:
             with dialogs.DlgPortSelector(self) as dlg:
                 dlg = dlg # type: dialogs.DlgPortSelector
                 if dlg.ShowModal() == wx.ID_OK:
-                    self.config.port = dlg.port
+                    ports = [acquisition.format_port_spec(dlg.port, dlg.address)]
+                    self.config.port = ports[0]
                     self.config.Save()
 
         self.config.Subscribe(self)
+        self.manager = self._DeviceManager()
+        self.manager.configure(adaptive=self._AdaptivePolling(), upgrade_baudrate=self.config.upgrade_baudrate)
+        self.device = None # type: Optional[acquisition.Device]
+        self.stats_dialog = None # type: dialogs.DlgStats
+        self._background = None # type: ThreadPoolExecutor
+        self._firmware_cache = None # type: fwcache.FirmwareCache
+        # optional subsystems are imported when first used, to keep them
+        # off the path to showing the window
+        self.recorder = None # type: recording.Recorder
+        self.stream_server = None # type: streamserver.StreamServer
+        # perf_counter() times of startup milestones, for benchmarks/startup.py
+        self.first_frame_at = None # type: float
+        # built once the window is up, the plotting library being the
+        # slowest import by far
+        self.chart = None
+
+        if self.config.record:
+            self._StartRecording()
+        if self.config.stream_address:
+            self._StartStreamServer()
+        # start polling straight away; devices are identified on their I/O
+        # threads and fill in the controls when that finishes
+        if self.config.mock_data:
+            self._OpenDevice("mock", mock=True)
+        else:
+            for spec in ports:
+                self._OpenDevice(*acquisition.parse_port_spec(spec))
+
+        self.Fit()
+        self.MinSize = self.Size
+        wx.CallAfter(self._CreateChart)
+
+    def _CreateChart(self):
+        if not self:
+            return
+        if self.config.plot_backend == "wx":
+            from wxstripchart import WxStripChart as StripChart
+        else:
+            from stripchart import StripChart
+        self.chart = StripChart(self, self.config.graph_seconds, self.config.voltage_range, self.config.amperage_range)
+        self.chart.cursor_callback = self.UpdateStatusBar
+        self.chart.frame_callback = self.UpdateReadout
+        if self.recorder is not None:
+            self.chart.history = self._History
+        rdgui_xrc.get_resources().AttachUnknownControl("ID_FIGURE", self.chart.window, self)
+        for device in self.manager.devices:
+            self.chart.add_trace(device)
+        self.Layout()
+        self.chart.start()
+
+    def _DeviceManager(self):
+        if self.config.acquisition_process:
+            import sharedacquisition
+            try:
+                return sharedacquisition.RemoteDeviceManager(self.config.polling_interval, self.config.graph_seconds)
+            except RuntimeError:
+                traceback.print_exc()
+        return acquisition.DeviceManager(self.config.polling_interval, self.config.graph_seconds)
+
+    def _OpenDevice(self, port, address=1, mock=False):
+        # type: (str, int, bool) -> Optional[acquisition.Device]
+        """Open a device and add it to the window unless it already is."""
+        opened = list(self.manager.devices)
         try:
-            rdwrap.open(port)
-            if rdwrap.rd.is_bootloader:
+            device = self.manager.open(port, address, mock)
+        except IOError as e:
+            # only separate acquisition processes fail to open
+            wx.MessageBox(str(e), _("Unable to open device"), wx.OK|wx.ICON_ERROR, self)
+            return None
+        if device not in opened:
+            self._AddDevice(device)
+        return device
+
+    def _StartRecording(self):
+        directory = self.config.record_directory or os.path.join(
+            wx.StandardPaths.Get().GetUserLocalDataDir(), "recordings")
+        import recording
+        self.recorder = recording.Recorder(self.manager, directory)
+        self.recorder.start()
+        if self.chart is not None:
+            self.chart.history = self._History
+
+    def _StopRecording(self):
+        if self.chart is not None:
+            self.chart.history = None
+            self.chart.scroll_to(0)
+        self.recorder.stop()
+        self.recorder = None
+
+    def _StartStreamServer(self):
+        import streamserver
+        try:
+            self.stream_server = streamserver.StreamServer(self.manager, self.config.stream_address)
+        except (IOError, OSError, ValueError) as e:
+            wx.MessageBox(str(e), _("Unable to serve samples on {}").format(self.config.stream_address),
+                          wx.OK|wx.ICON_ERROR, self)
+            return
+        self.stream_server.start()
+
+    def _StopStreamServer(self):
+        self.stream_server.stop()
+        self.stream_server = None
+
+    def _History(self, device, t0, t1, width):
+        # type: (acquisition.Device, float, float, float) -> Optional[Any]
+        """Plot data for the chart from device's recording, where its
+        sample store doesn't reach back to t0."""
+        if self.recorder is None:
+            return None
+        rec = self.recorder.recording(device)
+        if rec is None or (len(device.samples) and device.samples.snapshot()[0, 0] <= t0):
+            return None
+        # recordings are in UNIX time, the chart in perf_counter() time
+        epoch = self.recorder.epoch
+        data = rec.plot_data(epoch + t0, epoch + t1, width)
+        data[0] -= epoch
+        return data
+
+    def _AdaptivePolling(self):
+        # type: () -> Optional[acquisition.AdaptivePolling]
+        if not self.config.adaptive_polling:
+            return None
+        return acquisition.AdaptivePolling(self.config.adaptive_min_interval, self.config.adaptive_threshold)
+
+    def _ConfiguredPorts(self):
+        # type: () -> list[str]
+        return [port for port in self.config.port.split(",") if port]
+
+    def _SavePorts(self):
+        if not self.config.mock_data:
+            self.config.port = ",".join(str(device) for device in self.manager.devices)
+            self.config.Save()
+
+    def _AddDevice(self, device):
+        # type: (acquisition.Device) -> None
+        if self.chart is not None:
+            self.chart.add_trace(device)
+        device.on_reconnect = lambda device: wx.CallAfter(self._OnReconnect, device)
+        self.ctlDevice.Append(str(device), device)
+        self.ctlDevice.Show(self.ctlDevice.GetCount() > 1)
+        self._SelectDevice(device)
+
+    def _RemoveDevice(self, device):
+        # type: (acquisition.Device) -> None
+        if self.chart is not None:
+            self.chart.remove_trace(device)
+        for i in range(self.ctlDevice.GetCount()):
+            if self.ctlDevice.GetClientData(i) is device:
+                self.ctlDevice.Delete(i)
+                break
+        self.ctlDevice.Show(self.ctlDevice.GetCount() > 1)
+        self.manager.close(device)
+        if self.device is device:
+            self.device = None
+            if self.manager.devices:
+                self._SelectDevice(self.manager.devices[0])
+
+    def _OnReconnect(self, device):
+        # type: (acquisition.Device) -> None
+        if not self or device not in self.manager.devices:
+            return
+        self.SetStatusText(_("Reconnected to {}").format(device))
+        if device is self.device:
+            # the supply may have been power cycled or changed from its panel
+            self._SelectDevice(device)
+
+    def _SelectDevice(self, device):
+        # type: (acquisition.Device) -> None
+        """Point the controls at device and load its settings."""
+        self.device = device
+        for i in range(self.ctlDevice.GetCount()):
+            if self.ctlDevice.GetClientData(i) is device:
+                self.ctlDevice.SetSelection(i)
+                break
+        self.Layout()
+        if device.mock or device.remote:
+            # nothing to load settings from
+            return
+        def info(rd):
+            # type: (RD6006) -> Optional[Tuple[float, float, float, float, int, int]]
+            if rd.is_bootloader:
+                return None
+            voltage, current = rd.voltagecurrent
+            return voltage, current, rd.voltres, rd.ampres, rd.type, rd.enable
+        def done(future):
+            # type: (Future) -> None
+            if not self._command_succeeded(future) or self.device is not device:
+                return
+            info = future.result()
+            if info is None:
                 self.OnMenu_ID_FWUPDATE(None)
-            voltage, current = rdwrap.rd.voltagecurrent
+                return
+            voltage, current, voltres, ampres, typ, enable = info
             # assume model number is (max_voltage * 100) + max_amperage
-            inc = 1.0/rdwrap.rd.voltres
+            inc = 1.0/voltres
             self.ctlVoltage.SetIncrement(inc)
             self.ctlVoltage.SetDigits(int(-math.floor(math.log10(inc))))
-            self.ctlVoltage.SetRange(0, int(rdwrap.rd.type / 100) * 1.1)
+            self.ctlVoltage.SetRange(0, int(typ / 100) * 1.1)
             self.ctlVoltage.SetValue(voltage)
 
-            inc = 1.0/rdwrap.rd.ampres
+            inc = 1.0/ampres
             self.ctlAmperage.SetIncrement(inc)
             self.ctlAmperage.SetDigits(int(-math.floor(math.log10(inc))))
-            self.ctlAmperage.SetRange(0, (rdwrap.rd.type % 100) * 1.1)
+            self.ctlAmperage.SetRange(0, (typ % 100) * 1.1)
             self.ctlAmperage.SetValue(current)
 
-            self.btnEnable.SetValue(rdwrap.rd.enable)
-        except:
-            traceback.print_exc()
-
-        self.reader = ReaderThread()
-        self.figure = Figure()
-
-        self.vaxis = self.figure.add_subplot(111)
-        self.vline = Line2D([], [])
-        self.vaxis.add_line(self.vline)
-        self.vaxis.set_ylim(0, self.config.voltage_range)
-        self.vaxis.set_xlim(-self.config.graph_seconds, 0)
-        self.vaxis.set_xlabel('t')
-        self.vaxis.set_ylabel('V')
-        self.vaxis.yaxis.set_minor_locator(AutoMinorLocator(4))
-        self.vaxis.grid(axis='x', linestyle='--')
-        self.vaxis.grid(which='both', axis='y', linestyle='--')
-
-        self.aaxis = self.vaxis.twinx()
-        self.aline = Line2D([], [], color='#80000080')
-        self.aaxis.add_line(self.aline)
-        self.aaxis.set_ylim(0, self.config.amperage_range)
-        self.aaxis.set_ylabel('A')
-        self.aaxis.yaxis.set_minor_locator(AutoMinorLocator(4))
-
-        self.figure_canvas = FigureCanvas(self, wx.ID_ANY, self.figure)
-        rdgui_xrc.get_resources().AttachUnknownControl("ID_FIGURE", self.figure_canvas, self)
-
-        # Note that event is a MplEvent
-        self.figure_canvas.mpl_connect(
-            'motion_notify_event', self.UpdateStatusBar)
-
-        self.figure.tight_layout()
-        self.Fit()
-        self.MinSize = self.Size
-        self.reader.start()
-        self.ani = animation.FuncAnimation(self.figure, self.update,
-                interval=int(self.config.polling_interval*1000), blit=True)
-
-    def UpdateStatusBar(self, event):
-        if event.inaxes:
-            if event.inaxes == self.vaxis:
-                v = event.ydata
-                a = self.aaxis.transData.inverted().transform((event.x, event.y))[1]
-            else:
-                v = self.vaxis.transData.inverted().transform((event.x, event.y))[1]
-                a = event.ydata
-            self.SetStatusText(
-                "t={:.3f}  V={:.2f}  A={:.3f}".format(event.xdata, v, a))
+            self.btnEnable.SetValue(enable)
+        wx_future_callback(device.submit(info), done)
+
+    def UpdateStatusBar(self, cursor):
+        # type: (Optional[Tuple[float, float, float]]) -> None
+        if cursor is not None:
+            self.SetStatusText("t={:.3f}  V={:.2f}  A={:.3f}".format(*cursor))
         else:
             self.SetStatusText("")
 
-    def update(self, d):
-        with self.reader.datalock:
-            t = np.asarray(self.reader.t) - perf_counter()
-            v = np.asarray(self.reader.v)
-            a = np.asarray(self.reader.a)
-            self.vline.set_data(t, v)
-            self.aline.set_data(t, a)
-            if self and len(v) > 0 and len(a) > 0:
-                self.SetStatusText("Last V={:.2f}  A={:.3f}".format(v[-1], a[-1]), 1)
-        return self.vline, self.aline
+    def UpdateReadout(self):
+        if self.first_frame_at is None:
+            self.first_frame_at = perf_counter()
+        device = self.device
+        if device is not None and len(device.samples):
+            _, v, a = device.samples.snapshot()[:, -1]
+            self.SetStatusText("Last V={:.2f}  A={:.3f}  {:.1f}/s".format(v, a, device.achieved_rate), 1)
 
     def OnButton_btnUpdate(self, evt):
         voltage = self.ctlVoltage.GetValue()
         current = self.ctlAmperage.GetValue()
-        with rdwrap.lock:
-            rdwrap.rd.voltagecurrent = (voltage, current)
+        def update(rd):
+            # type: (RD6006) -> Tuple[float, float]
+            rd.voltagecurrent = (voltage, current)
             # read back in case the setting didn't take
-            voltage, current = rdwrap.rd.voltagecurrent
-        self.ctlVoltage.SetValue(voltage)
-        self.ctlAmperage.SetValue(current)
+            return rd.voltagecurrent
+        def done(future):
+            # type: (Future) -> None
+            if self._command_succeeded(future):
+                voltage, current = future.result()
+                self.ctlVoltage.SetValue(voltage)
+                self.ctlAmperage.SetValue(current)
+        wx_future_callback(self.device.submit(update, 'voltagecurrent'), done)
 
     def OnTogglebutton_btnEnable(self, evt):
         # type: (wx.CommandEvent) -> None
-        with rdwrap.lock:
-            rdwrap.rd.enable = evt.IsChecked()
+        enable = evt.IsChecked()
+        def update(rd):
+            # type: (RD6006) -> None
+            rd.enable = enable
+        wx_future_callback(self.device.submit(update, 'enable'), self._command_succeeded)
+
+    def _command_succeeded(self, future):
+        # type: (Future) -> bool
+        """Report a failed device command in the status bar."""
+        if not self or future.cancelled():
+            return False
+        exc = future.exception()
+        if exc is not None:
+            traceback.print_exception(type(exc), exc, exc.__traceback__)
+            self.SetStatusText(_("Command failed: {}").format(exc))
+            return False
+        return True
+
+    def OnChoice_ctlDevice(self, evt):
+        # type: (wx.CommandEvent) -> None
+        self._SelectDevice(evt.GetClientData())
 
     def OnMenu_wxID_OPEN(self, evt):
         with dialogs.DlgPortSelector(self) as dlg:
             dlg = dlg # type: dialogs.DlgPortSelector
             if dlg.ShowModal() == wx.ID_OK:
-                port = dlg.port
-                rdwrap.open(port)
-                self.config.port = port
-                self.config.Save()
+                if self.device is not None:
+                    self._RemoveDevice(self.device)
+                self._OpenDevice(dlg.port, dlg.address)
+                self._SavePorts()
+
+    def OnMenu_ID_ADD_DEVICE(self, evt):
+        with dialogs.DlgPortSelector(self) as dlg:
+            dlg = dlg # type: dialogs.DlgPortSelector
+            if dlg.ShowModal() == wx.ID_OK:
+                if self._OpenDevice(dlg.port, dlg.address) is not None:
+                    self._SavePorts()
+
+    def OnMenu_ID_CLOSE_DEVICE(self, evt):
+        if self.device is not None:
+            self._RemoveDevice(self.device)
+            self._SavePorts()
+
+    def _Background(self):
+        # type: () -> ThreadPoolExecutor
+        """Executor for slow work that isn't device I/O, such as downloads."""
+        if self._background is None:
+            self._background = ThreadPoolExecutor(max_workers=4)
+        return self._background
+
+    def _FirmwareCache(self):
+        # type: () -> fwcache.FirmwareCache
+        if self._firmware_cache is None:
+            import fwcache
+            self._firmware_cache = fwcache.FirmwareCache(
+                os.path.join(wx.StandardPaths.Get().GetUserLocalDataDir(), "firmware"))
+        return self._firmware_cache
+
+    def _FirmwareVersion(self, device):
+        # type: (acquisition.Device) -> Tuple[int, float]
+        """Model and firmware version of device.  Blocks on its I/O thread."""
+        if device.mock:
+            return 60062, 1.23
+        def version(rd):
+            # type: (RD6006) -> Tuple[int, float]
+            if rd.is_bootloader:
+                info = rd.bootloader_info
+                return info["model"], info["fwver"]
+            return rd.model, rd.fw
+        return device.submit(version).result()
 
     def OnMenu_ID_FWUPDATE(self, evt):
-        if self.config.mock_data:
-            model = 60062
-            fwver = 1.23
-        else:
-            with rdwrap.lock:
-                if rdwrap.rd.is_bootloader:
-                    info = rdwrap.rd.bootloader_info
-                    model = info["model"]
-                    fwver = info["fwver"]
+        device = self.device
+        cache = self._FirmwareCache()
+        def check():
+            model, fwver = self._FirmwareVersion(device)
+            return model, fwver, cache.metadata(model)
+        def checked(future):
+            # type: (Future) -> None
+            if not self._command_succeeded(future):
+                return
+            model, fwver, updata = future.result()
+            with dialogs.WrappedMultiMessageDialog(self, _("Device firmware version {:.2f} -> Online version {:.2f}, released {}").format(
+                fwver, float(updata["Version"]), updata["Time"]), _("Update firmware?"),
+                _("{}\nHistory:\n\n{}").format(updata["UpdateContent"], updata["History"]),
+                 wx.YES_NO|wx.ICON_QUESTION
+            ) as mb:
+                mb = mb # type: dialogs.WrappedMultiMessageDialog
+                ans = mb.ShowModal()
+            if ans == wx.ID_YES:
+                self.SetStatusText(_("Getting firmware..."))
+                # fetch and verify the whole image before touching the device
+                wx_future_callback(self._Background().submit(cache.firmware, model, updata),
+                                   lambda f: self._FirmwareFetched(device, f))
+        self.SetStatusText(_("Checking for firmware update..."))
+        wx_future_callback(self._Background().submit(check), checked)
+
+    def _FirmwareFetched(self, device, future):
+        # type: (acquisition.Device, Future) -> None
+        if not self._command_succeeded(future) or device not in self.manager.devices:
+            return
+        path = future.result()
+        self._update_firmware(int(os.stat(path).st_size), flasher.file_chunks(path), device)
+
+    def OnMenu_ID_FWCHECK_ALL(self, evt):
+        devices = list(self.manager.devices)
+        cache = self._FirmwareCache()
+        def check():
+            # each device answers on its own I/O thread
+            futures = [self._Background().submit(self._FirmwareVersion, device) for device in devices]
+            versions = []
+            for device, future in zip(devices, futures):
+                try:
+                    versions.append((device,) + future.result())
+                except Exception as e:
+                    versions.append((device, None, e))
+            online = cache.check_all(model for _, model, _ in versions if model is not None)
+            return versions, online
+        def checked(future):
+            # type: (Future) -> None
+            if not self._command_succeeded(future):
+                return
+            versions, online = future.result()
+            lines = []
+            for device, model, fwver in versions:
+                if model is None:
+                    lines.append(_("{}: {}").format(device, fwver))
+                elif isinstance(online[model], Exception):
+                    lines.append(_("{}: RD{} {:.2f}, check failed: {}").format(device, model // 10, fwver, online[model]))
+                elif float(online[model]["Version"]) > fwver:
+                    lines.append(_("{}: RD{} {:.2f}, {:.2f} available").format(device, model // 10, fwver, float(online[model]["Version"])))
                 else:
-                    model = rdwrap.rd.model
-                    fwver = rdwrap.rd.fw
-
-        url = "http://www.ruidengkeji.com/rdupdate/firmware/RD{0}/RD{0}.json".format(model)
-        with contextlib.closing(urlopen(url)) as fp:
-            updata = json.load(fp, strict=False)
-
-        with dialogs.WrappedMultiMessageDialog(self, _("Device firmware version {:.2f} -> Online version {:.2f}, released {}").format(
-            fwver, float(updata["Version"]), updata["Time"]), _("Update firmware?"),
-            _("{}\nHistory:\n\n{}").format(updata["UpdateContent"], updata["History"]),
-             wx.YES_NO|wx.ICON_QUESTION
-        ) as mb:
-            mb = mb # type: dialogs.WrappedMultiMessageDialog
-            ans = mb.ShowModal()
-        if ans == wx.ID_YES:
-            def read_firmware():
-                # type: () -> bytes
-                with contextlib.closing(urlopen(updata["DownloadUri"])) as fh:
-                    return fh.read()
-            self._update_firmware(int(updata["Size"]), read_firmware)
+                    lines.append(_("{}: RD{} {:.2f}, up to date").format(device, model // 10, fwver))
+            self.SetStatusText("")
+            wx.MessageBox("\n".join(lines), _("Firmware Versions"), wx.OK|wx.ICON_INFORMATION, self)
+        self.SetStatusText(_("Checking for firmware updates..."))
+        wx_future_callback(self._Background().submit(check), checked)
 
     def OnMenu_ID_FWFILE(self, evt):
         filename = wx.FileSelector(_("Open Firmware File"), wildcard=_("Firmware File (*.bin)|*.bin"), flags=wx.FD_OPEN|wx.FD_FILE_MUST_EXIST, parent=self) # type: str
         if filename.strip():
-            def read_firmware():
-                with open(filename, "rb") as fh:
-                    return fh.read()
-            self._update_firmware(int(os.stat(filename).st_size), read_firmware)
+            self._update_firmware(int(os.stat(filename).st_size), flasher.file_chunks(filename))
 
     def OnMenu_ID_CALIBRATE(self, evt):
         with dialogs.DlgCalibration(self) as dlg:
@@ -284,58 +443,99 @@ class CanvasFrame(rdgui_xrc.xrcCanvasFrame, config.ConfigChangeHandler):
             dlg.ShowModal()
 
     def OnMenu_ID_SYNC_TIME(self, evt):
-        with rdwrap.lock:
-            # eww, sleep holding lock
-            wx.MicroSleep(int((1 - math.modf(time())[0]) * 1e6))
-            rdwrap.rd._write_registers(48, list(localtime(time()+1)[:6]))
+        def sync(rd):
+            # type: (RD6006) -> None
+            rd._write_registers(48, list(localtime(time()+1)[:6]))
+        # let the I/O thread keep polling until the next second boundary
+        delay = 1 - math.modf(time())[0]
+        wx_future_callback(self.device.submit(sync, 'sync_time', delay), self._command_succeeded)
 
     def OnMenu_ID_SETTINGS(self, evt):
         with dialogs.DlgSettings(self) as dlg:
             dlg = dlg # type: dialogs.DlgSettings
             dlg.ShowModal()
 
+    def OnMenu_ID_STATS(self, evt):
+        if self.stats_dialog:
+            self.stats_dialog.Raise()
+        else:
+            self.stats_dialog = dialogs.DlgStats(self)
+            self.stats_dialog.Show()
+
     def OnMenu_wxID_EXIT(self, evt):
         self.Close()
 
     def OnClose(self, evt):
         # type: (wx.CloseEvent) -> None
-        self.reader.shutdown()
+        if self.chart is not None:
+            self.chart.stop()
+        if self._background is not None:
+            self._background.shutdown(wait=False)
+        self.manager.shutdown()
+        if self.recorder is not None:
+            self.recorder.stop()
+        if self.stream_server is not None:
+            self.stream_server.stop()
         self.config.Unsubscribe(self)
         evt.Skip()
 
     def OnConfigChangeEnd(self, updates):
-        graph_dirty = False
-        if 'graph_seconds' in updates:
-            self.vaxis.set_xlim(-updates['graph_seconds'], 0)
-            self.aaxis.set_xlim(-updates['graph_seconds'], 0)
-            graph_dirty = True
-        if 'polling_interval' in updates:
-            # TODO: update animation interval
-            pass
-        if 'voltage_range' in updates:
-            self.vaxis.set_ylim(0, updates['voltage_range'])
-            graph_dirty = True
-        if 'amperage_range' in updates:
-            self.aaxis.set_ylim(0, updates['amperage_range'])
-            graph_dirty = True
-        if graph_dirty:
-            self.figure_canvas.draw()
-
-    def _update_firmware(self, firmware_size, read_firmware_func):
-        # type: (int, Callable[[], bytes]) -> None
-        with wx.ProgressDialog(_("Updating Firmware"), _("Getting firmware..."), maximum=firmware_size, parent=self, style=wx.PD_APP_MODAL) as pd:
-            pd = pd # type: wx.ProgressDialog
-            firmware = read_firmware_func()
-            def progress(pos):
-                pd.Update(pos, _("Updating {}/{}: {:.2f}%").format(pos, len(firmware), pos*100./len(firmware)))
-            pd.Update(1, _("Restarting into bootloader..."))
-            with rdwrap.lock:
-                if not rdwrap.rd.is_bootloader:
-                    rdwrap.rd.reboot_into_bootloader()
-                    wx.Sleep(3)
-                rdwrap.rd.bootloader_update_firmware(firmware, progress)
-                wx.Sleep(5)
-            pd.Close()
+        adaptive = False
+        for name in ('adaptive_polling', 'adaptive_min_interval', 'adaptive_threshold'):
+            if name in updates:
+                adaptive = self._AdaptivePolling()
+                break
+        if 'polling_interval' in updates or 'graph_seconds' in updates or adaptive is not False:
+            self.manager.configure(updates.get('polling_interval'), updates.get('graph_seconds'), adaptive)
+        if 'upgrade_baudrate' in updates:
+            # applies from each device's next connect
+            self.manager.configure(upgrade_baudrate=updates['upgrade_baudrate'])
+        if 'record' in updates or 'record_directory' in updates:
+            if self.recorder is not None:
+                self._StopRecording()
+            if self.config.record:
+                self._StartRecording()
+        if 'stream_address' in updates:
+            if self.stream_server is not None:
+                self._StopStreamServer()
+            if self.config.stream_address:
+                self._StartStreamServer()
+        if self.chart is not None and ('graph_seconds' in updates or 'voltage_range' in updates or 'amperage_range' in updates):
+            self.chart.configure(updates.get('graph_seconds'), updates.get('voltage_range'), updates.get('amperage_range'))
+
+    def _update_firmware(self, firmware_size, chunks, device=None):
+        # type: (int, Iterable[bytes], acquisition.Device) -> None
+        """Flash the selected device on its I/O thread, showing progress.
+
+        chunks is only iterated there, so a download streams straight
+        into the device.
+        """
+        device = device or self.device
+        pd = wx.ProgressDialog(_("Updating Firmware {}").format(device), _("Restarting into bootloader..."),
+                               maximum=firmware_size, parent=self, style=wx.PD_AUTO_HIDE|wx.PD_ELAPSED_TIME)
+        messages = {
+            flasher.STAGE_REBOOT: _("Restarting into bootloader..."),
+            flasher.STAGE_RESTART: _("Restarting firmware..."),
+            flasher.STAGE_DONE: _("Done"),
+        }
+        def progress(p):
+            # type: (flasher.Progress) -> None
+            if not pd:
+                return
+            if p.stage == flasher.STAGE_FLASH:
+                eta = "{:.0f}s".format(p.eta) if p.eta is not None else "?"
+                message = _("Updating {}/{}: {:.0f} B/s, {} left").format(p.done, p.total, p.rate, eta)
+            else:
+                message = messages[p.stage]
+            pd.Update(min(p.done, p.total - 1), message)
+        def done(future):
+            # type: (Future) -> None
+            if pd:
+                pd.Destroy()
+            if self._command_succeeded(future):
+                self.SetStatusText(_("Firmware of {} updated").format(device))
+        future = device.flash_firmware(firmware_size, chunks, lambda p: wx.CallAfter(progress, p))
+        wx_future_callback(future, done)
 
 
 class App(wx.App):
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Headless RD60xx data logger.
+
+Polls one or more supplies with the same acquisition core as rdgui, no
+wxPython needed, and writes every sample to stdout or a file as CSV or as
+compact binary records.  Runs until interrupted (SIGINT, SIGTERM, SIGHUP)
+or for --duration seconds, and flushes everything before exiting.  With
+--record, samples also go to a recording per device (see recording.py),
+the same as rdgui makes, and with --serve they are streamed live to other
+programs (see streamserver.py).
+
+    $ python rdlogger.py /dev/ttyUSB0 /dev/ttyUSB1@2 --interval 0.05 -o log.csv
+    $ python rdlogger.py --mock 2 --format binary -o log.rdl
+    $ python rdlogger.py /dev/ttyUSB0 --record ~/recordings
+    $ python rdlogger.py /dev/ttyUSB0 --serve unix:/tmp/rd.sock
+
+Binary logs start with MAGIC and a JSON header line naming the devices,
+followed by RECORD structs of (device index, UNIX time, V, A).  Gaps in
+the data, while a device doesn't answer, are logged as NaN.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import errno
+import json
+import signal
+import struct
+import sys
+import threading
+import time
+from time import perf_counter
+try:
+    from typing import BinaryIO, Dict, IO, Iterator, List, Tuple
+except:
+    pass
+
+import acquisition
+import recording
+import streamserver
+
+
+MAGIC = b"RDLOG1\n"
+RECORD_FORMAT = "<Bdff"
+RECORD = struct.Struct(RECORD_FORMAT)
+# seconds between writes of queued samples
+FLUSH_INTERVAL = 0.25
+
+
+class CsvWriter(object):
+    def __init__(self, fh, devices):
+        # type: (IO[str], List[str]) -> None
+        super(CsvWriter, self).__init__()
+        self.fh = fh
+        self.devices = devices
+        fh.write("time,device,voltage,current\n")
+
+    def write(self, rows):
+        # type: (List[Tuple[int, float, float, float]]) -> None
+        devices = self.devices
+        self.fh.write("".join("{:.6f},{},{:.3f},{:.3f}\n".format(t, devices[i], v, a) for i, t, v, a in rows))
+
+
+class BinaryWriter(object):
+    def __init__(self, fh, devices):
+        # type: (BinaryIO, List[str]) -> None
+        super(BinaryWriter, self).__init__()
+        self.fh = fh
+        fh.write(MAGIC)
+        fh.write(json.dumps({"devices": devices, "record": RECORD_FORMAT}).encode("utf-8") + b"\n")
+
+    def write(self, rows):
+        # type: (List[Tuple[int, float, float, float]]) -> None
+        self.fh.write(b"".join(RECORD.pack(*row) for row in rows))
+
+
+WRITERS = {"csv": CsvWriter, "binary": BinaryWriter}
+
+
+def read_binary(fh):
+    # type: (BinaryIO) -> Iterator[Tuple[str, float, float, float]]
+    """Yield (device, time, V, A) from a binary log."""
+    if fh.readline() != MAGIC:
+        raise ValueError("Not an rdlogger binary log")
+    header = json.loads(fh.readline().decode("utf-8"))
+    devices = header["devices"]
+    record = struct.Struct(str(header["record"]))
+    while True:
+        data = fh.read(record.size)
+        if len(data) < record.size:
+            return
+        i, t, v, a = record.unpack(data)
+        yield devices[i], t, v, a
+
+
+class Logger(object):
+    """Collects samples from a DeviceManager's I/O threads and writes them
+    out from the caller's thread, so a slow output never holds up polling."""
+
+    def __init__(self, manager, devices, writer):
+        # type: (acquisition.DeviceManager, List[str], object) -> None
+        super(Logger, self).__init__()
+        self.manager = manager
+        self.writer = writer
+        self._names = dict((name, i) for i, name in enumerate(devices)) # type: Dict[str, int]
+        self._index = {} # type: Dict[acquisition.Device, int]
+        # deque appends and pops are atomic, so no lock is needed
+        self._queue = collections.deque()
+        # sample times are perf_counter() based
+        self._epoch = time.time() - perf_counter()
+        self.stopped = threading.Event()
+
+    def _on_sample(self, device, t, v, a):
+        # type: (acquisition.Device, float, float, float) -> None
+        i = self._index.get(device)
+        if i is None:
+            i = self._index[device] = self._names.get(str(device))
+        if i is not None:
+            self._queue.append((i, self._epoch + t, v, a))
+
+    def drain(self):
+        queue = self._queue
+        rows = []
+        while queue:
+            rows.append(queue.popleft())
+        if not rows:
+            return
+        try:
+            self.writer.write(rows)
+            self.writer.fh.flush()
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+            # whatever read the output has gone away
+            self.stopped.set()
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    def start(self):
+        if self.writer is not None:
+            self.manager.subscribe(self._on_sample)
+
+    def run(self, duration=None):
+        # type: (float) -> None
+        """Write samples until stopped or for duration seconds, then shut
+        the manager down."""
+        deadline = perf_counter() + duration if duration else None
+        try:
+            while not self.stopped.is_set():
+                timeout = FLUSH_INTERVAL
+                if deadline is not None:
+                    timeout = min(timeout, deadline - perf_counter())
+                    if timeout <= 0:
+                        break
+                self.stopped.wait(timeout)
+                self.drain()
+        finally:
+            self.manager.unsubscribe(self._on_sample)
+            self.manager.shutdown()
+            self.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("ports", nargs="*", metavar="PORT[@ADDRESS]", help="supplies to poll")
+    parser.add_argument("--mock", type=int, default=0, metavar="N", help="also poll N simulated devices")
+    parser.add_argument("-i", "--interval", type=float, default=0.1, help="seconds between polls")
+    parser.add_argument("-f", "--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("-o", "--output", help="file to write, - for stdout (the default without --record or --serve)")
+    parser.add_argument("-r", "--record", metavar="DIR", help="also record each device to a file in DIR")
+    parser.add_argument("-s", "--serve", metavar="ADDRESS",
+                        help="also stream samples live on [HOST:]PORT or unix:PATH")
+    parser.add_argument("-d", "--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--upgrade-baudrate", action="store_true",
+                        help="switch each link to the fastest rate that works")
+    args = parser.parse_args()
+    if not args.ports and not args.mock:
+        parser.error("no ports given")
+
+    if args.output is None and not args.record and not args.serve:
+        args.output = "-"
+    binary = args.format == "binary"
+    if args.output is None:
+        fh = None
+    elif args.output == "-":
+        fh = getattr(sys.stdout, "buffer", sys.stdout) if binary else sys.stdout
+        # rd6006 prints what it finds; keep that out of the data
+        sys.stdout = sys.stderr
+    else:
+        fh = open(args.output, "wb" if binary else "w")
+
+    # the sample stores only back the plot in rdgui; keep them small
+    manager = acquisition.DeviceManager(args.interval, max(10 * args.interval, 1.))
+    manager.configure(upgrade_baudrate=args.upgrade_baudrate)
+    specs = [acquisition.parse_port_spec(spec) for spec in args.ports]
+    specs += [("mock", i + 1) for i in range(args.mock)]
+    names = [acquisition.format_port_spec(port, address) for port, address in specs]
+
+    writer = WRITERS[args.format](fh, names) if fh is not None else None
+    logger = Logger(manager, names, writer)
+    recorder = None
+    if args.record:
+        recorder = recording.Recorder(manager, args.record)
+        recorder.start()
+    server = None
+    if args.serve:
+        server = streamserver.StreamServer(manager, args.serve)
+        server.start()
+    for name in ("SIGINT", "SIGTERM", "SIGHUP"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), logger.stop)
+    # listen before opening, so no device's first samples are missed
+    logger.start()
+    for port, address in specs:
+        manager.open(port, address, mock=port == "mock")
+    try:
+        logger.run(args.duration)
+    finally:
+        if recorder is not None:
+            recorder.stop()
+        if server is not None:
+            server.stop()
+        if fh is not None and args.output != "-":
+            fh.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
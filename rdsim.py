@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""RD60xx simulator on a pseudo-terminal, for running the real RD6006 code
+without hardware.
+
+Serves the Modbus RTU register map of one or more slaves (function codes
+3, 6 and 16) with a resistive load model behind the output, the reboot
+frame, and the bootloader's queryd/getinf/upfirm protocol.  Response
+latency, per-byte wire time and dropped responses are configurable.  The
+baud rate register is honoured: requests at any other line speed than the
+one it selects are ignored, as on the real device.  Linux only.
+
+    $ python rdsim.py --slaves 1,2 --load 10 --drop 0.01
+    /dev/pts/5
+"""
+
+from __future__ import print_function
+
+import argparse
+import array
+import os
+import random
+import select
+import struct
+import sys
+import termios
+import threading
+import time
+import tty
+try:
+    from typing import Dict, List, Optional
+except:
+    pass
+
+import modbusrtu
+
+
+REGISTERS = 128
+
+# register numbers, see RD6006
+REG_MODEL = 0
+REG_SERIAL_HI = 1
+REG_SERIAL_LO = 2
+REG_FW = 3
+REG_TEMP = 5
+REG_VSET = 8
+REG_ISET = 9
+REG_VOUT = 10
+REG_IOUT = 11
+REG_POWER = 13
+REG_VIN = 14
+REG_CVCC = 17
+REG_ENABLE = 18
+REG_BAUD = 25
+
+BAUD_RATES = (9600, 19200, 38400, 57600, 115200)
+_TERMIOS_SPEEDS = dict((getattr(termios, "B{}".format(rate)), rate) for rate in BAUD_RATES)
+
+WRITE_SINGLE_REGISTER = 6
+REBOOT_REGISTER = 0x100
+REBOOT_VALUE = 0x1601
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+
+# the bootloader acks a short final block once the line has been quiet
+# this long; an image ends with a short block or after FLASH_IDLE without
+# data, and the new firmware then takes BOOT_TIME to answer
+BLOCK_IDLE = 0.02
+FLASH_IDLE = 0.3
+BOOT_TIME = 0.5
+BOOTLOADER_VERSION = 110
+
+
+class SimulatedSupply(object):
+    """Register file and output stage of one RD60xx slave."""
+
+    def __init__(self, address=1, model=60062, serial=12345678, fw=1.28, load=10.0, noise=0.002):
+        # type: (int, int, int, float, float, float) -> None
+        super(SimulatedSupply, self).__init__()
+        self.address = address
+        # load resistance in ohms; None for an open circuit
+        self.load = load
+        self.noise = noise
+        self.regs = array.array('H', [0] * REGISTERS)
+        self.regs[REG_MODEL] = model
+        self.regs[REG_SERIAL_HI] = serial >> 16
+        self.regs[REG_SERIAL_LO] = serial & 0xFFFF
+        self.regs[REG_FW] = int(round(fw * 100))
+        self.regs[REG_TEMP] = 25
+        self.regs[REG_VIN] = 2400
+        self.regs[REG_VSET] = 500
+        self.regs[REG_ISET] = 1000
+        self.regs[REG_BAUD] = BAUD_RATES.index(115200)
+        # RD6012 and up have 10mA current resolution
+        self.voltres = 100.
+        self.ampres = 1000. if model // 10 == 6006 else 100.
+
+    @property
+    def serial(self):
+        # type: () -> int
+        return self.regs[REG_SERIAL_HI] << 16 | self.regs[REG_SERIAL_LO]
+
+    @property
+    def baudrate(self):
+        # type: () -> int
+        return BAUD_RATES[min(self.regs[REG_BAUD], len(BAUD_RATES) - 1)]
+
+    def update(self):
+        """Recompute the measured output from the setpoints and the load."""
+        regs = self.regs
+        v = i = 0.
+        cc = False
+        if regs[REG_ENABLE]:
+            vset = regs[REG_VSET] / self.voltres
+            iset = regs[REG_ISET] / self.ampres
+            if self.load is None:
+                v = vset
+            elif vset / self.load <= iset:
+                v, i = vset, vset / self.load
+            else:
+                v, i, cc = iset * self.load, iset, True
+            if self.noise:
+                v = max(v + random.gauss(0, self.noise), 0.)
+                i = max(i + random.gauss(0, self.noise / 10), 0.) if i else 0.
+        regs[REG_VOUT] = min(int(round(v * self.voltres)), 0xFFFF)
+        regs[REG_IOUT] = min(int(round(i * self.ampres)), 0xFFFF)
+        regs[REG_POWER] = min(int(round(v * i * 100)), 0xFFFF)
+        regs[REG_CVCC] = int(cc)
+
+    def read(self, start, count):
+        # type: (int, int) -> Optional[List[int]]
+        if start + count > REGISTERS:
+            return None
+        self.update()
+        return self.regs[start:start + count].tolist()
+
+    def write(self, start, values):
+        # type: (int, List[int]) -> bool
+        if start + len(values) > REGISTERS:
+            return False
+        self.regs[start:start + len(values)] = array.array('H', values)
+        return True
+
+
+def _frame(data):
+    # type: (bytes) -> bytes
+    return data + struct.pack("<H", modbusrtu.crc16(data))
+
+
+class Simulator(threading.Thread):
+    """Serves SimulatedSupply slaves on the slave side of a pty, at port."""
+
+    def __init__(self, supplies=None, latency=0.002, byte_time=None, drop=0.0):
+        # type: (List[SimulatedSupply], float, float, float) -> None
+        super(Simulator, self).__init__(name="Simulator")
+        self.daemon = True
+        self.supplies = dict((s.address, s) for s in (supplies or [SimulatedSupply()])) # type: Dict[int, SimulatedSupply]
+        # seconds before replying, and per byte of reply (default: the
+        # wire time at the line speed)
+        self.latency = latency
+        self.byte_time = byte_time
+        # probability of not answering a request
+        self.drop = drop
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        # keep the slave open so the pty survives clients closing it
+        self._slave = slave
+        self._buf = bytearray()
+        self._shutdown = False
+        # address of the slave sitting in its bootloader, if any
+        self.bootloader = None # type: Optional[int]
+        self._flashing = False
+        self._image = bytearray()
+        self._block = bytearray()
+        self._last_rx = 0.
+        self._booting_until = 0.
+
+    def shutdown(self):
+        self._shutdown = True
+        self.join()
+        os.close(self.master)
+        os.close(self._slave)
+
+    def _line_speed(self):
+        # type: () -> Optional[int]
+        # the master shares the slave's termios settings
+        return _TERMIOS_SPEEDS.get(termios.tcgetattr(self.master)[5])
+
+    def _send(self, data):
+        # type: (bytes) -> None
+        byte_time = self.byte_time
+        if byte_time is None:
+            byte_time = 10. / (self._line_speed() or 115200)
+        time.sleep(self.latency + byte_time * len(data))
+        os.write(self.master, data)
+
+    def run(self):
+        while not self._shutdown:
+            ready, _, _ = select.select([self.master], [], [], BLOCK_IDLE / 2)
+            now = time.time()
+            if ready:
+                try:
+                    data = os.read(self.master, 4096)
+                except OSError:
+                    # no client has the port open
+                    time.sleep(0.01)
+                    continue
+                self._last_rx = now
+                self._buf += data
+            if now < self._booting_until:
+                del self._buf[:]
+            elif self.bootloader is not None:
+                self._bootloader(now)
+            else:
+                self._modbus()
+
+    def _modbus(self):
+        buf = self._buf
+        while buf:
+            supply = self.supplies.get(buf[0])
+            if supply is None or supply.baudrate != self._line_speed():
+                # not for us, or unintelligible at this line speed
+                del buf[0]
+                continue
+            if len(buf) < 8:
+                return
+            fc = buf[1]
+            length = 8
+            if fc == modbusrtu.WRITE_MULTIPLE_REGISTERS:
+                if len(buf) < 7:
+                    return
+                length = 9 + buf[6]
+            if len(buf) < length:
+                return
+            frame = bytes(buf[:length])
+            if modbusrtu.crc16(frame, length - 2) != struct.unpack_from("<H", frame, length - 2)[0]:
+                # resynchronise on the next byte
+                del buf[0]
+                continue
+            del buf[:length]
+            if random.random() < self.drop:
+                continue
+            self._request(supply, frame)
+
+    def _request(self, supply, frame):
+        # type: (SimulatedSupply, bytes) -> None
+        address, fc, start, arg = struct.unpack_from(">BBHH", frame)
+        if fc == modbusrtu.READ_HOLDING_REGISTERS:
+            values = supply.read(start, arg) if 0 < arg <= modbusrtu.MAX_READ_REGISTERS else None
+            if values is None:
+                return self._exception(address, fc, ILLEGAL_DATA_ADDRESS)
+            self._send(_frame(struct.pack(">BBB{}H".format(arg), address, fc, 2 * arg, *values)))
+        elif fc == WRITE_SINGLE_REGISTER:
+            if start == REBOOT_REGISTER and arg == REBOOT_VALUE:
+                self._send(b'\xfc')
+                self.bootloader = address
+                return
+            if not supply.write(start, [arg]):
+                return self._exception(address, fc, ILLEGAL_DATA_ADDRESS)
+            self._send(frame)
+        elif fc == modbusrtu.WRITE_MULTIPLE_REGISTERS:
+            values = list(struct.unpack_from(">{}H".format(arg), frame, 7))
+            if not supply.write(start, values):
+                return self._exception(address, fc, ILLEGAL_DATA_ADDRESS)
+            self._send(_frame(frame[:6]))
+        else:
+            return self._exception(address, fc, ILLEGAL_FUNCTION)
+
+    def _exception(self, address, fc, code):
+        # type: (int, int, int) -> None
+        self._send(_frame(struct.pack(">BBB", address, fc | 0x80, code)))
+
+    def _boot(self, supply, now):
+        # type: (SimulatedSupply, float) -> None
+        """Start the newly flashed firmware: bump its version, and ignore
+        the line while it boots."""
+        supply.regs[REG_FW] += 1
+        self._flashing = False
+        self._image = bytearray()
+        self.bootloader = None
+        self._booting_until = now + BOOT_TIME
+
+    def _bootloader(self, now):
+        # type: (float) -> None
+        supply = self.supplies[self.bootloader]
+        if self._flashing:
+            self._block += self._buf
+            del self._buf[:]
+            while len(self._block) >= 64:
+                self._image += self._block[:64]
+                del self._block[:64]
+                self._send(b'OK')
+            idle = now - self._last_rx
+            if self._block and idle >= BLOCK_IDLE:
+                # a short block is the last one
+                self._image += self._block
+                del self._block[:]
+                self._send(b'OK')
+                self._boot(supply, now)
+            elif self._image and idle >= FLASH_IDLE:
+                self._boot(supply, now)
+            return
+        while True:
+            end = self._buf.find(b"\r\n")
+            if end < 0:
+                return
+            command = bytes(self._buf[:end])
+            del self._buf[:end + 2]
+            if command.endswith(b"queryd"):
+                self._send(b'boot')
+            elif command.endswith(b"getinf"):
+                self._send(b'inf' + struct.pack("<IHHH", supply.serial, supply.regs[REG_MODEL],
+                                                BOOTLOADER_VERSION, supply.regs[REG_FW]))
+            elif command.endswith(b"upfirm"):
+                self._send(b'upredy')
+                self._flashing = True
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--slaves", default="1", help="comma-separated slave addresses")
+    parser.add_argument("--model", type=int, default=60062)
+    parser.add_argument("--load", type=float, default=10.0, help="load resistance in ohms, 0 for open circuit")
+    parser.add_argument("--noise", type=float, default=0.002, help="measurement noise in volts")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds before each reply")
+    parser.add_argument("--byte-time", type=float, help="seconds per reply byte (default: wire time)")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability of dropping a reply")
+    parser.add_argument("--baud", type=int, choices=BAUD_RATES, default=115200)
+    parser.add_argument("--bootloader", action="store_true", help="start in the bootloader")
+    parser.add_argument("--link", help="also make the pty available at this path")
+    args = parser.parse_args()
+
+    supplies = []
+    for i, address in enumerate(int(a) for a in args.slaves.split(",")):
+        supply = SimulatedSupply(address, args.model, 12345678 + i, load=args.load or None, noise=args.noise)
+        supply.regs[REG_BAUD] = BAUD_RATES.index(args.baud)
+        supplies.append(supply)
+    sim = Simulator(supplies, args.latency, args.byte_time, args.drop)
+    if args.bootloader:
+        sim.bootloader = supplies[0].address
+    if args.link:
+        if os.path.lexists(args.link):
+            os.remove(args.link)
+        os.symlink(sim.port, args.link)
+    print(args.link or sim.port)
+    sys.stdout.flush()
+    sim.start()
+    try:
+        while sim.is_alive():
+            sim.join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Continuous recording of samples to disk.
+
+A recording is an append-only file of chunks of numpy records, (t, V, A)
+plus any extra channels, with t in seconds since the epoch:
+
+    header      MAGIC, then a JSON line naming the channels, padded to
+                HEADER_SIZE
+    chunk...    CHUNK_HEADER (b"CHNK", record count, first and last t,
+                CRC-32 of the records), then the records
+
+A chunk is written in one go once it holds CHUNK_RECORDS records or spans
+CHUNK_SECONDS, so a crash loses at most the chunk being filled; a torn
+chunk at the end of the file is dropped when it is next opened.  The time
+index is rebuilt from the chunk headers alone, hopping from one to the
+next, and a range query memory-maps just the chunks it overlaps.
+
+Only one Recording at a time may have a file open for writing; it holds
+an advisory lock on it, so rdgui and rdlogger recording into the same
+directory don't interleave chunks.  Readers take no lock.
+"""
+
+from __future__ import print_function
+
+import bisect
+import collections
+import json
+import os
+import re
+import struct
+import threading
+import time
+import traceback
+import zlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+try:
+    from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+    if TYPE_CHECKING:
+        # only named in type comments; keeps the device stack out of readers
+        import acquisition
+except:
+    pass
+
+import numpy as np
+
+import samplestore
+
+
+MAGIC = b"RDREC1\n"
+HEADER_SIZE = 512
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER = struct.Struct("<4sIddI4x")
+CHUNK_RECORDS = 4096
+CHUNK_SECONDS = 10.0
+CHANNELS = ("v", "a")
+EXTENSION = ".rdrec"
+# where the writer's lock is taken on Windows, which only locks byte
+# ranges: far past any data, so readers aren't locked out
+_LOCK_OFFSET = 1 << 40
+
+
+def record_dtype(channels):
+    # type: (Sequence[str]) -> np.dtype
+    return np.dtype([("t", "<f8")] + [(str(c), "<f4") for c in channels])
+
+
+class Recording(object):
+    """One recording file, open for appending (from one thread) and for
+    range queries (from any)."""
+
+    def __init__(self, path, channels=CHANNELS, writable=True,
+                 chunk_records=CHUNK_RECORDS, chunk_seconds=CHUNK_SECONDS):
+        # type: (str, Sequence[str], bool, int, float) -> None
+        super(Recording, self).__init__()
+        self.path = path
+        self.chunk_records = chunk_records
+        self.chunk_seconds = chunk_seconds
+        self.writable = writable
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if not exists and not writable:
+            raise IOError("No recording at {}".format(path))
+        if writable:
+            # created if need be, but never truncated: another writer may
+            # hold it
+            self._fh = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666), "r+b")
+            try:
+                self._Lock()
+            except:
+                self._fh.close()
+                raise
+            exists = os.fstat(self._fh.fileno()).st_size > 0
+        else:
+            self._fh = open(path, "rb")
+        if exists:
+            self.channels = self._ReadHeader()
+            if writable and tuple(channels) != self.channels:
+                self._fh.close()
+                raise ValueError("{} records {}, not {}".format(path, self.channels, tuple(channels)))
+        else:
+            self.channels = tuple(channels)
+            self._WriteHeader()
+        self.dtype = record_dtype(self.channels)
+        # sparse index: per chunk, its first and last t, where its records
+        # start and how many there are.  Entries are only ever appended, and
+        # published by bumping _count last, so readers need no lock.
+        self._t_first = [] # type: List[float]
+        self._t_last = [] # type: List[float]
+        self._offsets = [] # type: List[int]
+        self._counts = [] # type: List[int]
+        self._count = 0
+        end = self._Scan()
+        if writable:
+            # drop a chunk torn by a crash
+            self._fh.truncate(end)
+        self._end = end
+        self._buffer = np.empty(chunk_records, self.dtype)
+        self._filled = 0
+
+    def _Lock(self):
+        """Take the writer's lock, or raise IOError if another has it."""
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self._fh.seek(_LOCK_OFFSET)
+                msvcrt.locking(self._fh.fileno(), msvcrt.LK_NBLCK, 1)
+        except (IOError, OSError):
+            raise IOError("{} is being recorded by another process".format(self.path))
+
+    def _ReadHeader(self):
+        # type: () -> tuple
+        self._fh.seek(0)
+        header = self._fh.read(HEADER_SIZE)
+        if not header.startswith(MAGIC):
+            raise ValueError("{} is not a recording".format(self.path))
+        return tuple(json.loads(header[len(MAGIC):].decode("utf-8"))["channels"])
+
+    def _WriteHeader(self):
+        header = MAGIC + json.dumps({"channels": list(self.channels)}).encode("utf-8")
+        self._fh.seek(0)
+        self._fh.write(header.ljust(HEADER_SIZE - 1) + b"\n")
+        self._fh.flush()
+
+    def _Scan(self):
+        # type: () -> int
+        """Index the chunks in the file; return where the last good one ends."""
+        size = os.fstat(self._fh.fileno()).st_size
+        pos = HEADER_SIZE
+        while pos + CHUNK_HEADER.size <= size:
+            self._fh.seek(pos)
+            magic, count, t_first, t_last, crc = CHUNK_HEADER.unpack(self._fh.read(CHUNK_HEADER.size))
+            end = pos + CHUNK_HEADER.size + count * self.dtype.itemsize
+            if magic != CHUNK_MAGIC or end > size:
+                break
+            if end + CHUNK_HEADER.size > size:
+                # only the last chunk can have been torn by a crash (the
+                # file may have grown before its data made it to disk), so
+                # only it needs the CRC checked
+                data = self._fh.read(end - pos - CHUNK_HEADER.size)
+                if zlib.crc32(data) & 0xFFFFFFFF != crc:
+                    break
+            self._Index(t_first, t_last, pos + CHUNK_HEADER.size, count)
+            pos = end
+        return pos
+
+    def _Index(self, t_first, t_last, offset, count):
+        # type: (float, float, int, int) -> None
+        self._t_first.append(t_first)
+        self._t_last.append(t_last)
+        self._offsets.append(offset)
+        self._counts.append(count)
+        self._count += 1
+
+    def __len__(self):
+        return sum(self._counts[:self._count])
+
+    @property
+    def span(self):
+        # type: () -> Optional[tuple]
+        """(first t, last t) on disk, or None if nothing is yet."""
+        n = self._count
+        if not n:
+            return None
+        return self._t_first[0], self._t_last[n - 1]
+
+    def append(self, t, *values):
+        # type: (float, float) -> None
+        buf = self._buffer
+        buf[self._filled] = (t,) + values
+        self._filled += 1
+        if self._filled == len(buf) or t - buf[0]["t"] >= self.chunk_seconds:
+            self.flush()
+
+    def flush(self):
+        """Write the records buffered so far as a chunk."""
+        n = self._filled
+        if not n:
+            return
+        records = self._buffer[:n]
+        data = records.tobytes()
+        header = CHUNK_HEADER.pack(CHUNK_MAGIC, n, records[0]["t"], records[-1]["t"], zlib.crc32(data) & 0xFFFFFFFF)
+        self._fh.seek(self._end)
+        self._fh.write(header + data)
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._Index(float(records[0]["t"]), float(records[-1]["t"]), self._end + CHUNK_HEADER.size, n)
+        self._end += len(header) + len(data)
+        self._filled = 0
+
+    def close(self):
+        if self.writable:
+            self.flush()
+        self._fh.close()
+
+    def range(self, t0, t1):
+        # type: (float, float) -> np.ndarray
+        """Records with t0 <= t <= t1 that are on disk, as an array of dtype."""
+        n = self._count
+        first = bisect.bisect_left(self._t_last, t0, 0, n)
+        last = bisect.bisect_right(self._t_first, t1, 0, n)
+        parts = []
+        for i in range(first, last):
+            chunk = np.memmap(self.path, self.dtype, "r", self._offsets[i], (self._counts[i],))
+            t = chunk["t"]
+            parts.append(chunk[np.searchsorted(t, t0):np.searchsorted(t, t1, "right")])
+        if not parts:
+            return np.empty(0, self.dtype)
+        return np.concatenate(parts)
+
+    def plot_data(self, t0, t1, width):
+        # type: (float, float, float) -> np.ndarray
+        """(t, V, A) rows over [t0, t1] like SampleStore.plot_data, reduced
+        to a min/max pair per pixel column when there are more records."""
+        records = self.range(t0, t1)
+        n = len(records)
+        columns = max(int(width), 1)
+        if n <= 2 * columns:
+            return np.vstack((records["t"], records[self.channels[0]], records[self.channels[1]])).astype(float)
+        per = -(-n // columns)
+        m = -(-n // per)
+        padded = np.full((3, m * per), np.nan)
+        padded[0, :n] = records["t"]
+        padded[1, :n] = records[self.channels[0]]
+        padded[2, :n] = records[self.channels[1]]
+        buckets = padded.reshape(3, m, per)
+        out = np.empty((samplestore.CHANNELS, 2 * m))
+        out[samplestore.T, 0::2] = buckets[0, :, 0]
+        # fmin/fmax skip NaN padding and gaps, giving NaN for all-NaN buckets
+        out[samplestore.T, 1::2] = np.fmax.reduce(buckets[0], axis=1)
+        for channel in (samplestore.V, samplestore.A):
+            out[channel, 0::2] = np.fmin.reduce(buckets[channel], axis=1)
+            out[channel, 1::2] = np.fmax.reduce(buckets[channel], axis=1)
+        return out
+
+
+def filename(device):
+    # type: (object) -> str
+    """File name for a device's recording, from its port spec."""
+    return re.sub(r"[^\w.@-]+", "_", str(device).strip("/\\")) + EXTENSION
+
+
+class Recorder(object):
+    """Records every device of a DeviceManager into its own Recording in
+    directory, appending to what earlier sessions recorded.
+
+    Samples are queued from the I/O threads and written on a thread of
+    the recorder's own, so disk writes never hold up polling.
+    """
+
+    # seconds between hand-offs of queued samples to the recordings
+    DRAIN_INTERVAL = 0.5
+
+    def __init__(self, manager, directory):
+        # type: (acquisition.DeviceManager, str) -> None
+        super(Recorder, self).__init__()
+        self.manager = manager
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # sample times are perf_counter() based
+        self.epoch = time.time() - time.perf_counter()
+        # None for a device whose recording couldn't be opened
+        self.recordings = {} # type: Dict[acquisition.Device, Optional[Recording]]
+        self._queue = collections.deque()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._Run, name="Recorder")
+        self._thread.daemon = True
+
+    def start(self):
+        self.manager.subscribe(self._OnSample)
+        self._thread.start()
+
+    def stop(self):
+        self.manager.unsubscribe(self._OnSample)
+        self._stopped.set()
+        self._thread.join()
+        for recording in list(self.recordings.values()):
+            if recording is not None:
+                recording.close()
+
+    def recording(self, device):
+        # type: (acquisition.Device) -> Optional[Recording]
+        return self.recordings.get(device)
+
+    def _OnSample(self, device, t, v, a):
+        # type: (acquisition.Device, float, float, float) -> None
+        self._queue.append((device, self.epoch + t, v, a))
+
+    def _Run(self):
+        while not self._stopped.wait(self.DRAIN_INTERVAL):
+            self._Drain()
+        self._Drain()
+
+    def _Drain(self):
+        queue = self._queue
+        recordings = self.recordings
+        while queue:
+            device, t, v, a = queue.popleft()
+            if device not in recordings:
+                try:
+                    recordings[device] = Recording(os.path.join(self.directory, filename(device)))
+                except (IOError, OSError, ValueError):
+                    traceback.print_exc()
+                    recordings[device] = None
+            recording = recordings[device]
+            if recording is not None:
+                recording.append(t, v, a)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+from __future__ import print_function
+
+import numpy as np
+
+
+# rows of the column-stacked sample array
+T = 0
+V = 1
+A = 2
+CHANNELS = 3
+
+# rows of a MinMaxPyramid level: the time span and extremes of each bucket
+T_START = 0
+T_END = 1
+V_MIN = 2
+V_MAX = 3
+A_MIN = 4
+A_MAX = 5
+ENVELOPE_CHANNELS = 6
+
+
+class SampleStore(object):
+    """Single-producer, multi-reader buffer of (t, V, A) samples.
+
+    Samples live column-stacked in one array.  The producer only ever
+    writes past the published end, and when the array is full it copies the
+    retained samples into a fresh array, sized in whole chunks with room to
+    double, instead of wrapping around.  A published range is therefore
+    never modified afterwards, so readers get a consistent zero-copy view
+    without taking a lock, and can compare seq to see whether anything
+    changed.
+
+    Retention is by age rather than sample count, so the buffer matches
+    the time window however irregular the sample rate is.
+    """
+
+    CHUNK = 4096
+
+    def __init__(self, retention, chunk=CHUNK, channels=CHANNELS, decimate=True):
+        # type: (float, int, int, bool) -> None
+        super(SampleStore, self).__init__()
+        self.retention = retention
+        self._requested_retention = retention
+        self.chunk = chunk
+        self.channels = channels
+        # (array, start, end) is replaced as a whole so readers always see
+        # a matching set
+        self._published = (np.empty((channels, chunk)), 0, 0)
+        self.seq = 0
+        self.pyramid = MinMaxPyramid(retention, chunk) if decimate else None # type: MinMaxPyramid
+
+    def __len__(self):
+        _, start, end = self._published
+        return end - start
+
+    def set_retention(self, seconds):
+        # type: (float) -> None
+        """Change how many seconds of samples are kept.
+
+        Takes effect on the producer's next append.  Samples that aged out
+        but are still in the array come back if the window grows.
+        """
+        self._requested_retention = seconds
+        if self.pyramid is not None:
+            self.pyramid.set_retention(seconds)
+
+    def append(self, t, *values):
+        # type: (float, float) -> None
+        """Add a sample.  Only call from the producer thread."""
+        buf, start, end = self._published
+        if end == buf.shape[1]:
+            buf, start, end = self._reallocate(buf, start, end)
+        buf[0, end] = t
+        buf[1:, end] = values
+        end += 1
+        cutoff = t - self._requested_retention
+        times = buf[T]
+        if self._requested_retention != self.retention:
+            self.retention = self._requested_retention
+            start = int(np.searchsorted(times[:end], cutoff))
+        else:
+            # the window only slides forward: amortized O(1)
+            while times[start] < cutoff:
+                start += 1
+        self._published = (buf, start, end)
+        self.seq += 1
+        if self.pyramid is not None:
+            self.pyramid.add(t, *values)
+
+    def append_gap(self, t):
+        # type: (float) -> None
+        """Add a NaN sample, which breaks the plotted line at t."""
+        self.append(t, *([float('nan')] * (self.channels - 1)))
+
+    def _reallocate(self, buf, start, end):
+        n = end - start
+        size = -(-(2 * n + 1) // self.chunk) * self.chunk
+        newbuf = np.empty((self.channels, size))
+        newbuf[:, :n] = buf[:, start:end]
+        return newbuf, 0, n
+
+    def snapshot(self):
+        # type: () -> np.ndarray
+        """Return a read-only (channels, n) view of the retained samples."""
+        buf, start, end = self._published
+        view = buf[:, start:end]
+        view.flags.writeable = False
+        return view
+
+    def plot_data(self, t0, t1, width):
+        # type: (float, float, float) -> np.ndarray
+        """Return (t, V, A) rows covering [t0, t1] for a plot width pixels wide.
+
+        Uses the coarsest pyramid level that still gives at least one min/max
+        bucket per pixel column, and merges its buckets down to exactly one,
+        i.e. two points, per column, so render cost depends on the width
+        rather than on how much history is in view.  Falls back to a
+        zero-copy view of the raw samples when there are few enough.
+        """
+        raw = self.snapshot()
+        i0, i1 = np.searchsorted(raw[T], (t0, t1))
+        level = -1
+        if self.pyramid is not None:
+            level = self.pyramid.level_for(i1 - i0, width)
+        if level < 0:
+            return raw[:, i0:i1]
+
+        env = self.pyramid.levels[level].snapshot()
+        j0, j1 = np.searchsorted(env[T_START], (t0, t1))
+        env = env[:, j0:j1]
+        columns = max(int(width), 1)
+        if env.shape[1] > columns:
+            env = _merge_buckets(env, columns)
+        m = env.shape[1]
+        # raw samples newer than the last complete bucket, which span less
+        # than a bucket: one more min/max pair
+        tail = raw[:, max(i0, np.searchsorted(raw[T], env[T_END, -1], 'right') if m else i0):i1]
+        if tail.shape[1] > 2:
+            tail = _min_max_pair(tail)
+        out = np.empty((CHANNELS, 2 * m + tail.shape[1]))
+        out[T, 0:2*m:2] = env[T_START]
+        out[T, 1:2*m:2] = env[T_END]
+        out[V, 0:2*m:2] = env[V_MIN]
+        out[V, 1:2*m:2] = env[V_MAX]
+        out[A, 0:2*m:2] = env[A_MIN]
+        out[A, 1:2*m:2] = env[A_MAX]
+        out[:, 2*m:] = tail
+        return out
+
+
+def _merge_buckets(env, columns):
+    # type: (np.ndarray, int) -> np.ndarray
+    """Merge the buckets of envelope env, more than columns of them, into
+    exactly columns buckets."""
+    m = env.shape[1]
+    starts = np.arange(columns) * m // columns
+    ends = np.append(starts[1:], m) - 1
+    out = np.empty((ENVELOPE_CHANNELS, columns))
+    out[T_START] = env[T_START, starts]
+    out[T_END] = env[T_END, ends]
+    # fmin/fmax skip gaps unless a whole merged bucket is one
+    for lo, hi in ((V_MIN, V_MAX), (A_MIN, A_MAX)):
+        out[lo] = np.fmin.reduceat(env[lo], starts)
+        out[hi] = np.fmax.reduceat(env[hi], starts)
+    return out
+
+
+def _min_max_pair(samples):
+    # type: (np.ndarray) -> np.ndarray
+    """Reduce (t, V, A) samples to the two points of their min/max bucket."""
+    out = np.empty((CHANNELS, 2))
+    out[T] = samples[T, 0], samples[T, -1]
+    for channel in (V, A):
+        out[channel] = np.fmin.reduce(samples[channel]), np.fmax.reduce(samples[channel])
+    return out
+
+
+class MinMaxPyramid(object):
+    """Multi-resolution min/max envelope of (t, V, A) samples.
+
+    Level i holds one bucket per FACTOR**(i+1) samples with its time span
+    and the extremes of V and A, so spikes survive decimation.  Buckets are
+    completed incrementally as samples arrive, at amortized O(1) cost.
+    Gaps (NaN samples) are skipped unless they fill a whole bucket.
+    """
+
+    FACTOR = 4
+    LEVELS = 8
+
+    def __init__(self, retention, chunk):
+        # type: (float, int) -> None
+        super(MinMaxPyramid, self).__init__()
+        self.levels = [
+            SampleStore(retention, max(chunk // self.FACTOR ** (i + 1), 64), ENVELOPE_CHANNELS, decimate=False)
+            for i in range(self.LEVELS)
+        ]
+        # bucket being filled at each level: [count, t_start, t_end, v_min, v_max, a_min, a_max]
+        self._partial = [None] * self.LEVELS # type: list[list]
+
+    def set_retention(self, seconds):
+        # type: (float) -> None
+        for level in self.levels:
+            level.set_retention(seconds)
+
+    def add(self, t, v, a):
+        # type: (float, float, float) -> None
+        bucket = [1, t, t, v, v, a, a]
+        for i in range(self.LEVELS):
+            partial = self._partial[i]
+            if partial is None:
+                self._partial[i] = partial = bucket
+            else:
+                partial[0] += 1
+                partial[T_END + 1] = bucket[T_END + 1]
+                if bucket[V_MIN + 1] < partial[V_MIN + 1] or partial[V_MIN + 1] != partial[V_MIN + 1]:
+                    partial[V_MIN + 1] = bucket[V_MIN + 1]
+                if bucket[V_MAX + 1] > partial[V_MAX + 1] or partial[V_MAX + 1] != partial[V_MAX + 1]:
+                    partial[V_MAX + 1] = bucket[V_MAX + 1]
+                if bucket[A_MIN + 1] < partial[A_MIN + 1] or partial[A_MIN + 1] != partial[A_MIN + 1]:
+                    partial[A_MIN + 1] = bucket[A_MIN + 1]
+                if bucket[A_MAX + 1] > partial[A_MAX + 1] or partial[A_MAX + 1] != partial[A_MAX + 1]:
+                    partial[A_MAX + 1] = bucket[A_MAX + 1]
+            if partial[0] < self.FACTOR:
+                return
+            self._partial[i] = None
+            self.levels[i].append(*partial[1:])
+            bucket = [1] + partial[1:]
+
+    def level_for(self, samples, width):
+        # type: (int, float) -> int
+        """Coarsest level with at least one bucket per pixel, or -1 for raw."""
+        level = -1
+        size = self.FACTOR
+        while level + 1 < self.LEVELS and size * width <= samples:
+            level += 1
+            size *= self.FACTOR
+        return level
@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Acquisition in a process of its own, publishing through shared memory.
+
+Each device is polled by a separate process that writes its samples into
+a SharedRing, a multiprocessing.shared_memory ring buffer whose header
+holds the write index and the sequence number of the next sample.  The
+GUI maps the ring read-only through RemoteDeviceManager, a stand-in for
+DeviceManager, so sampling cadence no longer depends on how busy the GUI
+is, and polling carries on if the GUI crashes; the GUI picks the ring up
+again when it next starts.  Device commands are not forwarded, so the
+GUI only monitors devices acquired this way.
+
+Needs Python 3.8 or later.  The acquisition process can also be started
+by hand:
+
+    $ python sharedacquisition.py /dev/ttyUSB0 --interval 0.01
+"""
+
+from __future__ import print_function
+
+import argparse
+from concurrent.futures import Future
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from time import perf_counter
+try:
+    from typing import Callable, Dict, List, Optional, Tuple
+except:
+    pass
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+import numpy as np
+
+import acquisition
+from samplestore import CHANNELS, SampleStore
+
+
+MAGIC = b"RDRING1\0"
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("capacity", "<u8"),
+    # slot the next sample goes to, and how many were ever written
+    ("index", "<u8"),
+    ("seq", "<u8"),
+    # time.time() - perf_counter() in the writer, to translate its times
+    ("epoch", "<f8"),
+    ("pid", "<u8"),
+    ("interval", "<f8"),
+])
+# seconds RemoteDeviceManager waits for a new process's ring to appear
+SPAWN_TIMEOUT = 10.0
+# seconds between copies from the rings into the GUI's sample stores
+MIRROR_INTERVAL = 0.01
+
+
+def ring_name(spec):
+    # type: (str) -> str
+    """Shared memory name of the ring for the device at port spec."""
+    return "rdgui_" + re.sub(r"[^\w@-]+", "_", spec.strip("/\\"))
+
+
+def _pid_alive(pid):
+    # type: (int) -> bool
+    if os.name == "nt":
+        # os.kill would terminate it; and Windows frees shared memory with
+        # its last handle, so a ring that can be opened has a writer
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM: alive, but someone else's
+        return e.errno == 1
+    return True
+
+
+class SharedRing(object):
+    """Single-writer ring of (t, V, A) samples in shared memory.
+
+    Readers need no lock: the writer fills a slot before bumping seq, and
+    a reader discards whatever the writer may have overwritten while it
+    was copying.
+    """
+
+    def __init__(self, shm, owner):
+        # type: (shared_memory.SharedMemory, bool) -> None
+        super(SharedRing, self).__init__()
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((), HEADER_DTYPE, buffer=shm.buf)
+        self.capacity = int(self.header["capacity"])
+        self.data = np.ndarray((self.capacity, CHANNELS), "<f8", buffer=shm.buf, offset=HEADER_SIZE)
+        if not owner:
+            self.data.flags.writeable = False
+
+    @classmethod
+    def create(cls, name, capacity, interval=0.):
+        # type: (str, int, float) -> SharedRing
+        shm = shared_memory.SharedMemory(name, create=True, size=HEADER_SIZE + capacity * CHANNELS * 8)
+        header = np.ndarray((), HEADER_DTYPE, buffer=shm.buf)
+        header["capacity"] = capacity
+        header["index"] = header["seq"] = 0
+        header["epoch"] = time.time() - perf_counter()
+        header["pid"] = os.getpid()
+        header["interval"] = interval
+        # written last: readers ignore a ring until it is set up
+        header["magic"] = MAGIC
+        del header
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name):
+        # type: (str) -> Optional[SharedRing]
+        """Map the ring called name, or return None if there's none ready."""
+        try:
+            try:
+                shm = shared_memory.SharedMemory(name, track=False)
+            except TypeError:
+                # before Python 3.13 the resource tracker would unlink the
+                # ring when this process exits, taking it from the writer
+                shm = shared_memory.SharedMemory(name)
+                resource_tracker.unregister(shm._name, "shared_memory")
+        except (IOError, OSError):
+            return None
+        if shm.size < HEADER_SIZE or bytes(shm.buf[:len(MAGIC)]) != MAGIC:
+            shm.close()
+            return None
+        return cls(shm, False)
+
+    @property
+    def pid(self):
+        # type: () -> int
+        return int(self.header["pid"])
+
+    @property
+    def seq(self):
+        # type: () -> int
+        return int(self.header["seq"])
+
+    @property
+    def epoch(self):
+        # type: () -> float
+        return float(self.header["epoch"])
+
+    def alive(self):
+        # type: () -> bool
+        return _pid_alive(self.pid)
+
+    def append(self, t, v, a):
+        # type: (float, float, float) -> None
+        """Add a sample.  Only call from the writer."""
+        header = self.header
+        index = int(header["index"])
+        self.data[index] = (t, v, a)
+        header["index"] = (index + 1) % self.capacity
+        header["seq"] += 1
+
+    def read_since(self, seq):
+        # type: (int) -> Tuple[int, np.ndarray]
+        """Samples written since seq, as the seq to pass next time and a
+        (n, 3) array, oldest first; older ones are lost if the reader fell
+        more than a ring behind."""
+        end = self.seq
+        start = max(seq, end - self.capacity)
+        if start >= end:
+            return end, np.empty((0, CHANNELS))
+        rows = self.data[np.arange(start, end) % self.capacity]
+        # the slot of sample s is reused for s + capacity, which may have
+        # been in progress once seq reached s + capacity
+        valid = max(start, self.seq - self.capacity + 1)
+        return end, rows[valid - start:]
+
+    def close(self):
+        del self.header, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RemoteDevice(object):
+    """A device polled by another process, as far as the GUI needs one."""
+
+    mock = False
+    remote = True
+
+    def __init__(self, port, address, graph_seconds, ring):
+        # type: (str, int, float, SharedRing) -> None
+        super(RemoteDevice, self).__init__()
+        self.port = port
+        self.address = address
+        self.ring = ring
+        self.on_reconnect = None # type: Callable[[RemoteDevice], None]
+        self.listeners = () # type: Tuple[Callable[[RemoteDevice, float, float, float], None], ...]
+        self.samples = SampleStore(graph_seconds)
+        self._seq = 0
+        self._last_sample = None # type: float
+        self._mean_interval = None # type: float
+        # writer times to ours
+        self._offset = ring.epoch - (time.time() - perf_counter())
+
+    def __str__(self):
+        return acquisition.format_port_spec(self.port, self.address)
+
+    @property
+    def achieved_rate(self):
+        # type: () -> float
+        mean = self._mean_interval
+        if not mean:
+            return 0.
+        return 1. / mean
+
+    def submit(self, fn, key=None, delay=0.):
+        future = Future()
+        future.set_exception(IOError("{} is polled by a separate acquisition process".format(self)))
+        return future
+
+    def flash_firmware(self, size, chunks, progress=None):
+        return self.submit(None)
+
+    def configure(self, polling_interval=None, graph_seconds=None, adaptive=False, upgrade_baudrate=None):
+        if graph_seconds is not None:
+            self.samples.set_retention(graph_seconds)
+
+    def mirror(self):
+        """Copy new samples from the ring into samples.  Returns how many."""
+        self._seq, rows = self.ring.read_since(self._seq)
+        if not len(rows):
+            return 0
+        rows = rows.copy()
+        rows[:, 0] += self._offset
+        for t, v, a in rows.tolist():
+            self.samples.append(t, v, a)
+            for listener in self.listeners:
+                listener(self, t, v, a)
+            if self._last_sample is not None:
+                interval = t - self._last_sample
+                if self._mean_interval is None:
+                    self._mean_interval = interval
+                else:
+                    self._mean_interval += acquisition.Device.RATE_SMOOTHING * (interval - self._mean_interval)
+            self._last_sample = t
+        return len(rows)
+
+
+class RemoteDeviceManager(object):
+    """DeviceManager's interface over devices polled by separate processes,
+    started on open() unless one is already running for the device."""
+
+    def __init__(self, polling_interval, graph_seconds):
+        # type: (float, float) -> None
+        super(RemoteDeviceManager, self).__init__()
+        if shared_memory is None:
+            raise RuntimeError("Separate acquisition processes need Python 3.8 or later")
+        self.polling_interval = polling_interval
+        self.graph_seconds = graph_seconds
+        self.devices = [] # type: List[RemoteDevice]
+        self.listeners = () # type: Tuple[Callable[[RemoteDevice, float, float, float], None], ...]
+        self._lock = threading.Lock()
+        # held while copying from the rings, so none is unmapped meanwhile
+        self._mirror_lock = threading.Lock()
+        # processes started here, by pid, to be reaped when stopped
+        self._processes = {} # type: Dict[int, subprocess.Popen]
+        self._shutdown = threading.Event()
+        self._thread = threading.Thread(target=self._Mirror, name="RemoteDeviceManager")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def open(self, port, address=1, mock=False):
+        # type: (str, int, bool) -> RemoteDevice
+        spec = acquisition.format_port_spec(port, address)
+        with self._lock:
+            for device in self.devices:
+                if device.port == port and device.address == address:
+                    return device
+                if device.port == port:
+                    raise IOError("{} is already polled by another process".format(port))
+        name = ring_name(spec)
+        ring = SharedRing.attach(name)
+        if ring is not None and not ring.alive():
+            # left behind by a process that was killed
+            ring.close()
+            ring = None
+            self._Unlink(name)
+        if ring is None:
+            ring = self._Spawn(spec, name, mock)
+        device = RemoteDevice(port, address, self.graph_seconds, ring)
+        with self._lock:
+            device.listeners = self.listeners
+            self.devices.append(device)
+        return device
+
+    def _Spawn(self, spec, name, mock):
+        # type: (str, str, bool) -> SharedRing
+        capacity = max(int(2 * self.graph_seconds / max(self.polling_interval, 1e-3)), 4096)
+        args = [sys.executable, os.path.abspath(__file__), spec,
+                "--interval", repr(self.polling_interval), "--capacity", str(capacity)]
+        if mock:
+            args.append("--mock")
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS
+        else:
+            # keep polling if the GUI is killed along with its process group
+            kwargs["start_new_session"] = True
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL, **kwargs)
+        deadline = perf_counter() + SPAWN_TIMEOUT
+        while perf_counter() < deadline:
+            ring = SharedRing.attach(name)
+            if ring is not None:
+                self._processes[process.pid] = process
+                return ring
+            if process.poll() is not None:
+                raise IOError("Acquisition process for {} exited with {}".format(spec, process.returncode))
+            time.sleep(0.05)
+        process.terminate()
+        raise IOError("Acquisition process for {} didn't start".format(spec))
+
+    @staticmethod
+    def _Unlink(name):
+        # type: (str) -> None
+        try:
+            shm = shared_memory.SharedMemory(name)
+        except (IOError, OSError):
+            return
+        shm.close()
+        shm.unlink()
+
+    def close(self, device):
+        # type: (RemoteDevice) -> None
+        """Stop device's acquisition process and unmap its ring."""
+        with self._lock:
+            self.devices.remove(device)
+        pid = device.ring.pid
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+        with self._mirror_lock:
+            device.ring.close()
+        process = self._processes.pop(pid, None)
+        if process is not None:
+            try:
+                process.wait(SPAWN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def configure(self, polling_interval=None, graph_seconds=None, adaptive=False, upgrade_baudrate=None):
+        """Only graph_seconds applies; the processes keep their poll settings
+        until restarted."""
+        with self._lock:
+            if polling_interval is not None:
+                self.polling_interval = polling_interval
+            if graph_seconds is not None:
+                self.graph_seconds = graph_seconds
+            devices = list(self.devices)
+        for device in devices:
+            device.configure(graph_seconds=graph_seconds)
+
+    def subscribe(self, listener):
+        # type: (Callable[[RemoteDevice, float, float, float], None]) -> None
+        with self._lock:
+            self.listeners += (listener,)
+            for device in self.devices:
+                device.listeners = self.listeners
+
+    def unsubscribe(self, listener):
+        # type: (Callable[[RemoteDevice, float, float, float], None]) -> None
+        with self._lock:
+            self.listeners = tuple(l for l in self.listeners if l != listener)
+            for device in self.devices:
+                device.listeners = self.listeners
+
+    def _Mirror(self):
+        while not self._shutdown.wait(MIRROR_INTERVAL):
+            with self._mirror_lock:
+                for device in list(self.devices):
+                    device.mirror()
+
+    def shutdown(self):
+        self._shutdown.set()
+        self._thread.join()
+        for device in list(self.devices):
+            self.close(device)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("spec", metavar="PORT[@ADDRESS]")
+    parser.add_argument("-i", "--interval", type=float, default=0.1, help="seconds between polls")
+    parser.add_argument("--capacity", type=int, default=65536, help="samples the ring holds")
+    parser.add_argument("--mock", action="store_true", help="poll a simulated device")
+    args = parser.parse_args()
+    if shared_memory is None:
+        parser.error("needs Python 3.8 or later")
+
+    port, address = acquisition.parse_port_spec(args.spec)
+    name = ring_name(acquisition.format_port_spec(port, address))
+    existing = SharedRing.attach(name)
+    if existing is not None:
+        alive = existing.alive()
+        existing.close()
+        if alive:
+            print("{} is already being acquired".format(args.spec), file=sys.stderr)
+            return 1
+        RemoteDeviceManager._Unlink(name)
+    ring = SharedRing.create(name, args.capacity, args.interval)
+
+    stopped = threading.Event()
+    for signame in ("SIGINT", "SIGTERM", "SIGHUP"):
+        if hasattr(signal, signame):
+            signal.signal(getattr(signal, signame), lambda *args: stopped.set())
+    # the sample store only feeds the ring here; keep it small
+    manager = acquisition.DeviceManager(args.interval, 1.)
+    manager.subscribe(lambda device, t, v, a: ring.append(t, v, a))
+    manager.open(port, address, mock=args.mock)
+    try:
+        while not stopped.wait(1.):
+            pass
+    finally:
+        manager.shutdown()
+        ring.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Live samples for other programs over a local socket.
+
+StreamServer publishes every sample a DeviceManager (or a
+RemoteDeviceManager) takes to any number of clients on a TCP port or a
+Unix socket.  Every frame starts with FRAME_HEADER, (b"RD", type, 0,
+count), followed by:
+
+    FRAME_DEVICES   count bytes of JSON: the list of device names, null for
+                    one that has been closed, sent on connect and whenever
+                    a device is opened or closed
+    FRAME_SAMPLES   count records of RECORD_DTYPE (device index, UNIX time,
+                    V, A), laid out as rdlogger's binary records; NaN marks
+                    a gap
+    FRAME_DROPPED   nothing; count samples were dropped because the client
+                    fell behind
+
+A new client first gets what the devices' sample stores hold, then live
+samples in batches every BATCH_INTERVAL.  Batches are encoded once and
+shared by all clients, each of which has its own backlog of at most
+MAX_BACKLOG bytes, oldest frames dropped first, so a slow client can't
+hold up the others or acquisition, which only ever appends to a queue.
+"""
+
+from __future__ import print_function
+
+import collections
+import errno
+import json
+import os
+import selectors
+import socket
+import stat
+import struct
+import threading
+import time
+from time import perf_counter
+try:
+    from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+except:
+    pass
+
+import numpy as np
+
+import acquisition
+import samplestore
+
+
+FRAME_HEADER = struct.Struct("<2sBBI")
+FRAME_MAGIC = b"RD"
+FRAME_DEVICES = 1
+FRAME_SAMPLES = 2
+FRAME_DROPPED = 3
+# the layout of rdlogger.RECORD
+RECORD_DTYPE = np.dtype([("device", "u1"), ("t", "<f8"), ("v", "<f4"), ("a", "<f4")])
+
+# seconds between batches
+BATCH_INTERVAL = 0.02
+# bytes of frames queued for a client before the oldest are dropped
+MAX_BACKLOG = 4 << 20
+# records per frame when replaying history
+REPLAY_FRAME = 4096
+
+
+def parse_address(address):
+    # type: (str) -> Tuple[int, Any]
+    """Socket family and address for "unix:PATH", "PATH" with a slash in
+    it, "HOST:PORT" or "PORT"."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    if "/" in address or os.sep in address:
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def _remove_stale_socket(path):
+    # type: (str) -> None
+    """Remove the socket a server that wasn't shut down left at path.  Raise
+    IOError if path is anything else, or a server is still listening."""
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise IOError(errno.EEXIST, "Not a socket", path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (IOError, OSError) as e:
+        if e.errno != errno.ECONNREFUSED:
+            raise
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise IOError(errno.EADDRINUSE, "Another server is listening", path)
+
+
+def _frame(kind, count, payload=b""):
+    # type: (int, int, bytes) -> bytes
+    return FRAME_HEADER.pack(FRAME_MAGIC, kind, 0, count) + payload
+
+
+def _samples_frame(records):
+    # type: (np.ndarray) -> bytes
+    return _frame(FRAME_SAMPLES, len(records), records.tobytes())
+
+
+class _Client(object):
+    def __init__(self, sock):
+        # type: (socket.socket) -> None
+        super(_Client, self).__init__()
+        self.sock = sock
+        # frames to send, and how much of the first has gone
+        self.pending = collections.deque() # type: Deque[bytes]
+        self.offset = 0
+        self.queued = 0
+        self.dropped = 0
+        # device index -> time of the last sample replayed, to skip live
+        # samples that were in the replay too
+        self.replayed = {} # type: Dict[int, float]
+
+    def queue(self, frame):
+        # type: (bytes) -> None
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self.pending.append(_frame(FRAME_DROPPED, dropped))
+        self.pending.append(frame)
+        self.queued += len(frame)
+        # drop the oldest sample frames, but never one partly sent, nor
+        # the device lists
+        i = 1 if self.offset else 0
+        while self.queued > MAX_BACKLOG and i < len(self.pending) - 1:
+            _, kind, _, count = FRAME_HEADER.unpack_from(self.pending[i])
+            if kind != FRAME_SAMPLES:
+                i += 1
+                continue
+            self.queued -= len(self.pending[i])
+            del self.pending[i]
+            self.dropped += count
+
+    def send(self):
+        # type: () -> None
+        """Send what the socket takes without blocking."""
+        while self.pending:
+            frame = self.pending[0]
+            sent = self.sock.send(frame[self.offset:] if self.offset else frame)
+            self.offset += sent
+            self.queued -= sent
+            if self.offset < len(frame):
+                return
+            self.pending.popleft()
+            self.offset = 0
+
+
+class StreamServer(object):
+    """Serves live samples from manager's devices on address."""
+
+    def __init__(self, manager, address):
+        # type: (acquisition.DeviceManager, str) -> None
+        super(StreamServer, self).__init__()
+        self.manager = manager
+        self.address = address
+        family, addr = parse_address(address)
+        if family == socket.AF_UNIX:
+            _remove_stale_socket(addr)
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family != socket.AF_UNIX:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self._listener.bind(addr)
+            self._listener.listen(16)
+        except:
+            self._listener.close()
+            raise
+        self._listener.setblocking(False)
+        self._path = addr if family == socket.AF_UNIX else None
+        # sample times are perf_counter() based
+        self._epoch = time.time() - perf_counter()
+        self._queue = collections.deque()
+        # device names by index, which stays the same if one is reopened
+        self._names = [] # type: List[str]
+        self._index = {} # type: Dict[str, int]
+        self._open = set() # type: Set[str]
+        self._closed = set() # type: Set[str]
+        self._clients = {} # type: Dict[socket.socket, _Client]
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._shutdown = False
+        self._thread = threading.Thread(target=self._Run, name="StreamServer")
+        self._thread.daemon = True
+
+    @property
+    def port(self):
+        # type: () -> Optional[int]
+        """The TCP port listened on, useful when asked for port 0."""
+        if self._path is not None:
+            return None
+        return self._listener.getsockname()[1]
+
+    def start(self):
+        self.manager.subscribe(self._OnSample)
+        self._thread.start()
+
+    def stop(self):
+        self.manager.unsubscribe(self._OnSample)
+        self._shutdown = True
+        self._thread.join()
+        for sock in list(self._clients):
+            self._Drop(sock)
+        self._selector.close()
+        self._listener.close()
+        if self._path is not None and os.path.exists(self._path):
+            os.remove(self._path)
+
+    def _OnSample(self, device, t, v, a):
+        # type: (object, float, float, float) -> None
+        # on the I/O thread: as little as possible
+        self._queue.append((device, t, v, a))
+
+    def _DeviceIndex(self, name, announce=True):
+        # type: (str, bool) -> int
+        i = self._index.get(name)
+        if i is None:
+            i = self._index[name] = len(self._names)
+            self._names.append(name)
+            if announce:
+                self._QueueDevices()
+        return i
+
+    def _UpdateDevices(self):
+        """Tell the clients about devices opened or closed since last time."""
+        names = set(str(d) for d in list(self.manager.devices))
+        if names == self._open:
+            return
+        self._closed = (self._closed | self._open) - names
+        self._open = names
+        for name in sorted(names):
+            self._DeviceIndex(name, False)
+        self._QueueDevices()
+
+    def _QueueDevices(self):
+        frame = self._DevicesFrame()
+        for client in self._clients.values():
+            client.queue(frame)
+
+    def _DevicesFrame(self):
+        # type: () -> bytes
+        names = [None if name in self._closed else name for name in self._names]
+        payload = json.dumps(names).encode("utf-8")
+        return _frame(FRAME_DEVICES, len(payload), payload)
+
+    def _Run(self):
+        while not self._shutdown:
+            for key, events in self._selector.select(BATCH_INTERVAL):
+                sock = key.fileobj
+                if sock is self._listener:
+                    self._Accept()
+                    continue
+                if events & selectors.EVENT_READ and not self._Read(sock):
+                    self._Drop(sock)
+                    continue
+                if events & selectors.EVENT_WRITE:
+                    self._Send(sock)
+            self._UpdateDevices()
+            self._Broadcast()
+
+    def _Broadcast(self):
+        queue = self._queue
+        if not queue:
+            return
+        rows = []
+        while queue:
+            device, t, v, a = queue.popleft()
+            rows.append((self._DeviceIndex(str(device)), self._epoch + t, v, a))
+        records = np.array(rows, RECORD_DTYPE)
+        frame = _samples_frame(records)
+        for sock, client in list(self._clients.items()):
+            if client.replayed:
+                # the first batch may repeat the end of the replay
+                keep = np.ones(len(records), bool)
+                for i, t in client.replayed.items():
+                    keep &= (records["device"] != i) | (records["t"] > t)
+                client.replayed = {}
+                client.queue(_samples_frame(records[keep]) if not keep.all() else frame)
+            else:
+                client.queue(frame)
+            self._Send(sock)
+
+    def _Accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except (IOError, OSError):
+            return
+        sock.setblocking(False)
+        if sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # flush what's queued to the current clients first, so the
+        # replay only overlaps samples still to come
+        self._UpdateDevices()
+        self._Broadcast()
+        client = _Client(sock)
+        client.queue(self._DevicesFrame())
+        for device in list(self.manager.devices):
+            i = self._DeviceIndex(str(device))
+            history = device.samples.snapshot()
+            if not history.shape[1]:
+                continue
+            records = np.empty(history.shape[1], RECORD_DTYPE)
+            records["device"] = i
+            records["t"] = history[samplestore.T] + self._epoch
+            records["v"] = history[samplestore.V]
+            records["a"] = history[samplestore.A]
+            for start in range(0, len(records), REPLAY_FRAME):
+                client.queue(_samples_frame(records[start:start + REPLAY_FRAME]))
+            client.replayed[i] = records["t"][-1]
+        self._clients[sock] = client
+        self._selector.register(sock, selectors.EVENT_READ)
+        self._Send(sock)
+
+    def _Read(self, sock):
+        # type: (socket.socket) -> bool
+        """Discard what the client sends; False once it has gone."""
+        try:
+            return bool(sock.recv(4096))
+        except (IOError, OSError) as e:
+            return e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)
+
+    def _Send(self, sock):
+        # type: (socket.socket) -> None
+        client = self._clients.get(sock)
+        if client is None:
+            return
+        try:
+            client.send()
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._Drop(sock)
+                return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.pending else 0)
+        if self._selector.get_key(sock).events != events:
+            self._selector.modify(sock, events)
+
+    def _Drop(self, sock):
+        # type: (socket.socket) -> None
+        if self._clients.pop(sock, None) is not None:
+            self._selector.unregister(sock)
+        sock.close()
+
+
+def connect(address):
+    # type: (str) -> socket.socket
+    family, addr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(addr)
+    return sock
+
+
+def _read_exactly(sock, n):
+    # type: (socket.socket, int) -> bytes
+    buf = bytearray()
+    while len(buf) < n:
+        data = sock.recv(n - len(buf))
+        if not data:
+            raise EOFError()
+        buf += data
+    return bytes(buf)
+
+
+def frames(sock):
+    # type: (socket.socket) -> Iterator[Tuple[int, Any]]
+    """Yield (type, content) for each frame from a StreamServer: the device
+    list (None for a closed device), a RECORD_DTYPE array of samples, or the
+    number dropped."""
+    while True:
+        try:
+            magic, kind, _, count = FRAME_HEADER.unpack(_read_exactly(sock, FRAME_HEADER.size))
+            if magic != FRAME_MAGIC:
+                raise ValueError("Bad frame from stream server")
+            if kind == FRAME_DEVICES:
+                yield kind, json.loads(_read_exactly(sock, count).decode("utf-8"))
+            elif kind == FRAME_SAMPLES:
+                yield kind, np.frombuffer(_read_exactly(sock, count * RECORD_DTYPE.itemsize), RECORD_DTYPE)
+            else:
+                yield kind, count
+        except EOFError:
+            return
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+from __future__ import print_function
+
+from time import perf_counter
+try:
+    from typing import Callable, Optional, Tuple
+except:
+    pass
+
+from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
+import wx
+
+from stripfigure import StripFigure
+
+
+class StripChart(StripFigure):
+    """Scrolling V/A plot of devices' sample stores, drawn with matplotlib.
+
+    Frames are drawn by StripFigure from a wx.Timer at no more than
+    MAX_FRAME_RATE, independently of the poll rate, and skipped altogether
+    while the window is hidden or when nothing moved by a pixel.
+
+    With a history source, the mouse wheel scrolls back into recorded
+    data, and the view stays put until scrolled forward to live again.
+    """
+
+    MAX_FRAME_RATE = 25
+    # fraction of the view the mouse wheel scrolls by per step
+    SCROLL_STEP = 0.1
+
+    def __init__(self, parent, graph_seconds, voltage_range, amperage_range):
+        # type: (wx.Window, float, float, float) -> None
+        super(StripChart, self).__init__(lambda figure: FigureCanvas(parent, wx.ID_ANY, figure),
+                                         graph_seconds, voltage_range, amperage_range)
+        self.parent = parent
+        # called with (t, V, A) under the mouse, or None outside the axes
+        self.cursor_callback = None # type: Optional[Callable[[Optional[Tuple[float, float, float]]], None]]
+
+        self.window = self.canvas
+        # Note that event is a MplEvent
+        self.window.mpl_connect('motion_notify_event', self._OnMotion)
+        self.window.mpl_connect('scroll_event', self._OnScroll)
+
+        self.timer = wx.Timer(self.window)
+        self.window.Bind(wx.EVT_TIMER, self._OnTimer, self.timer)
+
+    def start(self):
+        self.figure.tight_layout()
+        self.timer.Start(int(1000 / self.MAX_FRAME_RATE))
+
+    def stop(self):
+        self.timer.Stop()
+
+    def _OnTimer(self, evt):
+        # type: (wx.TimerEvent) -> None
+        top = wx.GetTopLevelParent(self.window)
+        if not self.window.IsShownOnScreen() or top.IsIconized():
+            return
+        self.render(perf_counter())
+
+    def _OnMotion(self, event):
+        if self.cursor_callback is None:
+            return
+        if not event.inaxes:
+            self.cursor_callback(None)
+            return
+        v, a = self.values_at(event.x, event.y, event.inaxes, event.ydata)
+        self.cursor_callback((event.xdata - self.scrollback, v, a))
+
+    def _OnScroll(self, event):
+        if self.history is None:
+            return
+        xmin, xmax = self.vaxis.get_xlim()
+        self.scroll_to(self.scrollback + event.step * self.SCROLL_STEP * (xmax - xmin))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""The drawing half of stripchart.StripChart, on any matplotlib canvas.
+
+Kept free of wx so the same frames can be drawn headlessly on an Agg
+canvas, as benchmarks/pipeline.py does.
+"""
+
+from __future__ import print_function
+
+from time import perf_counter
+try:
+    from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+    if TYPE_CHECKING:
+        import acquisition
+except:
+    pass
+
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.ticker import AutoMinorLocator
+from matplotlib.transforms import Affine2D
+import numpy as np
+
+import metrics
+
+
+class StripFigure(object):
+    """Scrolling V/A plot of devices' sample stores.
+
+    The axes show time relative to now, while the traces hold absolute
+    sample times behind a shared offset transform, so scrolling only
+    changes that offset and a trace's data is only re-sent when its store
+    has new samples.  Traces are animated and blitted over a background
+    cached by the last full draw.
+    """
+
+    def __init__(self, make_canvas, graph_seconds, voltage_range, amperage_range):
+        # type: (Callable[[Figure], Any], float, float, float) -> None
+        super(StripFigure, self).__init__()
+        # called after every drawn frame
+        self.frame_callback = None # type: Optional[Callable[[], None]]
+        self.frame_time = metrics.registry.histogram("render/frame")
+        # called with (device, t0, t1, width) for plot data from before the
+        # sample store's window, or None to use the store
+        self.history = None # type: Optional[Callable[[acquisition.Device, float, float, float], Optional[np.ndarray]]]
+        # perf_counter() time at the right edge of a scrolled-back view,
+        # None to follow live data
+        self._view_end = None # type: Optional[float]
+        # device -> (vline, aline, store seq last sent)
+        self.traces = {} # type: Dict[acquisition.Device, list]
+        self._offset = Affine2D()
+        self._background = None
+        self._drawn_at = None # type: float
+
+        self.figure = Figure()
+
+        self.vaxis = self.figure.add_subplot(111)
+        self.vaxis.set_ylim(0, voltage_range)
+        self.vaxis.set_xlim(-graph_seconds, 0)
+        self.vaxis.set_xlabel('t')
+        self.vaxis.set_ylabel('V')
+        self.vaxis.yaxis.set_minor_locator(AutoMinorLocator(4))
+        self.vaxis.grid(axis='x', linestyle='--')
+        self.vaxis.grid(which='both', axis='y', linestyle='--')
+
+        self.aaxis = self.vaxis.twinx()
+        self.aaxis.set_ylim(0, amperage_range)
+        self.aaxis.set_ylabel('A')
+        self.aaxis.yaxis.set_minor_locator(AutoMinorLocator(4))
+
+        self.canvas = make_canvas(self.figure)
+        self.canvas.mpl_connect('draw_event', self._OnDraw)
+
+    def add_trace(self, device):
+        # type: (acquisition.Device) -> None
+        i = len(self.traces)
+        if i == 0:
+            vline = Line2D([], [])
+            aline = Line2D([], [], color='#80000080')
+        else:
+            vline = Line2D([], [], color='C{}'.format(i))
+            aline = Line2D([], [], color='C{}'.format(i), linestyle='--', alpha=0.5)
+        vline.set_label(str(device))
+        for line, axis in ((vline, self.vaxis), (aline, self.aaxis)):
+            axis.add_line(line)
+            line.set_transform(self._offset + axis.transData)
+            # drawn by render over the cached background
+            line.set_animated(True)
+        self.traces[device] = [vline, aline, None]
+        self._UpdateLegend()
+
+    def remove_trace(self, device):
+        # type: (acquisition.Device) -> None
+        vline, aline, _ = self.traces.pop(device)
+        vline.remove()
+        aline.remove()
+        self._UpdateLegend()
+
+    def _UpdateLegend(self):
+        legend = self.vaxis.get_legend()
+        if legend is not None:
+            legend.remove()
+        if len(self.traces) > 1:
+            self.vaxis.legend(loc='upper left')
+        self.canvas.draw_idle()
+
+    def configure(self, graph_seconds=None, voltage_range=None, amperage_range=None):
+        # type: (float, float, float) -> None
+        if graph_seconds is not None:
+            self.vaxis.set_xlim(-graph_seconds, 0)
+            self.aaxis.set_xlim(-graph_seconds, 0)
+        if voltage_range is not None:
+            self.vaxis.set_ylim(0, voltage_range)
+        if amperage_range is not None:
+            self.aaxis.set_ylim(0, amperage_range)
+        # the view moved, so every trace needs fetching again
+        for trace in self.traces.values():
+            trace[2] = None
+        self.canvas.draw()
+
+    @property
+    def scrollback(self):
+        # type: () -> float
+        """Seconds the view is behind now."""
+        if self._view_end is None:
+            return 0.
+        return perf_counter() - self._view_end
+
+    def scroll_to(self, scrollback):
+        # type: (float) -> None
+        """Show the view scrollback seconds behind now; 0 follows live data."""
+        self._view_end = perf_counter() - scrollback if scrollback > 0 else None
+        for trace in self.traces.values():
+            trace[2] = None
+        self._drawn_at = None
+
+    def _OnDraw(self, event):
+        # a full redraw skips the animated traces; keep it as the background
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._DrawTraces()
+
+    def render(self, now):
+        # type: (float) -> bool
+        """Blit a frame for perf_counter() time now, unless nothing changed.
+
+        Returns whether a frame was drawn.
+        """
+        if self._background is None:
+            return False
+        live = self._view_end is None
+        view = now if live else self._view_end
+        xmin, xmax = self.vaxis.get_xlim()
+        width = self.vaxis.bbox.width
+        # scrolled less than a pixel since the last frame
+        dirty = self._drawn_at is None or (live and (now - self._drawn_at) * width >= xmax - xmin)
+        for device, trace in self.traces.items():
+            # a scrolled-back view is fetched once
+            seq = device.samples.seq if live else -1
+            if seq == trace[2]:
+                continue
+            vline, aline, _ = trace
+            t, v, a = self._PlotData(device, view + xmin, view + xmax, width)
+            vline.set_data(t, v)
+            aline.set_data(t, a)
+            trace[2] = seq
+            dirty = True
+        if not dirty:
+            return False
+        self._offset.clear().translate(-view, 0)
+        self._drawn_at = now
+        self.canvas.restore_region(self._background)
+        self._DrawTraces()
+        self.canvas.blit(self.figure.bbox)
+        if self.frame_callback is not None:
+            self.frame_callback()
+        self.frame_time.record(perf_counter() - now)
+        return True
+
+    def _PlotData(self, device, t0, t1, width):
+        # type: (acquisition.Device, float, float, float) -> np.ndarray
+        if self._view_end is not None and self.history is not None:
+            data = self.history(device, t0, t1, width)
+            if data is not None:
+                return data
+        return device.samples.plot_data(t0, t1, width)
+
+    def _DrawTraces(self):
+        for vline, aline, _ in self.traces.values():
+            self.vaxis.draw_artist(vline)
+            self.aaxis.draw_artist(aline)
+
+    def values_at(self, x, y, axis, ydata):
+        # type: (float, float, Any, float) -> Tuple[float, float]
+        """(V, A) at display position (x, y) in axis, whose own value is ydata."""
+        if axis == self.vaxis:
+            return ydata, self.aaxis.transData.inverted().transform((x, y))[1]
+        return self.vaxis.transData.inverted().transform((x, y))[1], ydata
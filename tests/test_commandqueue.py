@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""CommandQueue ordering, coalescing and delays.
+
+    $ python -m unittest discover tests
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import commandqueue
+from commandqueue import PRIORITY_BACKGROUND, PRIORITY_USER
+
+
+class CommandQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = commandqueue.CommandQueue()
+
+    def _Drain(self):
+        """Run every runnable command, returning their results in order."""
+        results = []
+        with self.queue.cond:
+            cmd = self.queue.pop()
+            while cmd is not None:
+                cmd.run(lambda fn: fn())
+                results.append(cmd.future.result())
+                cmd = self.queue.pop()
+        return results
+
+    def test_priority_then_fifo(self):
+        for name, priority in (("b1", PRIORITY_BACKGROUND), ("u1", PRIORITY_USER),
+                               ("b2", PRIORITY_BACKGROUND), ("u2", PRIORITY_USER)):
+            self.queue.submit(lambda name=name: name, priority)
+        self.assertEqual(self._Drain(), ["u1", "u2", "b1", "b2"])
+
+    def test_keyed_commands_coalesce(self):
+        first = self.queue.submit(lambda: 1, key="voltage")
+        self.queue.submit(lambda: "other")
+        second = self.queue.submit(lambda: 2, key="voltage")
+        self.assertIs(first, second)
+        # runs in the first one's place, with the latest work
+        self.assertEqual(self._Drain(), [2, "other"])
+        self.assertEqual(first.result(), 2)
+
+    def test_key_reusable_once_popped(self):
+        first = self.queue.submit(lambda: 1, key="k")
+        self._Drain()
+        second = self.queue.submit(lambda: 2, key="k")
+        self.assertIsNot(first, second)
+        self.assertEqual(self._Drain(), [2])
+
+    def test_delayed(self):
+        self.queue.submit(lambda: "later", delay=0.05)
+        self.queue.submit(lambda: "now")
+        self.assertEqual(self._Drain(), ["now"])
+        self.assertGreater(self.queue.next_due(), time.perf_counter())
+        time.sleep(0.06)
+        self.assertLessEqual(self.queue.next_due(), time.perf_counter())
+        self.assertEqual(self._Drain(), ["later"])
+        self.assertEqual(self.queue.next_due(), float('inf'))
+
+    def test_exception_completes_future(self):
+        def fail():
+            raise ValueError("nope")
+        future = self.queue.submit(fail)
+        with self.queue.cond:
+            self.queue.pop().run(lambda fn: fn())
+        self.assertIsInstance(future.exception(), ValueError)
+
+    def test_cancel_all(self):
+        futures = [self.queue.submit(lambda: None), self.queue.submit(lambda: None, delay=10)]
+        self.queue.cancel_all()
+        self.assertTrue(all(f.cancelled() for f in futures))
+        self.assertEqual(self._Drain(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""FirmwareCache against a local HTTP stand-in for the vendor's server.
+
+    $ python -m unittest discover tests
+"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fwcache
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        if self.path.endswith(".json"):
+            etag = '"{}"'.format(server.version)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = json.dumps(server.metadata()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("ETag", etag)
+        elif self.path.endswith(".bin"):
+            body = server.image
+            self.send_response(200)
+        else:
+            self.send_error(404)
+            return
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(HTTPServer):
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), _Handler)
+        self.requests = []
+        self.version = "1.28"
+        self.image = b"\x5a" * 1000
+
+    @property
+    def base(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def metadata(self):
+        return {"Version": self.version, "Size": len(self.image),
+                "DownloadUri": "{}/RD60062-{}.bin".format(self.base, self.version)}
+
+
+class FirmwareCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = _Server()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.directory = tempfile.mkdtemp()
+        self.cache = fwcache.FirmwareCache(self.directory, self.server.base + "/RD{0}.json")
+
+    def tearDown(self):
+        self._StopServer()
+        shutil.rmtree(self.directory)
+
+    def _StopServer(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    def test_metadata_miss_then_hit(self):
+        self.assertEqual(self.cache.metadata(60062)["Version"], "1.28")
+        self.assertTrue(os.path.isfile(os.path.join(self.directory, "RD60062.json")))
+        # revalidated with the ETag and answered 304 from disk
+        self.assertEqual(self.cache.metadata(60062)["Version"], "1.28")
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_metadata_stale(self):
+        self.cache.metadata(60062)
+        self.server.version = "1.29"
+        self.assertEqual(self.cache.metadata(60062)["Version"], "1.29")
+        self._StopServer()
+        self.assertEqual(self.cache.metadata(60062)["Version"], "1.29")
+
+    def test_metadata_offline(self):
+        self.cache.metadata(60062)
+        self._StopServer()
+        self.assertEqual(self.cache.metadata(60062)["Version"], "1.28")
+        with self.assertRaises((IOError, OSError)):
+            self.cache.metadata(60121)
+
+    def test_firmware_miss_then_hit(self):
+        metadata = self.cache.metadata(60062)
+        path = self.cache.firmware(60062, metadata)
+        with open(path, "rb") as fh:
+            self.assertEqual(fh.read(), self.server.image)
+        self._StopServer()
+        self.assertEqual(self.cache.firmware(60062, metadata), path)
+
+    def test_firmware_corrupted(self):
+        metadata = self.cache.metadata(60062)
+        path = self.cache.firmware(60062, metadata)
+        with open(path, "r+b") as fh:
+            fh.write(b"\0")
+        requests = len(self.server.requests)
+        self.cache.firmware(60062, metadata)
+        self.assertEqual(len(self.server.requests), requests + 1)
+        with open(path, "rb") as fh:
+            self.assertEqual(hashlib.sha256(fh.read()).digest(), hashlib.sha256(self.server.image).digest())
+
+    def test_firmware_wrong_size(self):
+        metadata = self.cache.metadata(60062)
+        metadata["Size"] += 1
+        with self.assertRaises(IOError):
+            self.cache.firmware(60062, metadata)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "RD60062-1.28.bin")))
+
+
+if __name__ == '__main__':
+    unittest.main()
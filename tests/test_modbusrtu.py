@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""The Modbus RTU codec against minimalmodbus' own CRC and framing.
+
+    $ python -m unittest discover tests
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import minimalmodbus
+
+import modbusrtu
+
+
+def _latin1(fn, data):
+    """Call a minimalmodbus helper with bytes (2.x) or a str (1.x)."""
+    try:
+        return fn(data)
+    except TypeError:
+        return fn(data.decode("latin1")).encode("latin1")
+
+
+def _minimalmodbus_crc(data):
+    # type: (bytes) -> int
+    return struct.unpack("<H", _latin1(minimalmodbus._calculate_crc, data))[0]
+
+
+def _minimalmodbus_frame(address, fc, payload):
+    # type: (int, int, bytes) -> bytes
+    return _latin1(lambda p: minimalmodbus._embed_payload(address, minimalmodbus.MODE_RTU, fc, p), payload)
+
+
+class _Line(object):
+    """The serial.Serial calls RTUTransport makes, answered from replies."""
+
+    def __init__(self, *replies):
+        super(_Line, self).__init__()
+        self.baudrate = 115200
+        self.written = []
+        self.replies = list(replies)
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def read(self, n):
+        return self.replies.pop(0)[:n] if self.replies else b""
+
+
+class CrcTest(unittest.TestCase):
+    def test_matches_minimalmodbus(self):
+        rng = random.Random(1)
+        for n in (0, 1, 2, 6, 7, 64, 255):
+            data = bytes(bytearray(rng.randrange(256) for _ in range(n)))
+            self.assertEqual(modbusrtu.crc16(data), _minimalmodbus_crc(data), n)
+
+    def test_end(self):
+        data = b"\x01\x03\x00\x04\x00\x0fgarbage"
+        self.assertEqual(modbusrtu.crc16(data, 6), _minimalmodbus_crc(data[:6]))
+
+
+class TransportTest(unittest.TestCase):
+    def test_read_holding_registers(self):
+        values = list(range(1000, 1015))
+        reply = _minimalmodbus_frame(1, 3, struct.pack(">B15H", 30, *values))
+        line = _Line(reply)
+        rtu = modbusrtu.RTUTransport(line, 1)
+        self.assertEqual(rtu.read_holding_registers(4, 15), values)
+        self.assertEqual(line.written, [_minimalmodbus_frame(1, 3, struct.pack(">HH", 4, 15))])
+
+    def test_write_multiple_registers(self):
+        request = _minimalmodbus_frame(2, 16, struct.pack(">HHB2H", 8, 2, 4, 500, 1000))
+        line = _Line(_minimalmodbus_frame(2, 16, struct.pack(">HH", 8, 2)))
+        modbusrtu.RTUTransport(line, 2).write_multiple_registers(8, [500, 1000])
+        self.assertEqual(line.written, [request])
+
+    def test_bad_crc(self):
+        reply = bytearray(_minimalmodbus_frame(1, 3, struct.pack(">BH", 2, 42)))
+        reply[-1] ^= 0xFF
+        with self.assertRaises(modbusrtu.InvalidResponseError):
+            modbusrtu.RTUTransport(_Line(bytes(reply)), 1).read_holding_registers(0, 1)
+
+    def test_no_response(self):
+        with self.assertRaises(modbusrtu.NoResponseError):
+            modbusrtu.RTUTransport(_Line(), 1).read_holding_registers(0, 1)
+
+    def test_slave_exception(self):
+        # minimalmodbus won't frame an exception reply, only check one
+        reply = b"\x01\x83\x02" + struct.pack("<H", _minimalmodbus_crc(b"\x01\x83\x02"))
+        with self.assertRaises(modbusrtu.SlaveReportedException) as cm:
+            modbusrtu.RTUTransport(_Line(reply), 1).read_holding_registers(200, 1)
+        self.assertEqual(cm.exception.code, 2)
+
+    def test_wrong_slave(self):
+        reply = _minimalmodbus_frame(2, 3, struct.pack(">BH", 2, 42))
+        with self.assertRaises(modbusrtu.InvalidResponseError):
+            modbusrtu.RTUTransport(_Line(reply), 1).read_holding_registers(0, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
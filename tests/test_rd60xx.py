@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""RD6006's register image against the simulator.
+
+    $ python -m unittest discover tests
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import modbusrtu
+from rd60xx import RD6006
+import rdsim
+
+
+class _IgnoringSupply(rdsim.SimulatedSupply):
+    """Acknowledges writes to the setpoints without taking them, like a
+    supply given a value out of its range."""
+
+    def write(self, start, values):
+        if start <= rdsim.REG_ISET and start + len(values) > rdsim.REG_VSET:
+            return True
+        return super(_IgnoringSupply, self).write(start, values)
+
+
+class RegisterImageTest(unittest.TestCase):
+    def setUp(self):
+        self.supply = _IgnoringSupply()
+        self.simulator = rdsim.Simulator([self.supply])
+        self.simulator.start()
+        self.rd = RD6006(self.simulator.port)
+
+    def tearDown(self):
+        self.rd.instrument.serial.close()
+        self.simulator.shutdown()
+
+    def test_read_back_after_ignored_write(self):
+        self.rd.snapshot(60.)
+        self.assertEqual(self.rd.voltagecurrent, (5.0, 1.0))
+        self.rd.voltagecurrent = (7.0, 0.5)
+        # not the written values from the cache, but what the device has
+        self.assertEqual(self.rd.voltagecurrent, (5.0, 1.0))
+
+    def test_snapshot_serves_reads(self):
+        self.rd.snapshot(60.)
+        self.supply.regs[rdsim.REG_VSET] = 1200
+        self.assertEqual(self.rd.voltagecurrent, (5.0, 1.0))
+        self.rd.invalidate_snapshot()
+        self.assertEqual(self.rd.voltagecurrent, (12.0, 1.0))
+
+
+class SharedBusTest(unittest.TestCase):
+    def setUp(self):
+        self.simulator = rdsim.Simulator([rdsim.SimulatedSupply(1), rdsim.SimulatedSupply(2)])
+        self.simulator.start()
+        self.bus_timing = modbusrtu.BusTiming()
+
+    def tearDown(self):
+        self.simulator.shutdown()
+
+    def _Open(self, address):
+        # type: (int) -> RD6006
+        return RD6006(self.simulator.port, address, bus_timing=self.bus_timing)
+
+    def test_second_slave_keeps_tuned_timeout(self):
+        first = self._Open(1)
+        try:
+            serial = first.instrument.serial
+            self.bus_timing.timeouts[2] = 0.3
+            first.tune_timeout(3)
+            self.assertEqual(serial.timeout, 0.3)
+            second = self._Open(2)
+            self.assertIs(second.instrument.serial, serial)
+            self.assertEqual(serial.timeout, 0.3)
+            # tuning the second doesn't cut the first's timeout short
+            self.bus_timing.timeouts[1] = 0.4
+            second.tune_timeout(3)
+            self.assertEqual(serial.timeout, 0.4)
+        finally:
+            first.instrument.serial.close()
+
+    def test_fresh_connection_resets_timeout(self):
+        first = self._Open(1)
+        first.tune_timeout(3)
+        first.instrument.serial.close()
+        self.bus_timing.timeouts[2] = 0.3
+        again = self._Open(1)
+        try:
+            self.assertEqual(again.instrument.serial.timeout, RD6006.DEFAULT_TIMEOUT)
+            self.assertEqual(self.bus_timing.timeouts, {})
+        finally:
+            again.instrument.serial.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""SampleStore and its min/max pyramid.
+
+    $ python -m unittest discover tests
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import samplestore
+from samplestore import A, T, V, SampleStore
+
+
+def _fill(store, n, interval=0.01, t0=0.):
+    # type: (SampleStore, int, float, float) -> np.ndarray
+    """Append n samples of a known waveform; return them as (t, V, A)."""
+    t = t0 + np.arange(n) * interval
+    v = np.sin(t)
+    a = np.cos(t)
+    for row in zip(t, v, a):
+        store.append(*row)
+    return np.vstack((t, v, a))
+
+
+class SampleStoreTest(unittest.TestCase):
+    def test_grows_past_chunk(self):
+        store = SampleStore(1000., chunk=64, decimate=False)
+        expected = _fill(store, 1000)
+        self.assertEqual(store.seq, 1000)
+        np.testing.assert_array_equal(store.snapshot(), expected)
+
+    def test_reallocation_keeps_window(self):
+        # old samples age out while the array fills, so reallocation has
+        # to copy the retained window to the front instead of wrapping
+        store = SampleStore(1., chunk=64, decimate=False)
+        expected = _fill(store, 5000)
+        snapshot = store.snapshot()
+        self.assertLessEqual(snapshot.shape[1], 101)
+        np.testing.assert_array_equal(snapshot, expected[:, -snapshot.shape[1]:])
+        self.assertGreaterEqual(snapshot[T, 0], expected[T, -1] - 1.)
+        # capacity stays bounded by the window, not the history
+        self.assertLessEqual(store._published[0].shape[1], 4 * 64)
+
+    def test_published_views_are_stable(self):
+        store = SampleStore(1., chunk=64, decimate=False)
+        _fill(store, 50)
+        view = store.snapshot()
+        copy = view.copy()
+        _fill(store, 5000, t0=1.)
+        np.testing.assert_array_equal(view, copy)
+        self.assertFalse(view.flags.writeable)
+
+    def test_retention(self):
+        # exact in binary, so no rounding at the cutoffs
+        store = SampleStore(10., decimate=False)
+        _fill(store, 100, interval=0.25)
+        self.assertEqual(store.snapshot()[T, 0], 14.75)
+        store.set_retention(5.)
+        # applied by the producer on its next append
+        self.assertEqual(len(store), 41)
+        store.append(25., 0., 0.)
+        self.assertEqual(store.snapshot()[T, 0], 20.)
+        # samples that aged out come back while still in the array
+        store.set_retention(10.)
+        store.append(25.25, 0., 0.)
+        self.assertEqual(store.snapshot()[T, 0], 15.25)
+
+    def test_gap(self):
+        store = SampleStore(10., decimate=False)
+        store.append(0., 1., 2.)
+        store.append_gap(0.1)
+        self.assertTrue(np.isnan(store.snapshot()[V:, 1]).all())
+
+
+class PlotDataTest(unittest.TestCase):
+    def test_two_points_per_column(self):
+        store = SampleStore(1000.)
+        _fill(store, 100000)
+        for width in (100, 333, 640, 1500):
+            data = store.plot_data(0., 1000., width)
+            # a min/max pair per column, plus one for the samples newer
+            # than the last complete bucket
+            self.assertLessEqual(data.shape[1], 2 * width + 2, width)
+            self.assertGreaterEqual(data.shape[1], 2 * width, width)
+
+    def test_extremes_survive(self):
+        store = SampleStore(1000.)
+        t = np.arange(50000) * 0.01
+        v = np.zeros(len(t))
+        v[12345] = 9.
+        v[40000] = -3.
+        for row in zip(t, v, v):
+            store.append(*row)
+        data = store.plot_data(0., 500., 200)
+        self.assertEqual(np.nanmax(data[V]), 9.)
+        self.assertEqual(np.nanmin(data[A]), -3.)
+        self.assertTrue(np.all(np.diff(data[T]) >= 0))
+
+    def test_few_samples_are_raw(self):
+        store = SampleStore(1000.)
+        expected = _fill(store, 500)
+        np.testing.assert_array_equal(store.plot_data(0., 5., 640), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
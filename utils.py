@@ -3,12 +3,21 @@
 
 from __future__ import print_function
 
+try:
+    from concurrent.futures import Future
+    from typing import Callable
+except:
+    pass
 import itertools
 import numpy as np
-from numpy_ringbuffer import RingBuffer
 import threading
 import types
-import wx
+try:
+    import wx
+except ImportError:
+    # the acquisition core runs headless (see rdlogger) and needs only the
+    # helpers that don't touch wx
+    wx = None
 
 
 def appendlistitem(listctrl, *args):
@@ -25,23 +34,19 @@ def appendlistitem(listctrl, *args):
             listctrl.SetItem(li)
     return pos
 
+def wx_future_callback(future, callback):
+    # type: (Future, Callable[[Future], None]) -> None
+    """Call callback(future) on the main thread once future completes."""
+    future.add_done_callback(lambda f: wx.CallAfter(callback, f))
+
 def emitter(p=0.1):
     """Return a random value in [0, 1) with probability p, else 0."""
     while True:
-        v = np.random.rand(1)
+        v = np.random.rand()
         if v > p:
             yield 0.
         else:
-            yield np.random.rand(1)
-
-def ringbuffer_resize(ringbuffer, newcapacity):
-    # type: (RingBuffer, int) -> RingBuffer
-    newbuffer = RingBuffer(newcapacity, dtype=ringbuffer.dtype)
-    n = min(newcapacity, len(ringbuffer))
-    newbuffer._arr[:n] = ringbuffer[-n:]
-    newbuffer._right_index = n
-    newbuffer._left_index = 0
-    return newbuffer
+            yield np.random.rand()
 
 
 class AttributeSetterCtx(object):
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+from __future__ import print_function
+
+import math
+from time import perf_counter
+try:
+    from typing import Callable, Dict, List, Optional, Tuple
+except:
+    pass
+
+import numpy as np
+import wx
+
+import acquisition
+import metrics
+
+
+# matplotlib's default colour cycle, so both backends look alike
+COLORS = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+          '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf')
+FIRST_AMPERAGE_COLOR = wx.Colour(0x80, 0, 0, 0x80)
+
+
+def nice_ticks(lo, hi, max_ticks):
+    # type: (float, float, int) -> List[float]
+    """Round-numbered ticks (1, 2 or 5 times a power of ten) in [lo, hi]."""
+    span = hi - lo
+    if span <= 0 or max_ticks < 1:
+        return []
+    raw = span / max_ticks
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for step in (1, 2, 5, 10):
+        if step * magnitude >= raw:
+            break
+    step *= magnitude
+    first = math.ceil(lo / step)
+    return [i * step for i in range(int(first), int(math.floor(hi / step)) + 1)]
+
+
+class WxStripChart(object):
+    """Lightweight drop-in for stripchart.StripChart drawn with wx alone.
+
+    Axes, grid and labels are rendered once into a cached bitmap; each
+    frame blits it and strokes the traces, whose points are mapped to
+    pixels with a few vectorized numpy operations.  Frames follow the
+    same rules as StripChart: a capped wx.Timer, skipped while hidden or
+    when nothing moved by a pixel, and scrolling back into history with
+    the mouse wheel.
+    """
+
+    MAX_FRAME_RATE = 25
+    SCROLL_STEP = 0.1
+    # space for tick labels around the plot area, in pixels
+    MARGIN_LEFT = 48
+    MARGIN_RIGHT = 56
+    MARGIN_TOP = 8
+    MARGIN_BOTTOM = 36
+
+    def __init__(self, parent, graph_seconds, voltage_range, amperage_range):
+        # type: (wx.Window, float, float, float) -> None
+        super(WxStripChart, self).__init__()
+        self.parent = parent
+        self.cursor_callback = None # type: Optional[Callable[[Optional[Tuple[float, float, float]]], None]]
+        self.frame_callback = None # type: Optional[Callable[[], None]]
+        self.frame_time = metrics.registry.histogram("render/frame")
+        self.history = None # type: Optional[Callable[[acquisition.Device, float, float, float], Optional[np.ndarray]]]
+        self._view_end = None # type: Optional[float]
+        # device -> [V pen, A pen, store seq last fetched, (t, V, A) rows]
+        self.traces = {} # type: Dict[acquisition.Device, list]
+        self.graph_seconds = graph_seconds
+        self.voltage_range = voltage_range
+        self.amperage_range = amperage_range
+        self._background = None # type: wx.Bitmap
+        self._drawn_at = None # type: float
+
+        self.window = wx.Window(parent, wx.ID_ANY, size=(640, 480))
+        self.window.SetBackgroundStyle(wx.BG_STYLE_PAINT)
+        self.window.Bind(wx.EVT_PAINT, self._OnPaint)
+        self.window.Bind(wx.EVT_SIZE, self._OnSize)
+        self.window.Bind(wx.EVT_MOTION, self._OnMotion)
+        self.window.Bind(wx.EVT_LEAVE_WINDOW, self._OnMotion)
+        self.window.Bind(wx.EVT_MOUSEWHEEL, self._OnMouseWheel)
+
+        self.timer = wx.Timer(self.window)
+        self.window.Bind(wx.EVT_TIMER, self._OnTimer, self.timer)
+
+    def start(self):
+        self.timer.Start(int(1000 / self.MAX_FRAME_RATE))
+
+    def stop(self):
+        self.timer.Stop()
+
+    def add_trace(self, device):
+        # type: (acquisition.Device) -> None
+        i = len(self.traces)
+        color = wx.Colour(COLORS[i % len(COLORS)])
+        vpen = wx.Pen(color, 1)
+        if i == 0:
+            apen = wx.Pen(FIRST_AMPERAGE_COLOR, 1)
+        else:
+            apen = wx.Pen(wx.Colour(color.Red(), color.Green(), color.Blue(), 0x80), 1, wx.PENSTYLE_SHORT_DASH)
+        self.traces[device] = [vpen, apen, None, None]
+        self._Invalidate()
+
+    def remove_trace(self, device):
+        # type: (acquisition.Device) -> None
+        del self.traces[device]
+        self._Invalidate()
+
+    def configure(self, graph_seconds=None, voltage_range=None, amperage_range=None):
+        # type: (float, float, float) -> None
+        if graph_seconds is not None:
+            self.graph_seconds = graph_seconds
+        if voltage_range is not None:
+            self.voltage_range = voltage_range
+        if amperage_range is not None:
+            self.amperage_range = amperage_range
+        for trace in self.traces.values():
+            trace[2] = None
+        self._Invalidate()
+
+    @property
+    def scrollback(self):
+        # type: () -> float
+        if self._view_end is None:
+            return 0.
+        return perf_counter() - self._view_end
+
+    def scroll_to(self, scrollback):
+        # type: (float) -> None
+        self._view_end = perf_counter() - scrollback if scrollback > 0 else None
+        for trace in self.traces.values():
+            trace[2] = None
+        self.window.Refresh(False)
+
+    def _Invalidate(self):
+        """Rebuild the axes bitmap on the next paint."""
+        self._background = None
+        self._drawn_at = None
+        self.window.Refresh(False)
+
+    def _PlotRect(self):
+        # type: () -> wx.Rect
+        width, height = self.window.GetClientSize()
+        return wx.Rect(self.MARGIN_LEFT, self.MARGIN_TOP,
+                       max(width - self.MARGIN_LEFT - self.MARGIN_RIGHT, 1),
+                       max(height - self.MARGIN_TOP - self.MARGIN_BOTTOM, 1))
+
+    def _OnSize(self, evt):
+        # type: (wx.SizeEvent) -> None
+        self._Invalidate()
+        evt.Skip()
+
+    def _OnTimer(self, evt):
+        # type: (wx.TimerEvent) -> None
+        top = wx.GetTopLevelParent(self.window)
+        if not self.window.IsShownOnScreen() or top.IsIconized():
+            return
+        now = perf_counter()
+        live = self._view_end is None
+        view = now if live else self._view_end
+        rect = self._PlotRect()
+        dirty = self._drawn_at is None or (live and (now - self._drawn_at) * rect.width >= self.graph_seconds)
+        for device, trace in self.traces.items():
+            # a scrolled-back view is fetched once
+            seq = device.samples.seq if live else -1
+            if seq == trace[2]:
+                continue
+            trace[3] = self._PlotData(device, view - self.graph_seconds, view, rect.width)
+            trace[2] = seq
+            dirty = True
+        if dirty:
+            self.window.Refresh(False)
+
+    def _PlotData(self, device, t0, t1, width):
+        # type: (acquisition.Device, float, float, float) -> np.ndarray
+        if self._view_end is not None and self.history is not None:
+            data = self.history(device, t0, t1, width)
+            if data is not None:
+                return data
+        return device.samples.plot_data(t0, t1, width)
+
+    def _OnPaint(self, evt):
+        # type: (wx.PaintEvent) -> None
+        now = perf_counter()
+        view = now if self._view_end is None else self._view_end
+        dc = wx.BufferedPaintDC(self.window)
+        if self._background is None:
+            self._background = self._RenderBackground()
+        dc.DrawBitmap(self._background, 0, 0)
+        gc = wx.GraphicsContext.Create(dc)
+        rect = self._PlotRect()
+        gc.Clip(rect.x, rect.y, rect.width, rect.height)
+        sx = rect.width / self.graph_seconds
+        for vpen, apen, _, data in self.traces.values():
+            if data is None or data.shape[1] < 2:
+                continue
+            t, v, a = data
+            x = rect.x + (t - (view - self.graph_seconds)) * sx
+            bottom = rect.y + rect.height
+            for values, scale, pen in ((v, self.voltage_range, vpen), (a, self.amperage_range, apen)):
+                y = bottom - values * (rect.height / scale)
+                gc.SetPen(pen)
+                # NaN samples mark gaps in the data: break the line there
+                gaps = np.flatnonzero(np.isnan(values))
+                for segment in np.split(np.column_stack((x, y)), gaps):
+                    if len(segment) and np.isnan(segment[0, 1]):
+                        segment = segment[1:]
+                    if len(segment) > 1:
+                        gc.StrokeLines(segment.tolist())
+        self._drawn_at = now
+        if self.frame_callback is not None:
+            self.frame_callback()
+        self.frame_time.record(perf_counter() - now)
+
+    def _RenderBackground(self):
+        # type: () -> wx.Bitmap
+        width, height = self.window.GetClientSize()
+        bitmap = wx.Bitmap(max(width, 1), max(height, 1))
+        dc = wx.MemoryDC(bitmap)
+        dc.SetBackground(wx.WHITE_BRUSH)
+        dc.Clear()
+        dc.SetFont(self.window.GetFont())
+        dc.SetTextForeground(wx.BLACK)
+        rect = self._PlotRect()
+        left, top = rect.x, rect.y
+        right, bottom = rect.x + rect.width, rect.y + rect.height
+        _, text_height = dc.GetTextExtent("0")
+        grid = wx.Pen(wx.Colour(0xb0, 0xb0, 0xb0), 1, wx.PENSTYLE_SHORT_DASH)
+
+        dc.SetPen(grid)
+        for t in nice_ticks(-self.graph_seconds, 0, max(rect.width // 80, 1)):
+            x = right + t * rect.width / self.graph_seconds
+            dc.DrawLine(int(x), top, int(x), bottom)
+            label = "{:g}".format(t)
+            dc.DrawText(label, int(x - dc.GetTextExtent(label)[0] / 2), bottom + 3)
+        for v in nice_ticks(0, self.voltage_range, max(rect.height // 40, 1)):
+            y = bottom - v * rect.height / self.voltage_range
+            dc.DrawLine(left, int(y), right, int(y))
+            label = "{:g}".format(v)
+            dc.DrawText(label, left - dc.GetTextExtent(label)[0] - 4, int(y - text_height / 2))
+        for a in nice_ticks(0, self.amperage_range, max(rect.height // 40, 1)):
+            y = bottom - a * rect.height / self.amperage_range
+            dc.SetPen(wx.BLACK_PEN)
+            dc.DrawLine(right, int(y), right + 4, int(y))
+            dc.DrawText("{:g}".format(a), right + 6, int(y - text_height / 2))
+
+        dc.SetPen(wx.BLACK_PEN)
+        dc.SetBrush(wx.TRANSPARENT_BRUSH)
+        dc.DrawRectangle(rect)
+        dc.DrawText("t", left + rect.width // 2, bottom + 3 + text_height)
+        dc.DrawRotatedText("V", 2, top + rect.height // 2, 90)
+        dc.DrawRotatedText("A", width - text_height - 2, top + rect.height // 2, 90)
+
+        # legend, as matplotlib shows it once there is more than one device
+        if len(self.traces) > 1:
+            y = top + 4
+            for device, (vpen, _, _, _) in self.traces.items():
+                dc.SetPen(wx.Pen(vpen.GetColour(), 2))
+                dc.DrawLine(left + 6, y + text_height // 2, left + 26, y + text_height // 2)
+                dc.DrawText(str(device), left + 30, y)
+                y += text_height + 2
+        dc.SelectObject(wx.NullBitmap)
+        return bitmap
+
+    def _OnMotion(self, evt):
+        # type: (wx.MouseEvent) -> None
+        evt.Skip()
+        if self.cursor_callback is None:
+            return
+        rect = self._PlotRect()
+        x, y = evt.GetPosition()
+        if evt.Leaving() or not rect.Contains(x, y):
+            self.cursor_callback(None)
+            return
+        t = (x - rect.x - rect.width) * self.graph_seconds / rect.width - self.scrollback
+        fraction = float(rect.y + rect.height - y) / rect.height
+        self.cursor_callback((t, fraction * self.voltage_range, fraction * self.amperage_range))
+
+    def _OnMouseWheel(self, evt):
+        # type: (wx.MouseEvent) -> None
+        if self.history is None:
+            evt.Skip()
+            return
+        steps = float(evt.GetWheelRotation()) / evt.GetWheelDelta()
+        self.scroll_to(self.scrollback + steps * self.SCROLL_STEP * self.graph_seconds)